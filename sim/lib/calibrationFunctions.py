@@ -11,6 +11,7 @@ import csv
 from datetime import datetime, timedelta
 
 from lib.parallel import *
+from lib.mobilitysettings import load_settings
 
 import gpytorch, torch, botorch, sobol_seq, pandas
 from botorch import fit_gpytorch_model
@@ -384,8 +385,7 @@ def get_unique_calibration_params(*, country, area, multi_beta_calibration, esti
     train_G = state['train_G']
     
     mob_settings = calibration_mob_paths[country][area][0]
-    with open(mob_settings, 'rb') as fp:
-        mob_kwargs = pickle.load(fp)
+    mob_kwargs = load_settings(mob_settings)
     mob = MobilitySimulator(**mob_kwargs)
 
     data_start_date = calibration_start_dates[country][area]
@@ -443,8 +443,7 @@ def get_calibrated_params_limited_iters(country, area, multi_beta_calibration, e
     train_theta = state['train_theta']
 
     mob_settings = calibration_mob_paths[country][area][0]
-    with open(mob_settings, 'rb') as fp:
-        mob_kwargs = pickle.load(fp)
+    mob_kwargs = load_settings(mob_settings)
     mob = MobilitySimulator(**mob_kwargs)
 
     data_start_date = calibration_start_dates[country][area]
@@ -489,17 +488,18 @@ def get_calibrated_params_limited_iters(country, area, multi_beta_calibration, e
     return calibrated_params
 
 
-def downsample_cases(unscaled_area_cases, mob_settings):
+def downsample_cases(unscaled_area_cases, mob_settings, downsample=1):
     """
     Generates downsampled case counts based on town and area for a given 2d `cases` array.
     Scaled case count in age group a at time t is
 
-    scaled[t, a] = cases-area[t, a] * (town population / area population)
+    scaled[t, a] = cases-area[t, a] * (town population / area population) / downsample
 
+    where `downsample` is the factor of settings downsampled on load (see `lib.mobilitysettings.load_settings`).
     """
 
     unscaled_sim_cases = np.round(unscaled_area_cases * \
-        (mob_settings['num_people_unscaled'] / mob_settings['region_population']))
+        (mob_settings['num_people_unscaled'] / mob_settings['region_population']) / downsample)
     
     return unscaled_sim_cases
 
@@ -628,8 +628,7 @@ def make_bayes_opt_functions(args):
     mob_settings = args.mob or calibration_mob_paths[data_country][data_area][0 if args.downscale_mobility_model else 1] 
 
     # initialize mobility object to obtain information (no trace generation yet)
-    with open(mob_settings, 'rb') as fp:
-        mob_kwargs = pickle.load(fp)
+    mob_kwargs = load_settings(mob_settings)
     mob = MobilitySimulator(**mob_kwargs)
     
     # data settings
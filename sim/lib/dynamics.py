@@ -16,9 +16,18 @@ from collections import Counter
 
 from lib.priorityqueue import PriorityQueue
 from lib.measures import * 
+from lib.mobilitysim import contact_tuples, ContactArrays
 
 TO_HOURS = 24.0
 
+# measures whose containment of a visit is decided at `init_run` and does not depend on the state of the epidemic
+STATIC_VISIT_MEASURES = (SocialDistancingForAllMeasure, SocialDistancingBySiteTypeForAllMeasure, SocialDistancingByAgeMeasure)
+
+# measures keeping people at home from visits whose containment depends on the state of the epidemic
+DYNAMIC_VISIT_MEASURES = (SocialDistancingForPositiveMeasure, SocialDistancingForSmartTracing,
+                          SocialDistancingSymptomaticAfterSmartTracing, SocialDistancingForKGroups,
+                          UpperBoundCasesSocialDistancing)
+
 class DiseaseModel(object):
     """
     Simulate continuous-time SEIR epidemics with exponentially distributed inter-event times.
@@ -62,7 +71,7 @@ class DiseaseModel(object):
         self.num_site_types = mob.num_site_types
         
         self.people_household = mob.people_household  # j-th entry is household index of individual j
-        self.households = mob.households              # {household index: [individuals in household]}
+        self.has_households = mob.household_ptr is not None  # household members are `mob.household_members(j)`
             
         assert(self.num_age_groups == self.fatality_rates_by_age.shape[0])
         assert(self.num_age_groups == self.p_hospital_by_age.shape[0])
@@ -376,13 +385,17 @@ class DiseaseModel(object):
 
         return f
 
-    def launch_epidemic(self, params, initial_counts, testing_params, measure_list, thresholds_roc=[], verbose=True):
+    def launch_epidemic(self, params, initial_counts, testing_params, measure_list, thresholds_roc=[], verbose=True,
+                        well_mixed_occupancy=None):
         """
         Run the epidemic, starting from initial event list.
         Events are treated in order in a priority queue. An event in the queue is a tuple
         the form
             `(time, event_type, node, infector_node, location, metadata)`
 
+        If `well_mixed_occupancy` is given, sites with at least this many concurrent visitors on average
+        (see `well_mixed_sites`) are treated as well-mixed: exposures there are sampled for all visitors at once
+        from the hazard of the infector's presence at the site instead of pair by pair (see `__push_well_mixed_exposure_events`).
         """
         self.verbose = verbose
         self.thresholds_roc = thresholds_roc
@@ -519,6 +532,24 @@ class DiseaseModel(object):
                                    n_people=self.n_people,
                                    n_visits=max(self.mob.visit_counts))
 
+        # visits skipped throughout due to measures decided upfront are not enumerated as contacts at all
+        # (their exposures would be rejected by `is_person_home_from_visit_due_to_measure` anyway)
+        if any(self.measure_list.find_first(measure_type) is not None for measure_type in STATIC_VISIT_MEASURES):
+            self.mob.set_removed_visits(self.removed_visits_due_to_static_measures)
+        else:
+            self.mob.set_removed_visits(None)
+
+        # household exposures are sampled on the time both members are at home, where visits during which
+        # a measure may keep the person at home count as time at home (and are thinned at exposure time)
+        if self.has_households and self.beta_household > 0 and getattr(self.mob, 'window', None) is None:
+            self.household_copresence = self.mob.copresence_index(
+                away=self.visits_away_from_home_despite_measures(self.mob.visits))
+        else:
+            self.household_copresence = None
+
+        # sites where exposures are sampled from the aggregate hazard of the infector's presence
+        self.well_mixed_site = self.well_mixed_sites(well_mixed_occupancy) if well_mixed_occupancy is not None else None
+
         # Store the original beta values
         self.betas_weighted_mean = sum([
             self.betas[self.site_dict[k]]
@@ -580,6 +611,13 @@ class DiseaseModel(object):
             ht = h * self.testing_frequency
             self.queue.push((ht, 'execute_tests', None, None, None, None), priority=ht)
 
+        # infection hotspot statistics: every 14 days, for a 7-day window, until the end of the simulation
+        self.visit_expo_counts = dict()
+        self.hotspot_intervals_pending = self.__hotspot_intervals(slider_size=14 * 24.0, window_size=24.0 * 7, end_cutoff=0.0)
+
+        # mobility simulated in streaming mode is advanced along with the event clock
+        streaming_mobility = getattr(self.mob, 'window', None) is not None
+
         # MAIN EVENT LOOP
         t = 0.0
         while self.queue:
@@ -587,6 +625,9 @@ class DiseaseModel(object):
             # get next event to process
             t, event, i, infector, k, metadata = self.queue.pop()
 
+            if streaming_mobility:
+                self.__advance_mobility(t)
+
             # check if testing processing
             if event == 'execute_tests':
                 self.__update_testing_queue(t)
@@ -631,8 +672,8 @@ class DiseaseModel(object):
                     infector_away_from_home = False
                     i_away_from_home = False
 
-                    infector_visits = self.mob.mob_traces_by_indiv[infector].find((t, t))
-                    i_visits = self.mob.mob_traces_by_indiv[i].find((t, t))
+                    infector_visits = self.mob.find_visits_of_indiv(infector, t, t)
+                    i_visits = self.mob.find_visits_of_indiv(i, t, t)
 
                     for v in infector_visits:
                         infector_away_from_home = \
@@ -783,9 +824,19 @@ class DiseaseModel(object):
                                 (self.delta_isym_to_dead[infector] if self.bernoulli_is_fatal[infector] else self.delta_isym_to_resi[infector]))
 
                         # sample exposure at later point
-                        if t < tmax:
+                        # (at well-mixed sites, only during the remainder of this contact,
+                        # since exposures during later contacts were sampled independently)
+                        if t < tmax and self.well_mixed_site is not None and self.well_mixed_site[k]:
+                            self.__push_well_mixed_exposure_events(
+                                t=t, infector=infector, base_rate=base_rate_infector, tmax=tmax,
+                                contacts=ContactArrays(
+                                    t_from=np.array([contact.t_from]), t_to=np.array([contact.t_to]),
+                                    indiv_i=np.array([i]), indiv_j=np.array([infector]), site=np.array([k]),
+                                    id_i=np.array([i_visit_id]), id_j=np.array([infector_visit_id]),
+                                    t_to_direct=np.array([contact.t_to_direct])))
+                        elif t < tmax:
                             self.__push_contact_exposure_infector_to_j(
-                                t=t, infector=infector, j=i, base_rate=base_rate_infector, tmax=tmax)                 
+                                t=t, infector=infector, j=i, base_rate=base_rate_infector, tmax=tmax)
 
             elif event == 'ipre':
                 self.__process_presymptomatic_event(t, i)
@@ -825,8 +876,9 @@ class DiseaseModel(object):
         # print('% exposed in risk buckets: ', 100.0 * self.risk_got_exposed / (self.risk_got_exposed + self.risk_got_not_exposed))
 
         '''Compute infection hotspot statistics'''
-        # every 14 days, for a 7-day window, until the end of the simulation
-        self.visit_expo_counts = self.compute_infection_hotspot_stats(slider_size=14 * 24.0, window_size=24.0 * 7, end_cutoff=0.0)
+        # in streaming mode, windows completed before the end were already computed (see `__advance_mobility`)
+        self.visit_expo_counts.update(self.__compute_infection_hotspot_stats_of_intervals(self.hotspot_intervals_pending))
+        self.hotspot_intervals_pending = []
    
         '''Compute ROC statistics'''
         # tracing_stats [threshold][policy][action][stat]
@@ -845,6 +897,8 @@ class DiseaseModel(object):
         # free memory
         self.valid_contacts_for_tracing = None
         self.queue = None
+        self.household_copresence = None
+        self.mob.set_removed_visits(None)
 
 
     def compute_infection_hotspot_stats(self, *, slider_size, window_size, end_cutoff):
@@ -853,12 +907,20 @@ class DiseaseModel(object):
         Returns:
             dict: (t0, t1) -> count array of exposures caused by each visit of an infectious individual in (t0, t1)
         '''
+        return self.__compute_infection_hotspot_stats_of_intervals(
+            self.__hotspot_intervals(slider_size=slider_size, window_size=window_size, end_cutoff=end_cutoff))
 
-        # Build the range of time intervals to count for
+    def __hotspot_intervals(self, *, slider_size, window_size, end_cutoff):
+        '''Returns the list of time intervals (t0, t1) of the infection hotspot statistics'''
         t0_range = np.arange(0.0, self.max_time - window_size - end_cutoff, slider_size)
         t1_range = t0_range + window_size
-        interval_range = list(zip(t0_range, t1_range))
+        return list(zip(t0_range, t1_range))
 
+    def __compute_infection_hotspot_stats_of_intervals(self, interval_range):
+        '''
+        Counts the number of exposures caused per infectious visit in each time interval (t0, t1) of `interval_range`
+        (see `compute_infection_hotspot_stats`)
+        '''
         # Collect infector visit id of each contact exposure in the simulation
         visit_exposure_count = Counter()
         for j in range(self.n_people):
@@ -871,7 +933,7 @@ class DiseaseModel(object):
         total_expo_counts = dict()
         for t0, t1 in interval_range:
             expo_counts = []
-            for visit in self.mob.mob_traces.find((t0, t1)):
+            for visit in self.mob.find_visits(t0, t1):
                 t = visit.t_from
                 if t < t0:
                     continue 
@@ -900,6 +962,26 @@ class DiseaseModel(object):
         return total_expo_counts
 
 
+    def __advance_mobility(self, t):
+        '''
+        Advances the mobility simulated in streaming mode to time `t`.
+        Computes the infection hotspot statistics of completed windows and 
+        lets the mobility simulator drop visits no longer needed, i.e. visits ending before
+        the look-back of contact tracing and exposures and before pending hotspot windows.
+        '''
+        # hotspot window is completed once all visits starting in the window ended
+        completed = [(t0, t1) for t0, t1 in self.hotspot_intervals_pending
+                     if t > t1 + self.mob.visits.max_span]
+        if completed:
+            self.visit_expo_counts.update(self.__compute_infection_hotspot_stats_of_intervals(completed))
+            self.hotspot_intervals_pending = self.hotspot_intervals_pending[len(completed):]
+
+        keep_from = t - max(self.smart_tracing_contact_delta, self.delta)
+        if self.hotspot_intervals_pending:
+            keep_from = min(keep_from, self.hotspot_intervals_pending[0][0])
+
+        self.mob.advance(t, keep_from=keep_from)
+
     def compute_roc_stats(self, *, threshold_isolate, threshold_test):
         '''        
         Recovers contacts for which trace/no-trace decision was made.
@@ -1131,7 +1213,7 @@ class DiseaseModel(object):
             self.__push_contact_exposure_events(t=t, infector=i, base_rate=1.0, tmax=tmax)
             
             # household exposures
-            if self.households is not None and self.beta_household > 0:
+            if self.has_households and self.beta_household > 0:
                 self.__push_household_exposure_events(t=t, infector=i, base_rate=1.0, tmax=tmax)
 
     def __process_symptomatic_event(self, t, i, apply_for_test=True):
@@ -1194,7 +1276,7 @@ class DiseaseModel(object):
             self.__push_contact_exposure_events(t=t, infector=i, base_rate=self.mu, tmax=t + self.delta_iasy_to_resi[i])
             
             # household exposures
-            if self.households is not None and self.beta_household > 0:
+            if self.has_households and self.beta_household > 0:
                 self.__push_household_exposure_events(t=t, infector=i, base_rate=self.mu, tmax=t + self.delta_iasy_to_resi[i])
 
     def __process_resistant_event(self, t, i):
@@ -1223,6 +1305,9 @@ class DiseaseModel(object):
             self.state['hosp'][i] = False
             self.state_ended_at['hosp'][i] = t
 
+        # contacts of `i` cannot cause exposures anymore
+        self.mob.contacts.release(i)
+
     def __process_fatal_event(self, t, i):
         """
         Mark person `i` as fatality at time `t`
@@ -1240,6 +1325,9 @@ class DiseaseModel(object):
         if self.state['hosp'][i]:
             self.state['hosp'][i] = False
             self.state_ended_at['hosp'][i] = t
+
+        # contacts of `i` cannot cause exposures anymore
+        self.mob.contacts.release(i)
     
     def __process_hosp_event(self, t, i):
         """
@@ -1270,13 +1358,18 @@ class DiseaseModel(object):
         # compute all delta-contacts of `infector` with any other individual
         infectors_contacts = self.mob.find_contacts_of_indiv(indiv=infector, tmin=t, tmax=tmax)
 
-        # iterate over contacts and store contact of with each individual `indiv_i` that is still susceptible 
-        valid_contacts = set()
-        for contact in infectors_contacts:
-            if self.state['susc'][contact.indiv_i]:
-                if contact not in self.mob.contacts[contact.indiv_i][infector]:
-                    self.mob.contacts[contact.indiv_i][infector].update([contact])
-                valid_contacts.add(contact.indiv_i)
+        # store contacts with each individual `indiv_i` that is still susceptible
+        is_susc = self.state['susc'][infectors_contacts.indiv_i]
+
+        # contacts at well-mixed sites are not stored, their exposure events are sampled at once
+        if self.well_mixed_site is not None:
+            is_well_mixed = self.well_mixed_site[infectors_contacts.site]
+            self.__push_well_mixed_exposure_events(t=t, infector=infector, base_rate=base_rate, tmax=tmax,
+                contacts=infectors_contacts, idx=np.flatnonzero(is_susc & is_well_mixed))
+            is_susc &= ~is_well_mixed
+
+        indiv_i = self.mob.contacts.add(infector, infectors_contacts, idx=np.flatnonzero(is_susc))
+        valid_contacts = set(indiv_i.tolist())
 
         # generate potential exposure event for `j` from contact with `infector`
         for j in valid_contacts:
@@ -1367,6 +1460,78 @@ class DiseaseModel(object):
         #     self.risk_got_not_exposed[bucket] += 1
             
             
+    def well_mixed_sites(self, occupancy, t1=7 * TO_HOURS):
+        '''
+        Returns boolean array indicating the sites with a mean number of at least `occupancy` concurrent
+        visitors during the hours they are visited, estimated from the mobility traces in [0, `t1`]
+        '''
+        t1 = min(t1, self.max_time)
+        person_hours = self.mob.site_occupancy(1.0, 0.0, t1, sparse=True).person_hours
+        visited_hours = np.asarray((person_hours > 0).sum(axis=1)).ravel()
+        mean_occupancy = np.asarray(person_hours.sum(axis=1)).ravel() / np.maximum(visited_hours, 1)
+        return mean_occupancy >= occupancy
+
+    def __integrated_presence_kernel(self, tau, inf_from, inf_to):
+        '''Computes the exposure rate (per unit of beta and base rate) integrated over [inf_from, tau]
+        of a visitor staying at the site visited by an infector during [inf_from, inf_to], i.e. the integral of
+        gamma * exp(- gamma * (s - u)) over u in [s - delta, s] intersected with [inf_from, inf_to] and s in [inf_from, tau]
+        (vectorized over all arguments)
+        '''
+        tau = np.clip(tau, inf_from, inf_to + self.delta)
+        stay = np.minimum(tau, inf_to) - inf_from + (1.0 - np.exp(- self.gamma * (np.maximum(tau, inf_to) - inf_to))) / self.gamma
+        arrival = (1.0 - np.exp(- self.gamma * (np.minimum(tau, inf_from + self.delta) - inf_from))) / self.gamma \
+            + np.exp(- self.gamma * self.delta) * np.maximum(tau - inf_from - self.delta, 0.0)
+        return stay - arrival
+
+    def __push_well_mixed_exposure_events(self, *, t, infector, base_rate, tmax, contacts, idx=None):
+        """
+        Pushes the exposure events that person `infector` causes via the contacts `idx` (default: all)
+        of `ContactArrays` `contacts` at well-mixed sites, using `base_rate` as basic infectivity of `infector`.
+
+        At a site, the exposure rate of every visitor is given by the presence of the infector at the site,
+        so the exposures of all visitors are sampled at once from the integrated rate during their contacts
+        (by inversion, without thinning). Contacts are independent, hence every contact pushes its own event;
+        events of individuals exposed earlier are discarded when processed.
+        """
+        idx = np.arange(len(contacts.t_from)) if idx is None else idx
+        if len(idx) == 0:
+            return
+
+        # visit windows of the infector causing the contacts
+        inf_visits = {v.id: (v.t_from, v.t_to) for v in self.mob.find_visits_of_indiv(infector, t, tmax)}
+        inf_from, inf_to = np.array([inf_visits[int(k)] for k in contacts.id_j[idx]]).reshape(-1, 2).T
+
+        # integrated rate during the contacts after `t`
+        t_end = min(tmax, self.max_time)
+        lower = np.maximum(contacts.t_from[idx], t)
+        upper = np.maximum(np.minimum(contacts.t_to[idx], t_end), lower)
+        beta = np.array([self.betas[self.site_dict[self.site_type[k]]] for k in contacts.site[idx]]) * base_rate
+        integral_lower = self.__integrated_presence_kernel(lower, inf_from, inf_to)
+        integral = self.__integrated_presence_kernel(upper, inf_from, inf_to) - integral_lower
+
+        # exposure iff the first arrival of a unit rate process happens before the end of the contact
+        arrival = np.random.exponential(size=len(idx)) / beta
+        exposed = np.flatnonzero(arrival < integral)
+        if len(exposed) == 0:
+            return
+
+        # invert the integrated rate by bisection to obtain the exposure times
+        target = integral_lower[exposed] + arrival[exposed]
+        a, b = lower[exposed], upper[exposed]
+        for _ in range(50):
+            mid = 0.5 * (a + b)
+            below = self.__integrated_presence_kernel(mid, inf_from[exposed], inf_to[exposed]) < target
+            a = np.where(below, mid, a)
+            b = np.where(below, b, mid)
+
+        for tau, contact in zip(b.tolist(), contact_tuples(contacts, idx=idx[exposed])):
+            if tau >= t_end:
+                continue
+            self.queue.push(
+                (tau, 'expo', contact.indiv_i, infector, contact.site,
+                contact), # meta info: contact causing infection
+                priority=tau)
+
     def __push_household_exposure_events(self, *, t, infector, base_rate, tmax):
         """
         Pushes all exposure events that person `i` causes
@@ -1377,7 +1542,7 @@ class DiseaseModel(object):
         def valid_j():
             '''Generates indices j where `infector` is present
             at least `self.delta` hours before j '''
-            for j in self.households[self.people_household[infector]]:
+            for j in self.mob.household_members(infector).tolist():
                 if self.state['susc'][j]:
                     yield j
 
@@ -1393,10 +1558,18 @@ class DiseaseModel(object):
 
         We ignore the kernel for households infections since households members
         will overlap for long periods of time at home
+
+        If available, the exposure time is sampled directly on the time both are at home
+        (see `CopresenceIndex`), so no candidate times are rejected for being away from home
+        except during visits from which a measure may keep them at home
         """
 
         lambda_household = self.beta_household * base_rate * self.__kernel_term(- self.delta, 0.0, 0.0)
-        tau = t + np.random.exponential(scale=1.0 / lambda_household)
+        if self.household_copresence is not None:
+            tau = self.household_copresence.next_copresence(
+                infector, j, t, np.random.exponential(scale=1.0 / lambda_household))
+        else:
+            tau = t + np.random.exponential(scale=1.0 / lambda_household)
 
         # site = -1 means it is a household infection
         # thinning is done at exposure time if needed
@@ -1433,6 +1606,51 @@ class DiseaseModel(object):
         rejection_prob = 1.0 - acceptance_prob
         return rejection_prob
     
+    def removed_visits_due_to_static_measures(self, visits):
+        '''
+        Returns boolean array indicating the visits of `VisitStore` `visits` that are skipped
+        at all times of the visit (including `delta`) due to measures whose outcome is decided 
+        at `init_run`, i.e. for which `is_person_home_from_visit_due_to_measure` is True
+        for every contact during the visit
+        '''
+        t0, t1 = visits.t_from, visits.t_to_shifted
+        site_type_names = np.array([self.site_dict[k] for k in range(self.num_site_types)])
+        removed = (
+            self.measure_list.is_contained_during(
+                SocialDistancingForAllMeasure, t0=t0, t1=t1,
+                j=visits.indiv, j_visit_id=visits.id) |
+            self.measure_list.is_contained_during(
+                SocialDistancingBySiteTypeForAllMeasure, t0=t0, t1=t1,
+                j=visits.indiv, j_visit_id=visits.id, site_type=site_type_names[self.site_type[visits.site]]) |
+            self.measure_list.is_contained_during(
+                SocialDistancingByAgeMeasure, t0=t0, t1=t1,
+                age=self.people_age[visits.indiv], j_visit_id=visits.id)
+        )
+        return removed
+
+    def visits_away_from_home_despite_measures(self, visits):
+        '''
+        Returns boolean array indicating the visits of `VisitStore` `visits` during which the person
+        is away from home at all times of the visit (excluding `delta`) regardless of the course of the epidemic,
+        i.e. for which `is_person_home_from_visit_due_to_measure` is False at all times
+        '''
+        t0, t1 = visits.t_from, visits.t_to
+        site_type_names = np.array([self.site_dict[k] for k in range(self.num_site_types)])
+        maybe_home = (
+            self.measure_list.may_be_contained_during(
+                SocialDistancingForAllMeasure, t0=t0, t1=t1,
+                j=visits.indiv, j_visit_id=visits.id) |
+            self.measure_list.may_be_contained_during(
+                SocialDistancingBySiteTypeForAllMeasure, t0=t0, t1=t1,
+                j=visits.indiv, j_visit_id=visits.id, site_type=site_type_names[self.site_type[visits.site]]) |
+            self.measure_list.may_be_contained_during(
+                SocialDistancingByAgeMeasure, t0=t0, t1=t1,
+                age=self.people_age[visits.indiv], j_visit_id=visits.id)
+        )
+        for measure_type in DYNAMIC_VISIT_MEASURES:
+            maybe_home |= self.measure_list.may_be_contained_during(measure_type, t0=t0, t1=t1)
+        return ~maybe_home
+
     def is_person_home_from_visit_due_to_measure(self, t, i, visit_id, site_type):
         '''
         Returns True/False of whether person i stayed at home from visit
@@ -1679,10 +1897,26 @@ class DiseaseModel(object):
             tracing=True,
             p_reveal_visit=self.smart_tracing_p_willing_to_share)
 
+        # check status of both individuals at once for all contacts
+        start_contact = infectors_contacts.t_from
+        j = infectors_contacts.indiv_i
+        has_valid_status = (
+            # i not dead and not hospitalized at time of contact
+            ~(self.state['dead'][i] & (self.state_started_at['dead'][i] <= start_contact)) &
+            ~(self.state['hosp'][i] & (self.state_started_at['hosp'][i] <= start_contact)) &
+
+            # j not dead and not hospitalized at time of contact
+            ~(self.state['dead'][j] & (self.state_started_at['dead'][j] <= start_contact)) &
+            ~(self.state['hosp'][j] & (self.state_started_at['hosp'][j] <= start_contact)) &
+
+            # j not positive at time of tracing
+            ~(self.state['posi'][j] & (self.state_started_at['posi'][j] <= t))
+        )
+
         # filter which contacts were valid in dict keyed by individual
         valid_contacts_with_j = defaultdict(list)
         digitally_traced = defaultdict(list)
-        for contact in infectors_contacts:
+        for contact in contact_tuples(infectors_contacts, idx=np.flatnonzero(has_valid_status)):
             is_valid, is_digitally_traced = self.__is_tracing_contact_valid(t=t, i=i, contact=contact)
             if is_valid:
                 j = contact.indiv_i
@@ -1802,7 +2036,10 @@ class DiseaseModel(object):
 
     def __update_smart_tracing_housholds(self, t, i):
         '''Execute contact tracing actions for _household members_'''
-        for j in self.households[self.people_household[i]]:
+        # synthetic towns have no households
+        if not self.has_households:
+            return
+        for j in self.mob.household_members(i).tolist():
 
             if self.state['dead'][j]:
                 continue
@@ -1887,11 +2124,21 @@ class DiseaseModel(object):
 
                 self.valid_contacts_for_tracing.append((t, infector, contacts))
 
+                # visits of the contacts are queried again in `compute_roc_stats`, 
+                # so they must not be dropped by mobility simulated in streaming mode
+                if getattr(self.mob, 'window', None) is not None:
+                    contacts_all = [c for contacts_j in contacts.values() for c in contacts_j]
+                    self.mob.pin_visits(
+                        indiv=[c.indiv_i for c in contacts_all] + [c.indiv_j for c in contacts_all],
+                        visit_id=[c.id_tup[0] for c in contacts_all] + [c.id_tup[1] for c in contacts_all])
+
 
     def __is_tracing_contact_valid(self, *, t, i, contact):
         """ 
         Compute whether a contact of individual i at time t is valid
         This is called with `i` being the infector.
+        The status of both individuals (dead, hospitalized, positive) is assumed 
+        to be checked beforehand for all contacts at once (see `__update_smart_tracing`).
         """
 
         start_contact = contact.t_from
@@ -1900,29 +2147,6 @@ class DiseaseModel(object):
         j_visit_id, i_visit_id = contact.id_tup
         site_type = self.mob.site_dict[self.mob.site_type[site_id]]
 
-        '''Check status of both individuals'''
-        i_has_valid_status = (
-            # not dead
-            (not (self.state['dead'][i] and self.state_started_at['dead'][i] <= start_contact)) and
-
-            # not hospitalized at time of contact
-            (not (self.state['hosp'][i] and self.state_started_at['hosp'][i] <= start_contact))
-        )
-
-        j_has_valid_status = (
-            # not dead
-            (not (self.state['dead'][j] and self.state_started_at['dead'][j] <= start_contact)) and
-
-            # not hospitalized at time of contact
-            (not (self.state['hosp'][j] and self.state_started_at['hosp'][j] <= start_contact)) and
-
-            # not positive at time of tracing
-            (not (self.state['posi'][j] and self.state_started_at['posi'][j] <= t))
-        )
-
-        if (not i_has_valid_status) or (not j_has_valid_status):
-            return False, None
-        
         '''Check contact tracing channels'''
         # check if i is complaint with digital tracing
         is_i_compliant = self.measure_list.is_compliant(
@@ -14,6 +14,7 @@ from lib.calibrationFunctions import (
     get_calibrated_params, gen_initial_seeds, get_test_capacity, downsample_cases, extract_seeds_from_summary)
 from lib.mobilitysim import MobilitySimulator
 from lib.parallel import launch_parallel_simulations
+from lib.mobilitysettings import load_settings
 from lib.distributions import CovidDistributions
 from lib.data import collect_data_from_df
 from lib.measures import *
@@ -48,7 +49,7 @@ Simulation = namedtuple('Simulation', (
     'full_scale',               # Whether or not simulation is done at full scale
     'measure_list',             # Measure list
     'testing_params',           # Testing params
-    'store_mob',                # Indicator of whether to return and store MobilitySimulator object and measure bernoullis
+    'store_mob',                # Indicator of whether to store references to regenerate the mobility traces (see `ParallelSummary.get_mob`) and measure bernoullis
 
     # Model
     'model_params',             # Model parameters (from calibration)
@@ -59,8 +60,10 @@ Simulation = namedtuple('Simulation', (
     'num_age_groups',           # Number of age groups
     'beacon_config',            # dictionary containing information regarding beacon implementation
     'thresholds_roc',           # threshold values for ROC curve computation
+    'well_mixed_occupancy',     # occupancy above which sites are simulated as well-mixed (exact if None)
+    'mob_downsample',           # factor by which people and sites of the mobility settings are downsampled on load
 
-), defaults=(None, None, None))  # NOTE: `defaults` iterable is applied from back to front, i.e. just `beacon_config` and `thresholds_roc` and `num_age_groups` has a default
+), defaults=(None, None, None, None, None))  # NOTE: `defaults` iterable is applied from back to front, i.e. just `beacon_config` and `thresholds_roc` and `num_age_groups` and `well_mixed_occupancy` and `mob_downsample` have a default
 
 
 Plot = namedtuple('Plot', (
@@ -130,6 +133,24 @@ def process_command_line(return_parser=False):
                         help="flag to turn off mobility reduction")
     parser.add_argument("--continued", action="store_true",
                         help="skips sub-experiments for which summaries already exist")
+    parser.add_argument("--mob_pool_size", type=int,
+                        help="draw mobility of each random repeat from a fixed pool of this many realizations")
+    parser.add_argument("--mob_cache_dir", type=str,
+                        help="directory of on-disk cache of mobility realizations of the pool")
+    parser.add_argument("--mob_cache_max_gb", type=float,
+                        help="maximum size of mobility cache in GB (least recently used realizations are evicted)")
+    parser.add_argument("--mob_shared", action="store_true",
+                        help="simulate the mobility pool once and share it with all workers via shared memory")
+    parser.add_argument("--mob_chunk_dir", type=str,
+                        help="simulate mobility out-of-core, writing visits to chunks in this directory")
+    parser.add_argument("--mob_memory_budget_gb", type=float,
+                        help="maximum size of out-of-core mobility chunks kept in memory per worker in GB")
+    parser.add_argument("--mob_batch", action="store_true",
+                        help="generate mobility traces in batch per stratum (faster, but differ from the default traces of the same seed)")
+    parser.add_argument("--well_mixed_occupancy", type=float,
+                        help="sample exposures at sites with at least this mean occupancy from their aggregate hazard")
+    parser.add_argument("--downsample", type=int,
+                        help="preview run with people and sites of the town downsampled by this factor on load")
     if return_parser:
         return parser
 
@@ -172,7 +193,16 @@ class Experiment(object):
         cpu_count=None,
         multi_beta_calibration=False,
         condensed_summary=True,
-        continued_run=False):
+        continued_run=False,
+        mob_pool_size=None,
+        mob_cache_dir=None,
+        mob_cache_max_bytes=None,
+        mob_shared=False,
+        mob_chunk_dir=None,
+        mob_memory_budget=None,
+        mob_batch=False,
+        well_mixed_occupancy=None,
+        mob_downsample=None):
 
         self.experiment_info = experiment_info
         self.start_date = start_date
@@ -185,6 +215,25 @@ class Experiment(object):
         self.continued_run = continued_run
         self.verbose = verbose
 
+        # if `mob_pool_size` is given, repeat `r` of every simulation uses mobility realization `r % mob_pool_size`
+        # of a fixed pool, which is cached in `mob_cache_dir` (if given) with LRU eviction beyond `mob_cache_max_bytes`
+        self.mob_pool_size = mob_pool_size
+        self.mob_cache_dir = mob_cache_dir
+        self.mob_cache_max_bytes = mob_cache_max_bytes
+        # if `mob_shared`, the pool is simulated once and shared by all workers (see `launch_parallel_simulations`)
+        self.mob_shared = mob_shared
+        # if `mob_chunk_dir` is given, mobility is simulated out-of-core with at most `mob_memory_budget` bytes
+        # of visits in memory per worker (see `MobilitySimulator.simulate`)
+        self.mob_chunk_dir = mob_chunk_dir
+        self.mob_memory_budget = mob_memory_budget
+        # if `mob_batch`, mobility traces are generated in batch per stratum (see `MobilitySimulator.simulate`)
+        self.mob_batch = mob_batch
+        # if `well_mixed_occupancy` is given, it is the default of all simulations added (see `DiseaseModel.launch_epidemic`)
+        self.well_mixed_occupancy = well_mixed_occupancy
+        # if `mob_downsample` is given, the mobility settings of all simulations are downsampled on load by this factor,
+        # as are case counts and initial seeds (see `lib.mobilitysettings.downsample_settings`)
+        self.mob_downsample = mob_downsample
+
         # list simulations of experiment
         self.sims = []
 
@@ -228,7 +277,8 @@ class Experiment(object):
         beacon_config=None,
         thresholds_roc=None,
         estimate_mobility_reduction=False,
-        store_mob=False):
+        store_mob=False,
+        well_mixed_occupancy=None):
 
         # Set time window based on experiment start and end date
         sim_days = (pd.to_datetime(self.end_date) - pd.to_datetime(self.start_date)).days
@@ -245,8 +295,7 @@ class Experiment(object):
 
         # Load mob settings        
         mob_settings_file = calibration_mob_paths[country][area][1 if full_scale else 0]
-        with open(mob_settings_file, 'rb') as fp:
-            mob_settings = pickle.load(fp)
+        mob_settings = load_settings(mob_settings_file, downsample=self.mob_downsample)
 
         num_age_groups = len(mob_settings['mob_rate_per_age_per_type'])
 
@@ -256,7 +305,7 @@ class Experiment(object):
         assert(len(unscaled_area_cases.shape) == 2)
 
         # Scale down cases based on number of people in town and region
-        sim_cases = downsample_cases(unscaled_area_cases, mob_settings)
+        sim_cases = downsample_cases(unscaled_area_cases, mob_settings, downsample=self.mob_downsample or 1)
 
         # Instantiate correct state transition distributions (estimated from literature)
         distributions = CovidDistributions(country=country)
@@ -293,11 +342,23 @@ class Experiment(object):
         else:
             seed_summary_ = load_summary(seed_summary_path)
             seed_day_ = seed_summary_.max_time # take seeds at the end of simulation
-            initial_seeds = extract_seeds_from_summary(
-                seed_summary_, seed_day_, sim_cases)
+            if self.mob_downsample is not None:
+                # the seed summary is typically of the town at full scale: cases are matched at its scale
+                # and the seeds are rescaled to the population of the downsampled town
+                seed_scale_ = seed_summary_.n_people / len(mob_settings['home_loc'])
+                initial_seeds = extract_seeds_from_summary(
+                    seed_summary_, seed_day_, sim_cases * seed_scale_)
+                initial_seeds = {state: int(np.round(count / seed_scale_))
+                                 for state, count in initial_seeds.items()}
+            else:
+                initial_seeds = extract_seeds_from_summary(
+                    seed_summary_, seed_day_, sim_cases)
 
         if set_initial_seeds_to is not None:
             initial_seeds = set_initial_seeds_to
+            if self.mob_downsample is not None:
+                initial_seeds = {state: int(np.round(count / self.mob_downsample))
+                                 for state, count in initial_seeds.items()}
 
         if set_calibrated_params_to is not None:
             calibrated_params = set_calibrated_params_to
@@ -371,6 +432,12 @@ class Experiment(object):
             sim_kwargs['beacon_config'] = beacon_config
         if thresholds_roc is not None:
             sim_kwargs['thresholds_roc'] = thresholds_roc
+        if well_mixed_occupancy is None:
+            well_mixed_occupancy = self.well_mixed_occupancy
+        if well_mixed_occupancy is not None:
+            sim_kwargs['well_mixed_occupancy'] = well_mixed_occupancy
+        if self.mob_downsample is not None:
+            sim_kwargs['mob_downsample'] = self.mob_downsample
 
         sim = Simulation(**sim_kwargs)
 
@@ -399,8 +466,7 @@ class Experiment(object):
         # run all simulations
         for sim in self.sims:
 
-            with open(sim.mob_settings_file, 'rb') as fp:
-                mob_settings = pickle.load(fp)
+            mob_settings = load_settings(sim.mob_settings_file, downsample=sim.mob_downsample)
         
             summary = launch_parallel_simulations(
                 mob_settings=sim.mob_settings_file,
@@ -420,6 +486,15 @@ class Experiment(object):
                 thresholds_roc=sim.thresholds_roc if sim.thresholds_roc is not None else [],  # convert to [] if None
                 store_mob=sim.store_mob,
                 store_measure_bernoullis=sim.store_mob,
+                mob_pool_size=self.mob_pool_size,
+                mob_cache_dir=self.mob_cache_dir,
+                mob_cache_max_bytes=self.mob_cache_max_bytes,
+                mob_shared=self.mob_shared,
+                mob_chunk_dir=self.mob_chunk_dir,
+                mob_memory_budget=self.mob_memory_budget,
+                mob_batch=self.mob_batch,
+                well_mixed_occupancy=sim.well_mixed_occupancy,
+                mob_downsample=sim.mob_downsample,
                 verbose=False)
 
             if self.condensed_summary is True:
@@ -100,6 +100,22 @@ class SocialDistancingForAllMeasure(Measure):
         """
         is_home_now = self.bernoulli_stay_home[j, j_visit_id]
         return is_home_now and self._in_window(t)
+
+    @enforce_init_run
+    def is_contained_during(self, *, j, j_visit_id, t0, t1):
+        """Indicate for arrays of individuals `j` and visits `j_visit_id` if the measure
+        is respected for the visit at all times in [`t0`, `t1`] (vectorized)
+        """
+        is_home = self.bernoulli_stay_home[j, j_visit_id].astype(bool)
+        return is_home & (t0 >= self.t_window.left) & (t1 < self.t_window.right)
+
+    @enforce_init_run
+    def may_contain_during(self, *, j, j_visit_id, t0, t1):
+        """Indicate for arrays of individuals `j` and visits `j_visit_id` if the measure
+        is respected for the visit at some time in [`t0`, `t1`) (vectorized)
+        """
+        is_home = self.bernoulli_stay_home[j, j_visit_id].astype(bool)
+        return is_home & (t0 < self.t_window.right) & (t1 > self.t_window.left)
     
     @enforce_init_run
     def is_contained_prob(self, *, j, t):
@@ -280,6 +296,28 @@ class SocialDistancingBySiteTypeForAllMeasure(Measure):
         is_home_now = self.bernoulli_stay_home_type[site_type][j, j_visit_id]
         return is_home_now and self._in_window(t)
 
+    @enforce_init_run
+    def is_contained_during(self, *, j, j_visit_id, site_type, t0, t1):
+        """Indicate for arrays of individuals `j`, visits `j_visit_id` and site types `site_type`
+        if the measure is respected for the visit at all times in [`t0`, `t1`] (vectorized)
+        """
+        is_home = np.zeros(len(j_visit_id), dtype=bool)
+        for k, bernoulli_stay_home in self.bernoulli_stay_home_type.items():
+            of_type = site_type == k
+            is_home[of_type] = bernoulli_stay_home[j[of_type], j_visit_id[of_type]].astype(bool)
+        return is_home & (t0 >= self.t_window.left) & (t1 < self.t_window.right)
+
+    @enforce_init_run
+    def may_contain_during(self, *, j, j_visit_id, site_type, t0, t1):
+        """Indicate for arrays of individuals `j`, visits `j_visit_id` and site types `site_type`
+        if the measure is respected for the visit at some time in [`t0`, `t1`) (vectorized)
+        """
+        is_home = np.zeros(len(j_visit_id), dtype=bool)
+        for k, bernoulli_stay_home in self.bernoulli_stay_home_type.items():
+            of_type = site_type == k
+            is_home[of_type] = bernoulli_stay_home[j[of_type], j_visit_id[of_type]].astype(bool)
+        return is_home & (t0 < self.t_window.right) & (t1 > self.t_window.left)
+
     @enforce_init_run
     def is_contained_prob(self, *, j, site_type, t):
         """Returns probability of containment for individual `j` at time `t`
@@ -442,6 +480,22 @@ class SocialDistancingByAgeMeasure(Measure):
         """
         is_home_now = self.bernoulli_stay_home[j_visit_id, age]
         return is_home_now and self._in_window(t)
+
+    @enforce_init_run
+    def is_contained_during(self, *, age, j_visit_id, t0, t1):
+        """Indicate for arrays of ages `age` and visits `j_visit_id` if the measure
+        is respected for the visit at all times in [`t0`, `t1`] (vectorized)
+        """
+        is_home = self.bernoulli_stay_home[j_visit_id, age].astype(bool)
+        return is_home & (t0 >= self.t_window.left) & (t1 < self.t_window.right)
+
+    @enforce_init_run
+    def may_contain_during(self, *, age, j_visit_id, t0, t1):
+        """Indicate for arrays of ages `age` and visits `j_visit_id` if the measure
+        is respected for the visit at some time in [`t0`, `t1`) (vectorized)
+        """
+        is_home = self.bernoulli_stay_home[j_visit_id, age].astype(bool)
+        return is_home & (t0 < self.t_window.right) & (t1 > self.t_window.left)
     
     @enforce_init_run
     def is_contained_prob(self, *, age, t):
@@ -1184,6 +1238,30 @@ class MeasureList:
             return m.is_contained(t=t, **kwargs)
         return False  # No active measure
 
+    def is_contained_during(self, measure_type, t0, t1, **kwargs):
+        """Indicate for arrays of visits with times `t0`, `t1` if any measure of type `measure_type` contains
+        the visit at all times in [`t0`, `t1`] (vectorized). Only for measures whose containment is decided
+        at `init_run`, i.e. does not depend on the state of the epidemic.
+        """
+        contained = np.zeros(len(t0), dtype=bool)
+        for _, _, m in self.measure_dict.get(measure_type, []):
+            contained |= m.is_contained_during(t0=t0, t1=t1, **kwargs)
+        return contained
+
+    def may_be_contained_during(self, measure_type, t0, t1, **kwargs):
+        """Indicate for arrays of visits with times `t0`, `t1` if any measure of type `measure_type` may contain
+        the visit at some time in [`t0`, `t1`) (vectorized). For measures whose containment is decided at `init_run`
+        (implementing `may_contain_during`), this is exact if `kwargs` are given. Otherwise, e.g. for measures
+        depending on the state of the epidemic, every visit overlapping the time window of a measure may be contained.
+        """
+        contained = np.zeros(len(t0), dtype=bool)
+        for _, _, m in self.measure_dict.get(measure_type, []):
+            if kwargs:
+                contained |= m.may_contain_during(t0=t0, t1=t1, **kwargs)
+            else:
+                contained |= (t0 < m.t_window.right) & (t1 > m.t_window.left)
+        return contained
+
     def start_containment(self, measure_type, t, **kwargs):
         m = self.find(measure_type, t)
         if m is not None:
@@ -0,0 +1,431 @@
+"""
+Binary format of mobility settings, i.e. the keyword arguments of `MobilitySimulator` generated by
+`town-generator.ipynb`. Settings are stored as a directory containing one `.npy` file per array
+(e.g. `home_loc`, `tile_site_dist`) and `settings.json` containing the format version and all
+remaining (scalar or dict) settings. Arrays are memory-mapped read-only when loaded, so the pages
+are shared by all processes using the same settings.
+
+Existing pickled settings files `<name>.pk` are converted to the directory `<name>/` next to them by
+
+    python lib/mobilitysettings.py lib/mobility/*.pk
+
+and `load_settings` transparently prefers the converted directory of a `.pk` path.
+"""
+
+import os
+import sys
+import json
+import pickle
+import numpy as np
+from collections import namedtuple
+
+SETTINGS_FORMAT_VERSION = 1
+
+# Sparse representation of `tile_site_dist` keeping only the nearest sites of each type per tile.
+# The sites of type `k` kept for tile `t` are `site[ptr[t, k]:ptr[t, k+1]]`, sorted by distance `dist`.
+SparseTileSiteDist = namedtuple('SparseTileSiteDist', (
+    'ptr',                # (tiles, types + 1) offsets into `site` and `dist`
+    'site',               # Ids of kept sites
+    'dist',               # Distances of kept sites to tile centers
+    'truncation_error',   # (tiles, types) probability mass of the dropped sites under proximity `1/(1+d**2)`
+))
+
+# settings stored as typed arrays; all others have to be json serializable (dicts with int keys are supported)
+SETTINGS_ARRAY_DTYPES = {
+    'home_loc': np.float64,
+    'people_age': np.int64,
+    'people_household': np.int64,
+    'home_tile': np.int64,
+    'site_loc': np.float64,
+    'site_type': np.int64,
+    'mob_rate_per_age_per_type': np.float64,
+    'dur_mean_per_type': np.float64,
+    'variety_per_type': np.int64,
+    'tile_site_dist': np.float64,
+}
+
+# process-local cache of loaded settings: path -> (modification time, settings)
+_settings_cache = {}
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {'__items__': [[_to_json(k), _to_json(v)] for k, v in value.items()]}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, dict) and '__items__' in value:
+        return {_from_json(k): _from_json(v) for k, v in value['__items__']}
+    return value
+
+
+def _sparsify_tile_site_dist_rows(tile_site_dist, site_type, num_site_types, k, radius):
+    """Returns cell sizes, sites, distances and truncation errors of the rows of dense `tile_site_dist`,
+    see `sparsify_tile_site_dist`"""
+    tile_site_dist = np.asarray(tile_site_dist, dtype=np.float64)
+    num_tiles = tile_site_dist.shape[0]
+    prox = 1 / (1 + tile_site_dist ** 2)
+
+    counts = np.zeros((num_tiles, num_site_types), dtype=np.int64)
+    truncation_error = np.zeros((num_tiles, num_site_types))
+    sites, dists = [], []
+    for typ in range(num_site_types):
+        type_sites = np.where(site_type == typ)[0]
+        if len(type_sites) == 0:
+            continue
+        dist_typ = tile_site_dist[:, type_sites]
+        order = np.argsort(dist_typ, axis=1, kind='stable')
+        sorted_dist = np.take_along_axis(dist_typ, order, axis=1)
+
+        # keep the `k` nearest sites, all sites within `radius`, and at least the nearest site
+        keep = np.ones(num_tiles, dtype=np.int64)
+        if k is not None:
+            keep = np.maximum(keep, min(k, len(type_sites)))
+        if radius is not None:
+            keep = np.maximum(keep, (sorted_dist <= radius).sum(axis=1))
+        counts[:, typ] = keep
+
+        prox_typ = prox[:, type_sites]
+        total = prox_typ.sum(axis=1)
+        kept = np.take_along_axis(prox_typ, order, axis=1)
+        kept = np.where(np.arange(len(type_sites))[None, :] < keep[:, None], kept, 0.0).sum(axis=1)
+        truncation_error[:, typ] = 1 - kept / total
+
+        sites.append([type_sites[order[t, :keep[t]]] for t in range(num_tiles)])
+        dists.append([sorted_dist[t, :keep[t]] for t in range(num_tiles)])
+
+    # order entries by tile, then by type
+    types_present = [typ for typ in range(num_site_types) if (site_type == typ).any()]
+    site = [sites[i][t] for t in range(num_tiles) for i in range(len(types_present))]
+    dist = [dists[i][t] for t in range(num_tiles) for i in range(len(types_present))]
+    site = np.concatenate(site).astype(np.int32) if site else np.zeros(0, dtype=np.int32)
+    dist = np.concatenate(dist) if dist else np.zeros(0)
+    return counts, site, dist, truncation_error
+
+
+def sparsify_tile_site_dist(tile_site_dist, *, site_type, num_site_types=None, k=None, radius=None, chunk_size=1024):
+    """
+    Returns sparse representation of the dense tiles x sites distance matrix `tile_site_dist`
+    keeping the `k` nearest sites of each type per tile and/or all sites within `radius`
+    (at least the nearest site of each type is always kept). Usual sites of individuals are chosen
+    among the kept sites with renormalized proximities `1/(1+d**2)`.
+
+    For every tile and type, `truncation_error` is the probability mass of the dropped sites, which is
+    the total variation distance between the sampling distributions of a site with and without truncation.
+    Hence, the distribution of the `v` usual sites of a type chosen without replacement is within
+    total variation distance `v * truncation_error` of the one without truncation.
+
+    Parameters
+    ----------
+    tile_site_dist : 2D array of float
+        Pairwise distances between tile centers and sites
+    site_type : array of int
+        Type of each site
+    num_site_types : int (optional, default: None)
+        Number of site types; `max(site_type) + 1` if None
+    k : int (optional, default: None)
+        Number of nearest sites of each type kept per tile
+    radius : float (optional, default: None)
+        Sites of each type within `radius` (in units of `tile_site_dist`) are kept
+    chunk_size : int (optional, default: 1024)
+        Number of tiles processed at once
+
+    Returns
+    -------
+    tile_site_dist : SparseTileSiteDist
+    """
+    site_type = np.asarray(site_type)
+    num_site_types = num_site_types or int(site_type.max()) + 1
+
+    blocks = []
+    for a in range(0, len(tile_site_dist), chunk_size):
+        counts, site, dist, truncation_error = _sparsify_tile_site_dist_rows(
+            tile_site_dist[a:a + chunk_size], site_type, num_site_types, k, radius)
+        ptr = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts.ravel(), out=ptr[1:])
+        # row `t` of `ptr` holds the offsets of the types of tile `t` and the end of the last type
+        ptr = np.concatenate([ptr[:-1].reshape(counts.shape), ptr[num_site_types::num_site_types, None]], axis=1)
+        blocks.append(SparseTileSiteDist(ptr=ptr, site=site, dist=dist, truncation_error=truncation_error))
+
+    return concatenate_sparse_tile_site_dist(blocks)
+
+
+def concatenate_sparse_tile_site_dist(blocks):
+    """Returns `SparseTileSiteDist` of the consecutive blocks of tiles `blocks`"""
+    offsets = np.cumsum([0] + [len(block.site) for block in blocks])
+    return SparseTileSiteDist(
+        ptr=np.concatenate([block.ptr + offset for block, offset in zip(blocks, offsets)]),
+        site=np.concatenate([block.site for block in blocks]),
+        dist=np.concatenate([block.dist for block in blocks]),
+        truncation_error=np.concatenate([block.truncation_error for block in blocks]))
+
+
+def _stratified_sample(strata, downsample, rng, min_count=0):
+    """Returns sorted indices of a random sample of about `1/downsample` of the units of every stratum `strata`,
+    keeping `floor(n/downsample)` units of a stratum of size `n` and one more with probability of the remainder,
+    but at least `min_count` units"""
+    order = rng.permutation(len(strata))
+    sort = np.argsort(strata[order], kind='stable')
+    sorted_strata = strata[order][sort]
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(sorted_strata)) + 1))
+    counts = np.diff(np.concatenate((starts, [len(sorted_strata)])))
+    expected = counts / downsample
+    keep = np.floor(expected) + (rng.random(len(counts)) < expected - np.floor(expected))
+    keep = np.minimum(np.maximum(keep, min_count), counts)
+    rank = np.arange(len(sorted_strata)) - np.repeat(starts, counts)
+    return np.sort(order[sort[rank < np.repeat(keep, counts)]])
+
+
+def _nearest_sites_of_emptied_cells(tile_site_dist, sites, num_sites):
+    """Returns the nearest site of every nonempty cell (tile, type) of `SparseTileSiteDist` `tile_site_dist`
+    none of whose sites are among the kept `sites`"""
+    ptr = np.asarray(tile_site_dist.ptr)
+    site, dist = np.asarray(tile_site_dist.site), np.asarray(tile_site_dist.dist)
+    cell_start, cell_end = ptr[:, :-1].ravel(), ptr[:, 1:].ravel()
+    if len(site) == 0:
+        return np.zeros(0, dtype=np.int64)
+    # cells are contiguous, so the nonempty cells partition the entries
+    nonempty_start = cell_start[cell_end > cell_start]
+    is_kept = np.zeros(num_sites, dtype=np.int64)
+    is_kept[sites] = 1
+    emptied = np.add.reduceat(is_kept[site], nonempty_start) == 0
+    # entries sorted by distance within each cell, so the first entry of a cell is its nearest site
+    cell = np.repeat(np.arange(cell_start.size), cell_end - cell_start)
+    order = np.lexsort((dist, cell))
+    return np.unique(site[order[nonempty_start[emptied]]])
+
+
+def _downsample_sparse_tile_site_dist(tile_site_dist, sites, site_type, num_site_types):
+    """Returns `SparseTileSiteDist` restricted to the kept `sites` (with new ids given by their position in `sites`)"""
+    new_id = np.full(len(site_type), -1, dtype=np.int64)
+    new_id[sites] = np.arange(len(sites))
+    kept = new_id[tile_site_dist.site] >= 0
+
+    # entries of cell (tile, type) are `ptr[t, k]:ptr[t, k+1]` of the flattened cells
+    ptr = np.asarray(tile_site_dist.ptr)
+    cell_counts = np.diff(np.concatenate((ptr[:, :-1].ravel(), [ptr[-1, -1]])))
+    cell = np.repeat(np.arange(cell_counts.size), cell_counts)
+    counts = np.bincount(cell[kept], minlength=cell_counts.size).reshape(-1, num_site_types)
+
+    new_ptr = np.zeros(counts.size + 1, dtype=np.int64)
+    np.cumsum(counts.ravel(), out=new_ptr[1:])
+    new_ptr = np.concatenate([new_ptr[:-1].reshape(counts.shape), new_ptr[num_site_types::num_site_types, None]], axis=1)
+    # truncation errors refer to the sites before downsampling
+    return SparseTileSiteDist(ptr=new_ptr, site=new_id[tile_site_dist.site[kept]].astype(np.int32),
+                              dist=np.asarray(tile_site_dist.dist)[kept],
+                              truncation_error=np.asarray(tile_site_dist.truncation_error))
+
+
+def downsample_settings(settings, downsample, seed=0):
+    """
+    Returns mobility settings of a town with about `1/downsample` of the people and sites of `settings`,
+    e.g. for quick preview runs of a scenario. People are sampled by household (if households are given)
+    stratified by home tile and age group (of the oldest household member), and sites are sampled stratified
+    by site type keeping at least one site of every type. For sparse tile-site distances, a cell (tile, type) whose
+    kept sites would all be removed keeps its nearest site instead, so every tile keeps candidates of every type. As in settings generated with a downsampling factor
+    in `town-generator.ipynb`, the number of visits per person and type is unchanged, so that the expected
+    occupancy of the sites is preserved. Case counts of the downsampled town are scaled by
+    `lib.calibrationFunctions.downsample_cases` with the same factor.
+
+    Parameters
+    ----------
+    settings : dict
+        Keyword arguments of `MobilitySimulator` of a real town
+    downsample : int
+        Downsampling factor of people and sites
+    seed : int (optional, default: 0)
+        Random seed of the sample
+
+    Returns
+    -------
+    settings : dict
+        Downsampled settings; `downsample` is multiplied by the factor
+    """
+    if downsample < 1:
+        raise ValueError('`downsample` must be at least 1.')
+    rng = np.random.default_rng(seed)
+    settings = dict(settings)
+
+    # people
+    people_age = np.asarray(settings['people_age'])
+    home_tile = np.asarray(settings['home_tile'])
+    num_age_groups = len(settings['mob_rate_per_age_per_type'])
+    if settings.get('people_household') is not None:
+        _, household = np.unique(np.asarray(settings['people_household']), return_inverse=True)
+        household_tile = np.zeros(household.max() + 1, dtype=np.int64)
+        household_tile[household] = home_tile
+        household_age = np.zeros(household.max() + 1, dtype=np.int64)
+        np.maximum.at(household_age, household, people_age)
+        households = _stratified_sample(household_tile * num_age_groups + household_age, downsample, rng)
+        people = np.flatnonzero(np.isin(household, households))
+        settings['people_household'] = np.unique(household[people], return_inverse=True)[1]
+    else:
+        people = _stratified_sample(home_tile * num_age_groups + people_age, downsample, rng)
+
+    for key in ['home_loc', 'people_age', 'home_tile']:
+        settings[key] = np.asarray(settings[key])[people]
+
+    # sites
+    site_type = np.asarray(settings['site_type'])
+    num_site_types = np.shape(settings['mob_rate_per_age_per_type'])[1]
+    sites = _stratified_sample(site_type, downsample, rng, min_count=1)
+    if isinstance(settings['tile_site_dist'], SparseTileSiteDist):
+        sites = np.union1d(sites, _nearest_sites_of_emptied_cells(settings['tile_site_dist'], sites, len(site_type)))
+    settings['site_loc'] = np.asarray(settings['site_loc'])[sites]
+    settings['site_type'] = site_type[sites]
+    if isinstance(settings['tile_site_dist'], SparseTileSiteDist):
+        settings['tile_site_dist'] = _downsample_sparse_tile_site_dist(
+            settings['tile_site_dist'], sites, site_type, num_site_types)
+    else:
+        settings['tile_site_dist'] = np.asarray(settings['tile_site_dist'])[:, sites]
+
+    settings['downsample'] = settings['downsample'] * downsample
+    return settings
+
+
+def converted_settings_path(path):
+    """Returns path of the settings directory converted from the pickled settings file `path`"""
+    return os.path.splitext(path)[0]
+
+
+def save_settings(settings, path):
+    """
+    Saves mobility settings in the binary format
+
+    Parameters
+    ----------
+    settings : dict
+        Keyword arguments of `MobilitySimulator`
+    path : str
+        Output directory
+    """
+    os.makedirs(path, exist_ok=True)
+    meta = {}
+    for key, value in settings.items():
+        if isinstance(value, SparseTileSiteDist):
+            for field, array in value._asdict().items():
+                np.save(os.path.join(path, f'{key}.{field}.npy'), np.ascontiguousarray(array))
+            meta[key] = {'__sparse__': True}
+        elif key in SETTINGS_ARRAY_DTYPES and value is not None:
+            np.save(os.path.join(path, key + '.npy'),
+                    np.ascontiguousarray(value, dtype=SETTINGS_ARRAY_DTYPES[key]))
+        else:
+            meta[key] = _to_json(value)
+
+    # written last, so a directory without `settings.json` is never loaded
+    with open(os.path.join(path, 'settings.json'), 'w') as fp:
+        json.dump(dict(version=SETTINGS_FORMAT_VERSION, settings=meta), fp, indent=1)
+
+
+def convert_settings(path):
+    """Converts pickled settings file `path` to the binary format and returns the path of the directory"""
+    with open(path, 'rb') as fp:
+        settings = pickle.load(fp)
+    out = converted_settings_path(path)
+    save_settings(settings, out)
+    return out
+
+
+def _read_settings_dir(path, mmap_mode):
+    with open(os.path.join(path, 'settings.json'), 'r') as fp:
+        meta = json.load(fp)
+    if meta['version'] != SETTINGS_FORMAT_VERSION:
+        raise ValueError(f'Settings `{path}` have format version {meta["version"]}, '
+                         f'expected {SETTINGS_FORMAT_VERSION}. Convert the settings again.')
+    settings = {key: _from_json(value) for key, value in meta['settings'].items()}
+    for key, value in settings.items():
+        if isinstance(value, dict) and value.get('__sparse__'):
+            settings[key] = SparseTileSiteDist(**{
+                field: np.load(os.path.join(path, f'{key}.{field}.npy'), mmap_mode=mmap_mode)
+                for field in SparseTileSiteDist._fields})
+    for key in SETTINGS_ARRAY_DTYPES:
+        file = os.path.join(path, key + '.npy')
+        if os.path.isfile(file):
+            settings[key] = np.load(file, mmap_mode=mmap_mode)
+    return settings
+
+
+def _read_settings_pickle(path):
+    with open(path, 'rb') as fp:
+        settings = pickle.load(fp)
+    for key, dtype in SETTINGS_ARRAY_DTYPES.items():
+        if settings.get(key) is not None and not isinstance(settings[key], SparseTileSiteDist):
+            settings[key] = np.asarray(settings[key], dtype=dtype)
+            settings[key].setflags(write=False)
+    return settings
+
+
+def _is_current_settings_dir(path, pickle_path):
+    """Whether `path` contains settings of the current format version converted after `pickle_path` was modified"""
+    try:
+        meta_path = os.path.join(path, 'settings.json')
+        if os.stat(meta_path).st_mtime_ns < os.stat(pickle_path).st_mtime_ns:
+            return False
+        with open(meta_path, 'r') as fp:
+            return json.load(fp)['version'] == SETTINGS_FORMAT_VERSION
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def is_binary_settings(path):
+    """Whether `load_settings(path)` reads settings in the binary format, i.e. memory-mapped by default"""
+    return os.path.isdir(path) or _is_current_settings_dir(converted_settings_path(path), path)
+
+
+def load_settings(path, mmap_mode='r', downsample=None, downsample_seed=0):
+    """
+    Loads mobility settings, i.e. the keyword arguments of `MobilitySimulator`.
+    Settings are read once per process and cached; arrays are read-only.
+
+    Parameters
+    ----------
+    path : str
+        Settings directory in the binary format, or pickled settings file. For a pickled settings
+        file, the converted directory is used instead if it exists and is up to date (see `convert_settings`).
+    mmap_mode : str (optional, default: 'r')
+        Memory-map mode of arrays in the binary format; arrays are read into memory if None
+    downsample : int (optional, default: None)
+        If given, people and sites are downsampled by this factor on load (see `downsample_settings`)
+    downsample_seed : int (optional, default: 0)
+        Random seed of the downsampling
+
+    Returns
+    -------
+    settings : dict
+        Fresh dict of settings, which may be modified (its read-only arrays are shared)
+    """
+    if not os.path.isdir(path) and _is_current_settings_dir(converted_settings_path(path), path):
+        path = converted_settings_path(path)
+
+    if os.path.isdir(path):
+        stamp = os.stat(os.path.join(path, 'settings.json')).st_mtime_ns
+    else:
+        stamp = os.stat(path).st_mtime_ns
+
+    key = (os.path.abspath(path), mmap_mode)
+    if key not in _settings_cache or _settings_cache[key][0] != stamp:
+        if os.path.isdir(path):
+            settings = _read_settings_dir(path, mmap_mode)
+        else:
+            settings = _read_settings_pickle(path)
+        _settings_cache[key] = (stamp, settings)
+
+    if downsample is not None and downsample != 1:
+        base = _settings_cache[key][1]
+        key = key + (downsample, downsample_seed)
+        if key not in _settings_cache or _settings_cache[key][0] != stamp:
+            settings = downsample_settings(base, downsample, seed=downsample_seed)
+            for value in settings.values():
+                if isinstance(value, np.ndarray):
+                    value.setflags(write=False)
+            _settings_cache[key] = (stamp, settings)
+
+    return dict(_settings_cache[key][1])
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print(f'{path} -> {convert_settings(path)}')
@@ -1,18 +1,31 @@
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict
+from contextlib import contextmanager
 import itertools
+import bisect
 import random as rd
 import pandas as pd
 import numpy as np
 import numba
+import scipy as sp
+import scipy.sparse
 import pickle
 import json
+import os
+import shutil
+import tempfile
+import weakref
 
 from interlap import InterLap
 
 from lib.calibrationSettings import calibration_mob_paths
+from lib.mobilitysettings import load_settings, SparseTileSiteDist
 
 TO_HOURS = 24.0
 
+# mobility rollouts used to place beacons by visit frequency (see `MobilitySimulator.place_beacons`)
+BEACON_ROLLOUTS = 10
+BEACON_MAX_TIME = 28 * TO_HOURS
+
 # Tuple representing a vist of an individual at a site
 # Note: first two elements must be('t_from', 't_to_shifted') to match contacts using `interlap`
 Visit = namedtuple('Visit', (
@@ -42,200 +55,1482 @@ Contact = namedtuple('Contact', (
 # using pandas.Interval objects
 Interval = namedtuple('Interval', ('left', 'right'))
 
+# State of the mobility traces of all individuals, used to continue
+# simulating the traces window by window (see `MobilitySimulator.simulate`)
+MobilityStreams = namedtuple('MobilityStreams', (
+    'rng_state',        # Random stream of each individual
+    'next_t',           # Next arrival time of each individual (of a visit not ending before `max_time` if trace ended)
+    'next_id',          # Next visit id of each individual
+    'usual_sites',      # Usual sites of each individual per site type (real mode only)
+    'num_usual_sites',  # Number of usual sites of each individual per site type (real mode only)
+))
+
+# Tuple of parallel numpy arrays representing several contacts (see `Contact`),
+# as returned by `MobilitySimulator.find_contacts_of_indiv`
+ContactArrays = namedtuple('ContactArrays', (
+    't_from',      # Times of beginning of contacts
+    't_to',        # Times of end of contacts including `delta`
+    'indiv_i',     # Ids of individuals 'from' contacts
+    'indiv_j',     # Ids of individuals 'to' contacts
+    'site',        # Ids of sites
+    'id_i',        # `id`s of visits of `indiv_i`
+    'id_j',        # `id`s of visits of `indiv_j`
+    't_to_direct', # Times of end of contacts (excluding delta)
+))
+
+
+# Occupancy of sites (or site types) in consecutive time bins, as returned by `MobilitySimulator.site_occupancy`
+SiteOccupancy = namedtuple('SiteOccupancy', (
+    'bins',          # Edges of the time bins
+    'occupancy',     # (sites, bins) number of visits overlapping each bin
+    'person_hours',  # (sites, bins) integrated visit time within each bin
+))
+
+
+def contact_tuples(contacts, idx=None):
+    """Generator of `Contact` namedtuples for the entries `idx` (default: all) of `ContactArrays` `contacts`"""
+    for k in (range(len(contacts.t_from)) if idx is None else idx):
+        t_from, t_to = float(contacts.t_from[k]), float(contacts.t_to[k])
+        yield Contact(t_from=t_from,
+                      t_to=t_to,
+                      indiv_i=int(contacts.indiv_i[k]),
+                      indiv_j=int(contacts.indiv_j[k]),
+                      id_tup=(int(contacts.id_i[k]), int(contacts.id_j[k])),
+                      site=int(contacts.site[k]),
+                      duration=t_to - t_from,
+                      t_to_direct=float(contacts.t_to_direct[k]))
+
+
+@contextmanager
+def _numba_num_threads(num_threads):
+    """Temporarily set the number of threads used by numba (all available if None)"""
+    if num_threads is None:
+        yield
+        return
+    default_num_threads = numba.get_num_threads()
+    numba.set_num_threads(num_threads)
+    try:
+        yield
+    finally:
+        numba.set_num_threads(default_num_threads)
+
+
+# Counter-based random streams (SplitMix64): the `n`-th draw of the stream with key `key` is
+# the pure function `_splitmix64(key + n * _SPLITMIX_GAMMA)` of (`key`, `n`). Each individual draws
+# from its own stream keyed by (seed, individual), so traces can be simulated independently
+# and in parallel, are identical for any number of threads, and do not depend on other individuals
+_SPLITMIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+@numba.njit
+def _splitmix64(z):
+    """SplitMix64 finalizer, a bijective mixing of 64-bit integers"""
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+@numba.njit
+def _random_stream(seed, indiv):
+    """Returns state of the random stream of individual `indiv` for simulation seed `seed`"""
+    state = np.empty(1, dtype=np.uint64)
+    state[0] = _splitmix64(_splitmix64(np.uint64(seed)) ^ np.uint64(indiv))
+    return state
+
+
+@numba.njit
+def _random(state):
+    """Next uniform random number in [0, 1) of random stream `state`"""
+    state[0] += _SPLITMIX_GAMMA
+    return (_splitmix64(state[0]) >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@numba.njit
+def _expovariate(state, rate):
+    """Next exponential random number with rate `rate` of random stream `state`"""
+    return - np.log(1.0 - _random(state)) / rate
+
+
+@numba.njit
+def _random_choice(state, cum_weights):
+    """Next index drawn with probability proportional to weights with cumulative sum `cum_weights`"""
+    idx = np.searchsorted(cum_weights, _random(state) * cum_weights[-1], side='right')
+    return min(idx, len(cum_weights) - 1)
+
+
+@numba.njit
+def _merge_positions(old_ptr, old_keys, new_group, new_keys):
+    """Positions in the merged order of new elements sorted by (`new_group`, `new_keys`) merged into old elements
+    sorted by group and key, where the old elements of group `g` are `old_ptr[g]:old_ptr[g+1]` with keys `old_keys`.
+    New elements are placed after old elements with equal group and key."""
+    pos = np.empty(len(new_keys), dtype=np.int64)
+    for m in range(len(new_keys)):
+        lo, hi = old_ptr[new_group[m]], old_ptr[new_group[m] + 1]
+        pos[m] = lo + np.searchsorted(old_keys[lo:hi], new_keys[m], side='right') + m
+    return pos
+
+@numba.njit
+def _is_primary_order(indiv, t_from):
+    """Indicate if visits are sorted by (`indiv`, `t_from`), i.e. if sorting them would not change their order"""
+    for m in range(1, len(indiv)):
+        if indiv[m] < indiv[m - 1] or (indiv[m] == indiv[m - 1] and t_from[m] < t_from[m - 1]):
+            return False
+    return True
+
+def _merge_into(old, new, pos):
+    """Array of `old` and `new` elements, where the new elements are at positions `pos` and the old ones keep their order"""
+    out = np.empty(len(old) + len(new), dtype=old.dtype)
+    is_old = np.ones(len(out), dtype=np.bool_)
+    is_old[pos] = False
+    out[pos] = new
+    out[is_old] = old
+    return out
+
+class VisitStore:
+    """Columnar (struct-of-arrays) store of all visits of a mobility simulation.
+
+    Columns are kept in the primary order (`indiv`, `t_from`), which makes the visits
+    of individual `i` the contiguous slice `indiv_ptr[i]:indiv_ptr[i+1]`. Two further
+    CSR-style permutations sort the visits by (`site`, `t_from`) and globally by `t_from`.
+    All window queries match visits on the closed interval [`t_from`, `t_to_shifted`],
+    i.e. with the same semantics as `InterLap.find` on `Visit` namedtuples.
+
+    Times are stored as float64 (exact equality of times is relied upon when matching
+    contacts back to visits), ids as int32.
+    """
+
+    def __init__(self, *, t_from, t_to_shifted, t_to, indiv, site, id, num_people, num_sites):
+        """
+        t_from, t_to_shifted, t_to : array of float
+            Arrival, end of influence (departure + `delta`) and departure times of each visit
+        indiv, site, id : array of int
+            Individual, site and per-individual visit id of each visit
+        num_people : int
+            Number of people in the population
+        num_sites : int
+            Number of sites
+        """
+        self.num_people = num_people
+        self.num_sites = num_sites
+
+        # primary order: by individual, then by time
+        # (simulated traces are already in this order, which is checked in linear time instead of sorting)
+        t_from, indiv = np.asarray(t_from, dtype=np.float64), np.asarray(indiv, dtype=np.int32)
+        order = slice(None) if _is_primary_order(indiv, t_from) else np.lexsort((t_from, indiv))
+        self.t_from = np.array(t_from[order])
+        self.t_to_shifted = np.array(np.asarray(t_to_shifted, dtype=np.float64)[order])
+        self.t_to = np.array(np.asarray(t_to, dtype=np.float64)[order])
+        self.indiv = np.array(indiv[order])
+        self.site = np.array(np.asarray(site, dtype=np.int32)[order])
+        self.id = np.array(np.asarray(id, dtype=np.int32)[order])
+
+        self.indiv_ptr = np.zeros(num_people + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indiv, minlength=num_people), out=self.indiv_ptr[1:])
+
+        # global time order
+        self.time_order = np.argsort(self.t_from, kind='mergesort')
+        self.time_t_from = self.t_from[self.time_order]
+
+        # secondary order: by site, then by time, i.e. the time order stably sorted by site
+        self.site_order = self.time_order[np.argsort(self.site[self.time_order], kind='stable')]
+        self.site_ptr = np.zeros(num_sites + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.site, minlength=num_sites), out=self.site_ptr[1:])
+        self.site_t_from = self.t_from[self.site_order]
+
+        # longest visit influence per site bounds the binary search for overlapping visits
+        span = self.t_to_shifted - self.t_from
+        self.site_max_span = np.zeros(num_sites, dtype=np.float64)
+        np.maximum.at(self.site_max_span, self.site, span)
+        self.max_span = span.max() if len(span) > 0 else 0.0
+
+    # arrays written by `save`, i.e. the columns and all index structures
+    _arrays = ('t_from', 't_to_shifted', 't_to', 'indiv', 'site', 'id', 'indiv_ptr', 'site_order',
+               'site_ptr', 'site_t_from', 'site_max_span', 'time_order', 'time_t_from')
+
+    def save(self, path):
+        """Save columns and index structures as `.npy` files in directory `path`"""
+        os.makedirs(path, exist_ok=True)
+        for name in self._arrays:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+        with open(os.path.join(path, 'store.json'), 'w') as fp:
+            json.dump(dict(num_people=int(self.num_people), num_sites=int(self.num_sites),
+                           max_span=float(self.max_span)), fp)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load store saved with `save` from directory `path`. By default, the arrays are
+        memory-mapped read-only, so they are only paged in when accessed and
+        shared between all processes loading the same store."""
+        with open(os.path.join(path, 'store.json'), 'r') as fp:
+            meta = json.load(fp)
+        store = cls.__new__(cls)
+        store.num_people = meta['num_people']
+        store.num_sites = meta['num_sites']
+        store.max_span = meta['max_span']
+        for name in cls._arrays:
+            setattr(store, name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+        return store
+
+    def __len__(self):
+        return len(self.t_from)
+
+    def extend(self, *, t_from, t_to_shifted, t_to, indiv, site, id):
+        """
+        Add visits to the store in place, where the new visits of each individual start after all
+        of their stored visits (e.g. traces continued to a longer horizon, see `MobilitySimulator.extend`).
+        The new visits are sorted and merged into the existing orders, so the stored visits are not sorted again.
+        """
+        order = np.lexsort((np.asarray(t_from), np.asarray(indiv)))
+        new = dict(
+            t_from=np.asarray(t_from, dtype=np.float64)[order],
+            t_to_shifted=np.asarray(t_to_shifted, dtype=np.float64)[order],
+            t_to=np.asarray(t_to, dtype=np.float64)[order],
+            indiv=np.asarray(indiv, dtype=np.int32)[order],
+            site=np.asarray(site, dtype=np.int32)[order],
+            id=np.asarray(id, dtype=np.int32)[order])
+        n = len(self)
+
+        # primary order: new visits of an individual are appended to the slice of the individual
+        pos = _merge_positions(self.indiv_ptr, self.t_from, new['indiv'], new['t_from'])
+        is_new = np.zeros(n + len(pos), dtype=np.bool_)
+        is_new[pos] = True
+        old_pos = np.flatnonzero(~is_new)
+        for name, column in new.items():
+            setattr(self, name, _merge_into(getattr(self, name), column, pos))
+        self.indiv_ptr = self.indiv_ptr + np.concatenate(([0], np.cumsum(np.bincount(new['indiv'], minlength=self.num_people))))
+
+        # secondary order: by site, then by time
+        site_order = np.lexsort((new['t_from'], new['site']))
+        site_pos = _merge_positions(self.site_ptr, self.site_t_from, new['site'][site_order], new['t_from'][site_order])
+        self.site_order = _merge_into(old_pos[self.site_order], pos[site_order], site_pos)
+        self.site_t_from = _merge_into(self.site_t_from, new['t_from'][site_order], site_pos)
+        self.site_ptr = self.site_ptr + np.concatenate(([0], np.cumsum(np.bincount(new['site'], minlength=self.num_sites))))
+
+        span = new['t_to_shifted'] - new['t_from']
+        self.site_max_span = np.array(self.site_max_span)
+        np.maximum.at(self.site_max_span, new['site'], span)
+
+        # global time order
+        time_order = np.argsort(new['t_from'], kind='mergesort')
+        time_pos = _merge_positions(np.array([0, n]), self.time_t_from,
+                                    np.zeros(len(time_order), dtype=np.int64), new['t_from'][time_order])
+        self.time_order = _merge_into(old_pos[self.time_order], pos[time_order], time_pos)
+        self.time_t_from = _merge_into(self.time_t_from, new['t_from'][time_order], time_pos)
+        self.max_span = max(self.max_span, span.max() if len(span) > 0 else 0.0)
+
+    @property
+    def visit_counts(self):
+        """Number of visits of each individual"""
+        return np.diff(self.indiv_ptr)
+
+    def indiv_window(self, indiv, t0, t1):
+        """Return bounds `(a, b)` such that `a:b` are the visits of `indiv` overlapping [t0, t1].
+        Visits of an individual are disjoint in time, hence both `t_from` and `t_to_shifted`
+        are sorted within the slice of `indiv`.
+        """
+        lo, hi = self.indiv_ptr[indiv], self.indiv_ptr[indiv + 1]
+        a = lo + np.searchsorted(self.t_to_shifted[lo:hi], t0, side='left')
+        b = lo + np.searchsorted(self.t_from[lo:hi], t1, side='right')
+        return a, max(a, b)
+
+    def site_window(self, site, t0, t1):
+        """Return indices (in primary order) of all visits at `site` overlapping [t0, t1]"""
+        lo, hi = self.site_ptr[site], self.site_ptr[site + 1]
+        t_from_site = self.site_t_from[lo:hi]
+        a = lo + np.searchsorted(t_from_site, t0 - self.site_max_span[site], side='left')
+        b = lo + np.searchsorted(t_from_site, t1, side='right')
+        idx = self.site_order[a:b]
+        return idx[self.t_to_shifted[idx] >= t0]
+
+    def window(self, t0, t1):
+        """Return indices (in primary order) of all visits overlapping [t0, t1], sorted by `t_from`"""
+        a = np.searchsorted(self.time_t_from, t0 - self.max_span, side='left')
+        b = np.searchsorted(self.time_t_from, t1, side='right')
+        idx = self.time_order[a:b]
+        return idx[self.t_to_shifted[idx] >= t0]
+
+    def visit(self, k):
+        """Return visit with index `k` (in primary order) as `Visit` namedtuple"""
+        t_from, t_to = float(self.t_from[k]), float(self.t_to[k])
+        return Visit(
+            t_from=t_from,
+            t_to_shifted=float(self.t_to_shifted[k]),
+            t_to=t_to,
+            indiv=int(self.indiv[k]),
+            site=int(self.site[k]),
+            duration=t_to - t_from,
+            id=int(self.id[k]))
+
+    def visits(self, idx):
+        """Generator of `Visit` namedtuples for indices `idx` (in primary order)"""
+        for k in idx:
+            yield self.visit(k)
+
+    def to_interlap_by_indiv(self):
+        """Build dict of InterLap of visits per individual (backward compatibility only)"""
+        return {i: InterLap(ranges=list(self.visits(range(self.indiv_ptr[i], self.indiv_ptr[i + 1]))))
+                for i in range(self.num_people)}
+
+    def to_interlap_by_site(self):
+        """Build dict of InterLap of visits per site (backward compatibility only)"""
+        return {k: InterLap(ranges=list(self.visits(self.site_order[self.site_ptr[k]:self.site_ptr[k + 1]])))
+                for k in range(self.num_sites)}
+
+    def to_interlap(self):
+        """Build InterLap of all visits (backward compatibility only)"""
+        return InterLap(ranges=list(self.visits(range(len(self)))))
+
+
+class ChunkedVisitStore:
+    """Out-of-core store of the visits of a mobility simulation in streaming mode (see `MobilitySimulator.simulate`).
+
+    Every simulated window of arrival times [t0, t1) is written to disk as one chunk, i.e. a `VisitStore` whose
+    index arrays (the site-sorted order and the offsets) are narrowed to int32, and chunks are never dropped.
+    Chunks are read back on demand into a page cache of at most `memory_budget` bytes,
+    evicting the least recently used chunks. The chunks needed by the current query always stay resident,
+    so a query spanning more chunks than fit into the budget temporarily exceeds it.
+
+    Queries go through `chunks`, which returns the resident `VisitStore`s holding all visits overlapping
+    a time window. The chunk directory is removed when the store is garbage collected.
+    """
+
+    def __init__(self, *, root, num_people, num_sites, memory_budget=None):
+        """
+        root : str
+            Directory in which a fresh temporary chunk directory is created
+        num_people : int
+            Number of people in the population
+        num_sites : int
+            Number of sites
+        memory_budget : int (optional, default: None)
+            Maximum total size in bytes of the chunks kept in memory; unbounded if None
+        """
+        self.num_people = num_people
+        self.num_sites = num_sites
+        self.memory_budget = memory_budget
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='chunks-', dir=root)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, True)
+
+        # arrival time window [t0, t1) and number of visits of each chunk
+        self.t0, self.t1, self.sizes = [], [], []
+        self.max_span = 0.0
+
+        # page cache: chunk -> (`VisitStore`, size in bytes), least recently used first
+        self._resident = OrderedDict()
+        self.resident_bytes = 0
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def _chunk_path(self, c):
+        return os.path.join(self.path, f'{c:06d}')
+
+    def append(self, visits, t0, t1):
+        """Write `VisitStore` `visits` of the visits with arrival times in [t0, t1) as new chunk"""
+        if len(visits) >= 2**31:
+            raise ValueError('Chunks have to contain less than 2**31 visits; simulate in smaller windows.')
+        for name in ('indiv_ptr', 'site_order', 'site_ptr', 'time_order'):
+            setattr(visits, name, getattr(visits, name).astype(np.int32))
+        c = len(self.sizes)
+        visits.save(self._chunk_path(c))
+        # visits of traces continued by `MobilitySimulator.extend` may arrive before `t0`
+        self.t0.append(min(t0, visits.t_from.min()) if len(visits) > 0 else t0)
+        self.t1.append(t1)
+        self.sizes.append(len(visits))
+        self.max_span = max(self.max_span, visits.max_span)
+        self._insert(c, visits, keep=(c,))
+
+    def _insert(self, c, visits, keep):
+        self._resident[c] = (visits, sum(getattr(visits, name).nbytes for name in VisitStore._arrays))
+        self.resident_bytes += self._resident[c][1]
+        if self.memory_budget is None:
+            return
+        for evicted in list(self._resident):
+            if self.resident_bytes <= self.memory_budget:
+                break
+            if evicted not in keep:
+                self.resident_bytes -= self._resident.pop(evicted)[1]
+
+    def _load(self, c, keep=()):
+        """Returns `VisitStore` of chunk `c`, reading it into the page cache if it is not resident"""
+        if c in self._resident:
+            self._resident.move_to_end(c)
+            return self._resident[c][0]
+        visits = VisitStore.load(self._chunk_path(c), mmap_mode=None)
+        self._insert(c, visits, keep=keep)
+        return visits
+
+    def chunks(self, t0, t1):
+        """Returns list of `VisitStore`s of the chunks containing all visits overlapping [t0, t1], sorted by time"""
+        needed = tuple(c for c in range(len(self.sizes))
+                       if self.t0[c] <= t1 and self.t1[c] > t0 - self.max_span and self.sizes[c] > 0)
+        if not needed:
+            empty = np.zeros(0), np.zeros(0, dtype=np.int32)
+            return [VisitStore(t_from=empty[0], t_to_shifted=empty[0], t_to=empty[0], indiv=empty[1], site=empty[1],
+                               id=empty[1], num_people=self.num_people, num_sites=self.num_sites)]
+        return [self._load(c, keep=needed) for c in needed]
+
+    def close(self):
+        """Remove the chunk directory"""
+        self._resident.clear()
+        self.resident_bytes = 0
+        self._finalizer()
+
+
+class ContactGraph:
+    """CSR graph of all delta-contacts of a mobility simulation.
+
+    The contacts caused by individual `j` (i.e. `indiv_j` = `j`, the individual at risk being `indiv_i`)
+    are the contiguous slice `ptr[j]:ptr[j+1]`, sorted in the same order as returned by
+    `MobilitySimulator.find_contacts_of_indiv(j, ...)`. Built by `MobilitySimulator.compute_contact_graph`.
+    """
+
+    # arrays written by `save`
+    _arrays = ('ptr', 't_from', 't_to', 't_to_direct', 'indiv_i', 'site', 'id_i', 'id_j')
+
+    def __init__(self, *, ptr, t_from, t_to, t_to_direct, indiv_i, site, id_i, id_j):
+        """
+        ptr : array of int
+            Offsets of the contacts caused by each individual
+        t_from, t_to, t_to_direct : array of float
+            Begin, end including `delta` and end excluding `delta` of each contact
+        indiv_i, site, id_i, id_j : array of int
+            Individual at risk, site and visit ids of `indiv_i` and `indiv_j` of each contact
+        """
+        self.ptr = ptr
+        self.t_from = t_from
+        self.t_to = t_to
+        self.t_to_direct = t_to_direct
+        self.indiv_i = indiv_i
+        self.site = site
+        self.id_i = id_i
+        self.id_j = id_j
+
+        # longest contact bounds the binary search for contacts in a time window
+        self.max_span = float((t_to - t_from).max()) if len(t_from) > 0 else 0.0
+
+    @property
+    def num_people(self):
+        return len(self.ptr) - 1
+
+    def __len__(self):
+        return len(self.t_from)
+
+    def save(self, path):
+        """Save graph as `.npy` files in directory `path`, e.g. next to the `VisitStore` of the traces"""
+        os.makedirs(path, exist_ok=True)
+        for name in self._arrays:
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load graph saved with `save` from directory `path`, memory-mapped read-only by default"""
+        return cls(**{name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                      for name in cls._arrays})
+
+    def contacts_of_indiv(self, indiv, tmin, tmax):
+        """Return `ContactArrays` of the contacts caused by `indiv` with `t_from` <= `tmax` and `t_to` > `tmin`,
+        i.e. `MobilitySimulator.find_contacts_of_indiv(indiv, tmin, tmax)` for `tracing=False`"""
+        lo, hi = self.ptr[indiv], self.ptr[indiv + 1]
+        a = lo + np.searchsorted(self.t_from[lo:hi], tmin - self.max_span, side='left')
+        b = lo + np.searchsorted(self.t_from[lo:hi], tmax, side='right')
+        idx = a + np.where(self.t_to[a:b] > tmin)[0]
+        return ContactArrays(
+            t_from=self.t_from[idx],
+            t_to=self.t_to[idx],
+            indiv_i=self.indiv_i[idx],
+            indiv_j=np.full(len(idx), indiv, dtype=np.int32),
+            site=self.site[idx],
+            id_i=self.id_i[idx],
+            id_j=self.id_j[idx],
+            t_to_direct=self.t_to_direct[idx])
+
+
+@numba.njit
+def _disjoint_contacts(group_ptr, t_from, t_to):
+    """Marks the contacts of each group `group_ptr[g]:group_ptr[g+1]` (sorted by `t_from`) that do not overlap
+    (on closed intervals) an earlier marked contact of the group, i.e. the ones kept when inserting them one by one
+    into an `InterLap` if not overlapping a contained contact (jit for speed)"""
+    keep = np.zeros(len(t_from), dtype=np.bool_)
+    for g in range(len(group_ptr) - 1):
+        last_t_to = -np.inf
+        for k in range(group_ptr[g], group_ptr[g + 1]):
+            if t_from[k] > last_t_to:
+                keep[k] = True
+                last_t_to = t_to[k]
+    return keep
+
+
+class ContactStore:
+    """Store of the contacts between infectors and individuals at risk used for sampling exposures,
+    i.e. `MobilitySimulator.contacts` queried by `is_in_contact`, `will_be_in_contact` and `next_contact`.
+
+    The contacts from `indiv_j` (infector) to `indiv_i` are kept as a slice of preallocated columns, sorted by
+    `t_from` and pairwise disjoint (a contact overlapping a contained one is not added), hence also sorted by `t_to`.
+    A hash map from the pair (`indiv_j`, `indiv_i`) to its slice makes finding and deduplicating contacts O(1)
+    and queries a binary search within the slice. Memory grows with the contacts added, and the contacts of an
+    infector are released with `release` once they cannot cause exposures anymore.
+    """
+
+    # columns of the contacts
+    _arrays = ('t_from', 't_to', 't_to_direct', 'site', 'id_i', 'id_j')
+
+    def __init__(self, num_people, capacity=1024):
+        """
+        num_people : int
+            Number of people in the population
+        capacity : int (optional, default: 1024)
+            Initial number of contacts allocated
+        """
+        self.num_people = num_people
+        self.t_from = np.empty(capacity, dtype=np.float64)
+        self.t_to = np.empty(capacity, dtype=np.float64)
+        self.t_to_direct = np.empty(capacity, dtype=np.float64)
+        self.site = np.empty(capacity, dtype=np.int32)
+        self.id_i = np.empty(capacity, dtype=np.int32)
+        self.id_j = np.empty(capacity, dtype=np.int32)
+
+        # (start, count) of the contacts of each pair with key `indiv_j * num_people + indiv_i`
+        self._pairs = {}
+        # individuals at risk of each infector with contacts in the store
+        self._infector_pairs = defaultdict(list)
+        self._size = 0
+        self._num_live = 0
+
+    def __len__(self):
+        return self._num_live
+
+    def _reserve(self, n):
+        """Make room for `n` more contacts, compacting the columns if most of them were released"""
+        if self._size + n <= len(self.t_from):
+            return
+        if self._num_live + n <= len(self.t_from) // 2:
+            self._compact()
+            return
+        capacity = max(2 * len(self.t_from), self._num_live + n)
+        for name in self._arrays:
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def _compact(self):
+        """Move the slices of all pairs to the front of the columns"""
+        keys = list(self._pairs.keys())
+        starts = np.array([self._pairs[key][0] for key in keys], dtype=np.int64)
+        counts = np.array([self._pairs[key][1] for key in keys], dtype=np.int64)
+        first = np.cumsum(counts) - counts
+        idx = np.repeat(starts - first, counts) + np.arange(counts.sum())
+        for name in self._arrays:
+            column = getattr(self, name)
+            column[:len(idx)] = column[idx]
+        self._pairs = {key: (int(a), int(c)) for key, a, c in zip(keys, first, counts)}
+        self._size = len(idx)
+
+    def _append(self, columns):
+        """Append contacts given as dict of columns and return the position of the first one"""
+        n = len(columns['t_from'])
+        self._reserve(n)
+        start = self._size
+        for name in self._arrays:
+            getattr(self, name)[start:start + n] = columns[name]
+        self._size += n
+        self._num_live += n
+        return start
+
+    def add(self, infector, contacts, idx=None):
+        """
+        Add the contacts `idx` (default: all) of `ContactArrays` `contacts` caused by `infector`,
+        skipping contacts overlapping a contact of the same pair already in the store
+        (in the order of `idx`), and return the individuals at risk of the contacts.
+
+        Parameters
+        ----------
+        infector : int
+            Individual causing the contacts, i.e. `indiv_j` of all contacts
+        contacts : ContactArrays
+            Contacts sorted by `t_from`, e.g. as returned by `MobilitySimulator.find_contacts_of_indiv`
+        idx : array of int (optional, default: None)
+            Indices of the contacts to add
+
+        Returns
+        -------
+        indiv_i : array of int
+            Individual at risk of each of the contacts `idx`
+        """
+        idx = np.arange(len(contacts.t_from)) if idx is None else np.asarray(idx, dtype=np.int64)
+        indiv_i = contacts.indiv_i[idx]
+        if len(idx) == 0:
+            return indiv_i
+
+        # group contacts by individual at risk, keeping their order
+        order = idx[np.argsort(indiv_i, kind='stable')]
+        grouped_i = contacts.indiv_i[order]
+        group_ptr = np.concatenate(([0], np.flatnonzero(np.diff(grouped_i)) + 1, [len(order)]))
+        keep = _disjoint_contacts(group_ptr, contacts.t_from[order], contacts.t_to[order])
+
+        columns = dict(t_from=contacts.t_from[order], t_to=contacts.t_to[order],
+                       t_to_direct=contacts.t_to_direct[order], site=contacts.site[order],
+                       id_i=contacts.id_i[order], id_j=contacts.id_j[order])
+        is_new = np.array([infector * self.num_people + int(grouped_i[a]) not in self._pairs
+                           for a in group_ptr[:-1]], dtype=bool)
+
+        # new pairs are appended as one block
+        new_rows = keep & np.repeat(is_new, np.diff(group_ptr))
+        start = self._append({name: column[new_rows] for name, column in columns.items()})
+        for g in np.flatnonzero(is_new):
+            a, b = group_ptr[g], group_ptr[g + 1]
+            j = int(grouped_i[a])
+            count = int(keep[a:b].sum())
+            self._pairs[infector * self.num_people + j] = (start, count)
+            self._infector_pairs[infector].append(j)
+            start += count
+
+        # contacts of existing pairs are merged into a new slice
+        for g in np.flatnonzero(~is_new):
+            a, b = group_ptr[g], group_ptr[g + 1]
+            self._merge(infector, int(grouped_i[a]), {name: column[a:b] for name, column in columns.items()})
+
+        return indiv_i
+
+    def _merge(self, infector, j, columns):
+        """Add contacts of the existing pair (`infector`, `j`) one by one"""
+        key = infector * self.num_people + j
+        start, count = self._pairs[key]
+        merged = {name: list(getattr(self, name)[start:start + count]) for name in self._arrays}
+        for k in range(len(columns['t_from'])):
+            t_from, t_to = columns['t_from'][k], columns['t_to'][k]
+            # stored contacts are disjoint, so the last one starting before `t_to` has the largest `t_to`
+            p = bisect.bisect_right(merged['t_from'], t_to)
+            if p > 0 and merged['t_to'][p - 1] >= t_from:
+                continue
+            p = bisect.bisect_left(merged['t_from'], t_from)
+            for name in self._arrays:
+                merged[name].insert(p, columns[name][k])
+        self._num_live -= count
+        self._pairs[key] = (self._append(merged), len(merged['t_from']))
+
+    def release(self, infector):
+        """Remove all contacts caused by `infector`"""
+        for j in self._infector_pairs.pop(infector, []):
+            _, count = self._pairs.pop(infector * self.num_people + j)
+            self._num_live -= count
+
+    def _slice(self, indiv_i, indiv_j):
+        start, count = self._pairs.get(indiv_j * self.num_people + indiv_i, (0, 0))
+        return start, start + count
+
+    def contact(self, k, indiv_i, indiv_j):
+        """Return contact at position `k` of the columns as `Contact` namedtuple"""
+        t_from, t_to = float(self.t_from[k]), float(self.t_to[k])
+        return Contact(t_from=t_from,
+                       t_to=t_to,
+                       indiv_i=indiv_i,
+                       indiv_j=indiv_j,
+                       id_tup=(int(self.id_i[k]), int(self.id_j[k])),
+                       site=int(self.site[k]),
+                       duration=t_to - t_from,
+                       t_to_direct=float(self.t_to_direct[k]))
+
+    def find(self, indiv_i, indiv_j, t):
+        """Return the contact from `indiv_j` to `indiv_i` containing time `t`, or None"""
+        a, b = self._slice(indiv_i, indiv_j)
+        k = a + int(np.searchsorted(self.t_from[a:b], t, side='right')) - 1
+        if k >= a and self.t_to[k] >= t:
+            return self.contact(k, indiv_i, indiv_j)
+        return None
+
+    def next(self, indiv_i, indiv_j, t, site=None):
+        """Return the first contact from `indiv_j` to `indiv_i` at `site` (any if None) ending at or after `t`, or None"""
+        a, b = self._slice(indiv_i, indiv_j)
+        for k in range(a + int(np.searchsorted(self.t_to[a:b], t, side='left')), b):
+            if (site is None) or (self.site[k] == site):
+                return self.contact(k, indiv_i, indiv_j)
+        return None
+
+
 @numba.njit
-def _simulate_individual_synthetic_trace(indiv, num_sites, max_time, home_loc, site_loc,
-                            site_type, mob_rate_per_type, dur_mean_per_type, delta):
-    """Simulate a mobility trace for one synthetic individual on a 2D grid (jit for speed)"""
-    # Holds tuples of (time_start, time_end, indiv, site, duration)
-    data = list()
-    # Set rates and probs
-    tot_mob_rate = np.sum(mob_rate_per_type)  # Total mobility rate
-    site_type_prob = mob_rate_per_type / tot_mob_rate  # Site type probability
-    # time
-    t = rd.expovariate(tot_mob_rate)
-    # Site proximity to individual's home
-    site_dist = np.sum((home_loc[indiv] - site_loc)**2,axis=1)
-    site_prox = 1/(1+site_dist)
-
-    id = 0
-    while t < max_time:
+def _next_copresence(t, duration, t_from, t_to, a, a_end, b, b_end):
+    """Returns the time at which the individuals with away intervals `a:a_end` and `b:b_end` of `t_from`, `t_to`
+    (disjoint and sorted each) have been at home together for `duration` time units after `t` (jit for speed)"""
+    a += np.searchsorted(t_to[a:a_end], t, side='right')
+    b += np.searchsorted(t_to[b:b_end], t, side='right')
+    s = t
+    while True:
+        # leave the away intervals containing `s`
+        away = True
+        while away:
+            away = False
+            while a < a_end and t_to[a] <= s:
+                a += 1
+            while b < b_end and t_to[b] <= s:
+                b += 1
+            if a < a_end and t_from[a] <= s:
+                s = t_to[a]
+                away = True
+            if b < b_end and t_from[b] <= s:
+                s = t_to[b]
+                away = True
+
+        # both are at home until the next away interval starts
+        t_next = np.inf
+        if a < a_end:
+            t_next = t_from[a]
+        if b < b_end:
+            t_next = min(t_next, t_from[b])
+        if s + duration <= t_next:
+            return s + duration
+        duration -= t_next - s
+        s = t_next
+
+
+class CopresenceIndex:
+    """Index of the time intervals [`t_from`, `t_to`) individuals are away from home, used to sample
+    household exposures directly on the time two household members are at home together (co-presence),
+    i.e. the complement of the union of their away intervals (see `DiseaseModel`).
+
+    The away intervals of individual `i` are the contiguous slice `ptr[i]:ptr[i+1]`, which are
+    disjoint and sorted by time since the visits of an individual are.
+    """
+
+    def __init__(self, visits, away=None):
+        """
+        visits : VisitStore
+            Visits of all individuals
+        away : array of bool (optional, default: None)
+            Visits (in primary order of `visits`) during which the individual is away from home.
+            Visits not marked count as time at home; all visits are away if None.
+        """
+        if away is None:
+            away = np.ones(len(visits), dtype=np.bool_)
+        away = away & (visits.t_to > visits.t_from)
+        self.t_from = np.ascontiguousarray(visits.t_from[away])
+        self.t_to = np.ascontiguousarray(visits.t_to[away])
+        self.ptr = np.zeros(visits.num_people + 1, dtype=np.int64)
+        np.cumsum(np.bincount(visits.indiv[away], minlength=visits.num_people), out=self.ptr[1:])
+
+    def __len__(self):
+        return len(self.t_from)
+
+    def next_copresence(self, indiv_i, indiv_j, t, duration):
+        """Returns the time at which `indiv_i` and `indiv_j` have been at home together for `duration`
+        time units after `t`, i.e. the time `tau` such that their co-presence in [`t`, `tau`] is `duration`"""
+        return _next_copresence(float(t), float(duration), self.t_from, self.t_to,
+                                self.ptr[indiv_i], self.ptr[indiv_i + 1], self.ptr[indiv_j], self.ptr[indiv_j + 1])
+
+
+class VisitTemplate:
+    """Template periods of the mobility traces of all individuals, tiled over a long horizon
+    (see `MobilitySimulator.simulate` with `period`).
+
+    Each individual has `num_templates` template periods, i.e. consecutive periods of one simulation
+    of `num_templates * period` time units. In the `c`-th period of the horizon, i.e. [c * period, (c+1) * period),
+    each individual follows one of their template periods, chosen uniformly at random independently
+    per individual and period. Visits are hence resolved at time `t mod period` against a template,
+    so memory and simulation cost do not depend on the length of the horizon.
+
+    Template visits are stored in order (`indiv`, template period, `t_from`) with times relative to the
+    beginning of their template period, which makes the visits of individual `i` in template period `w`
+    the contiguous slice `ptr[i * num_templates + w]:ptr[i * num_templates + w + 1]`.
+    """
+
+    def __init__(self, visits, *, period, num_templates, delta, seed):
+        """
+        visits : VisitStore
+            Visits of a mobility simulation of `num_templates * period` time units
+        period : float
+            Length of the template periods, e.g. one week
+        num_templates : int
+            Number of template periods per individual
+        delta : float
+            Time delta of contacts
+        seed : int
+            Random seed of the choice of template periods
+        """
+        self.period = period
+        self.num_templates = num_templates
+        self.delta = delta
+        self.seed = seed
+        self.num_people = visits.num_people
+
+        # visits reaching into the next period are dropped, so the tiled visits of an individual never overlap
+        template = np.floor(visits.t_from / period).astype(np.int64)
+        keep = (template < num_templates) & (visits.t_to <= (template + 1) * period)
+        template = template[keep]
+        offset = template * period
+        self.t_from = visits.t_from[keep] - offset
+        self.t_to = visits.t_to[keep] - offset
+        self.site = visits.site[keep]
+
+        # visits are in primary order (`indiv`, `t_from`), hence also ordered by (`indiv`, template period)
+        cell = visits.indiv[keep].astype(np.int64) * num_templates + template
+        self.ptr = np.zeros(self.num_people * num_templates + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.num_people * num_templates), out=self.ptr[1:])
+
+        # visit ids of the first visit of each individual in period `_id_period`
+        self._id_period = 0
+        self._first_id = np.zeros(self.num_people, dtype=np.int64)
+
+    def choice(self, c):
+        """Template period followed by each individual in the `c`-th period of the horizon"""
+        return np.random.default_rng([self.seed, c]).integers(self.num_templates, size=self.num_people)
+
+    def _period_counts(self, c):
+        """Number of visits of each individual in the `c`-th period of the horizon and their slices in the template"""
+        cell = np.arange(self.num_people, dtype=np.int64) * self.num_templates + self.choice(c)
+        return self.ptr[cell + 1] - self.ptr[cell], self.ptr[cell]
+
+    def _first_ids(self, c):
+        """Visit ids of the first visit of each individual in the `c`-th period; periods are queried in order"""
+        if c < self._id_period:
+            raise ValueError('Periods of a visit template have to be generated in order.')
+        while self._id_period < c:
+            counts, _ = self._period_counts(self._id_period)
+            self._first_id += counts
+            self._id_period += 1
+        return self._first_id
+
+    def visit_counts(self, max_time):
+        """Number of visits of each individual in [0, `max_time`]"""
+        num_periods = int(np.ceil(max_time / self.period))
+        visit_counts = np.zeros(self.num_people, dtype=np.int64)
+        for c in range(num_periods):
+            counts, start = self._period_counts(c)
+            if (c + 1) * self.period > max_time:
+                # last period is truncated at `max_time`, as traces end with the first visit beyond `max_time`
+                idx = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+                ends = self.t_to[idx] + c * self.period <= max_time
+                counts = np.bincount(np.repeat(np.arange(self.num_people), counts)[ends], minlength=self.num_people)
+            visit_counts += counts
+        return visit_counts
+
+    def columns(self, t0, t1, max_time):
+        """Returns the columns (as `MobilitySimulator._simulate_mobility_window`) of all visits with
+        arrival time in [`t0`, `t1`) that end before `max_time`"""
+        columns = []
+        for c in range(int(np.floor(t0 / self.period)), int(np.ceil(t1 / self.period))):
+            counts, start = self._period_counts(c)
+            first = np.cumsum(counts) - counts
+            idx = np.repeat(start - first, counts) + np.arange(counts.sum())
+            indiv = np.repeat(np.arange(self.num_people, dtype=np.int32), counts)
+            visit_id = np.repeat(self._first_ids(c) - first, counts) + np.arange(counts.sum())
+
+            t_from = self.t_from[idx] + c * self.period
+            t_to = self.t_to[idx] + c * self.period
+            keep = (t_from >= t0) & (t_from < t1) & (t_to <= max_time)
+            columns.append((t_from[keep], t_to[keep] + self.delta, t_to[keep], indiv[keep],
+                            self.site[idx[keep]], visit_id[keep].astype(np.int32)))
+
+        if not columns:
+            return (np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int32),
+                    np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+        return tuple(np.concatenate(column) for column in zip(*columns))
+
+
+def _site_grid(*, site_loc, site_type, num_site_types):
+    """
+    Build a uniform grid over the sites in synthetic mode, used as spatial index to choose sites
+    proportional to their proximity to an individual's home (see `_simulate_individual_synthetic_trace`).
+    The grid has about `num_sites ** 0.5` cells, so that building the per-individual tables over the cells
+    is much cheaper than iterating over all sites.
+
+    Returns
+    -------
+    grid_sites : array of int
+        Site ids grouped by site type and cell, i.e. sites of type `k` in cell `c` are
+        `grid_sites[grid_ptr[k * num_cells + c]:grid_ptr[k * num_cells + c + 1]]`
+    grid_ptr : array of int
+        Offsets of (site type, cell) pairs in `grid_sites`
+    cell_lo, cell_hi : 2D array of float
+        Lower left and upper right corner of each cell
+    """
+    num_cells_per_dim = max(1, int(round(len(site_loc) ** 0.25)))
+    num_cells = num_cells_per_dim ** 2
+
+    lo, hi = site_loc.min(axis=0), site_loc.max(axis=0)
+    width = np.where(hi > lo, (hi - lo) / num_cells_per_dim, 1.0)
+    cell_xy = np.minimum(((site_loc - lo) / width).astype(np.int64), num_cells_per_dim - 1)
+    cell = cell_xy[:, 0] * num_cells_per_dim + cell_xy[:, 1]
+
+    key = site_type * num_cells + cell
+    grid_sites = np.argsort(key, kind='mergesort')
+    grid_ptr = np.zeros(num_site_types * num_cells + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key, minlength=num_site_types * num_cells), out=grid_ptr[1:])
+
+    cell_lo = lo + np.stack(np.divmod(np.arange(num_cells), num_cells_per_dim), axis=1) * width
+    cell_hi = cell_lo + width
+    return grid_sites, grid_ptr, cell_lo, cell_hi
+
+@numba.njit
+def _simulate_individual_synthetic_trace(t, t_end, max_time, home, site_loc, cum_mob_rate_per_type, dur_mean_per_type,
+                                         delta, grid_sites, grid_ptr, cell_lo, cell_hi, state):
+    """Simulate the visits with arrival time in [`t`, `t_end`) of the mobility trace of one synthetic individual
+    with home `home` on a 2D grid (jit for speed), where `t` is the next arrival time of the individual.
+    Uses random stream `state` and the spatial index of sites built by `_site_grid`.
+    Returns arrays of arrival times, departure times and sites, and the next arrival time after `t_end`.
+    If the trace ended, i.e. the visit arriving next does not end before `max_time`, its random draws are undone,
+    so the trace continues identically for a later `max_time` (see `MobilitySimulator.extend`)."""
+    # Holds times of arrival and departure and sites of visits
+    visit_t_from, visit_t_to, visit_site = [0.0 for _ in range(0)], [0.0 for _ in range(0)], [0 for _ in range(0)]
+    # Set rates
+    tot_mob_rate = cum_mob_rate_per_type[-1]  # Total mobility rate
+    if t >= min(t_end, max_time):
+        return np.array(visit_t_from), np.array(visit_t_to), np.array(visit_site), t
+
+    # Upper bound of proximity `1/(1+d**2)` to individual's home of sites in each cell
+    num_site_types, num_cells = len(cum_mob_rate_per_type), len(cell_lo)
+    cell_prox = np.empty(num_cells)
+    for c in range(num_cells):
+        dx = max(cell_lo[c, 0] - home[0], 0.0, home[0] - cell_hi[c, 0])
+        dy = max(cell_lo[c, 1] - home[1], 0.0, home[1] - cell_hi[c, 1])
+        cell_prox[c] = 1 / (1 + dx * dx + dy * dy)
+
+    # Cumulative upper bound of proximity of all sites of each type over cells
+    cum_cell_prox = np.empty((num_site_types, num_cells))
+    for k in range(num_site_types):
+        tot = 0.0
+        for c in range(num_cells):
+            tot += (grid_ptr[k * num_cells + c + 1] - grid_ptr[k * num_cells + c]) * cell_prox[c]
+            cum_cell_prox[k, c] = tot
+
+    while t < min(t_end, max_time):
+        visit_state = state[0]
         # Choose a site type
-        k = np.searchsorted(np.cumsum(site_type_prob), np.random.random(), side="right")
-        s_args = np.where(site_type == k)[0]
-        if len(s_args) == 0:  # If there is no site of this type, resample
-            # FIXME: If input site types are messed up (prob 1 for missing type)
-            # then we end up in an infinit loop...
-            continue
-        # Choose site: Proportional to distance among chosen type
-        site_prob = site_prox[s_args] / site_prox[s_args].sum()
-        s_idx = np.random.multinomial(1, pvals=site_prob).argmax()
-        site = s_args[s_idx]
+        k = _random_choice(state, cum_mob_rate_per_type)
+        # Choose site: Proportional to proximity among chosen type, by rejection sampling
+        # of sites chosen proportional to the upper bound of proximity of their cell
+        while True:
+            c = _random_choice(state, cum_cell_prox[k])
+            a, b = grid_ptr[k * num_cells + c], grid_ptr[k * num_cells + c + 1]
+            site = grid_sites[a + int(_random(state) * (b - a))]
+            dx, dy = site_loc[site, 0] - home[0], site_loc[site, 1] - home[1]
+            if _random(state) * cell_prox[c] * (1 + dx * dx + dy * dy) <= 1.0:
+                break
         # Duration: Exponential
-        dur = rd.expovariate(1/dur_mean_per_type[k])
+        dur = _expovariate(state, 1/dur_mean_per_type[k])
         if t + dur > max_time:
+            state[0] = visit_state
             break
-        # Add visit namedtuple to list
-        data.append(Visit(
-            id=id,
-            t_from=t,
-            t_to_shifted=t + dur + delta,
-            t_to=t + dur,
-            indiv=indiv,
-            site=site,
-            duration=dur))
+        # Add visit
+        visit_t_from.append(t)
+        visit_t_to.append(t + dur)
+        visit_site.append(site)
         # Shift time to after visit influence (i.e. duration + delta)
         t += dur + delta
         # Shift time to next start of next visit
-        t += rd.expovariate(tot_mob_rate)
-        # Increment id
-        id += 1
+        t += _expovariate(state, tot_mob_rate)
 
-    return data
+    return np.array(visit_t_from), np.array(visit_t_to), np.array(visit_site), t
 
-@numba.njit
-def _simulate_individual_real_trace(indiv, max_time, site_type, mob_rate_per_type, dur_mean_per_type,
-                               variety_per_type, delta, site_dist):
-    """Simulate a mobility trace for one real individual in a given town (jit for speed)"""
-    # Holds tuples of (time_start, time_end, indiv, site, duration)
-    data = list()
-    # Set rates and probs
-    tot_mob_rate = np.sum(mob_rate_per_type)  # Total mobility rate
-    site_type_prob = mob_rate_per_type / tot_mob_rate  # Site type probability
-    # time
-    t = rd.expovariate(tot_mob_rate)
-    # Site proximity to individual's home
-    site_dist = site_dist**2
-    site_prox = 1/(1+site_dist)
+def _site_choice_tables(*, site_type, num_site_types, tile_site_dist):
+    """
+    Precompute the tables used to choose the usual sites of individuals in real mode,
+    which are shared by all residents of a tile.
+
+    `tile_site_dist` is either the dense tiles x sites distance matrix or its `SparseTileSiteDist`
+    representation, in which case only the kept sites of a tile are candidates and their proximities
+    are renormalized.
+
+    Returns
+    -------
+    tile_sites : array of int
+        Candidate site ids per tile and type, i.e. sites of type `k` for tile `t` are `tile_sites[tile_ptr[t, k]:tile_ptr[t, k+1]]`.
+        For dense distances, all tiles share the sites of each type, i.e. the sites sorted by type.
+    tile_ptr : 2D array of int
+        Offsets of tiles and site types in `tile_sites`
+    tile_site_cum_prox : array of float
+        Cumulative site proximity `1/(1+d**2)`, i.e. `tile_site_cum_prox[tile_prox_ptr[t]:][tile_ptr[t, k]:tile_ptr[t, k+1]]`
+        is the cumulative sum of proximities of the candidate sites of type `k` to the center of tile `t`
+    tile_prox_ptr : array of int
+        Offset of the proximities of each tile in `tile_site_cum_prox` relative to `tile_ptr`,
+        i.e. `t * num_sites` for dense distances and 0 for sparse ones
+    """
+    if isinstance(tile_site_dist, SparseTileSiteDist):
+        tile_sites = np.asarray(tile_site_dist.site, dtype=np.int32)
+        tile_ptr = np.asarray(tile_site_dist.ptr, dtype=np.int64)
+        # segmented cumulative sum over the cells (tile, type), i.e. global cumulative sum minus its value before each cell
+        cum_prox = np.cumsum(1 / (1 + np.asarray(tile_site_dist.dist, dtype=np.float64) ** 2))
+        cell_start, cell_end = tile_ptr[:, :-1].ravel(), tile_ptr[:, 1:].ravel()
+        cell_offset = np.where(cell_start > 0, cum_prox[np.maximum(cell_start - 1, 0)], 0.0)
+        tile_site_cum_prox = cum_prox - np.repeat(cell_offset, cell_end - cell_start)
+        tile_prox_ptr = np.zeros(tile_ptr.shape[0], dtype=np.int64)
+        return tile_sites, tile_ptr, tile_site_cum_prox, tile_prox_ptr
+
+    # dense distances: all sites of a type are candidates of every tile
+    tile_site_dist = np.asarray(tile_site_dist)
+    num_tiles, num_sites = tile_site_dist.shape
+    type_sites = np.argsort(site_type, kind='mergesort')
+    type_ptr = np.zeros(num_site_types + 1, dtype=np.int64)
+    np.cumsum(np.bincount(site_type, minlength=num_site_types), out=type_ptr[1:])
+
+    tile_sites = type_sites.astype(np.int32)
+    tile_ptr = np.tile(type_ptr, (num_tiles, 1))
+    tile_site_cum_prox = 1 / (1 + tile_site_dist[:, type_sites].astype(np.float64) ** 2)
+    for k in range(num_site_types):
+        np.cumsum(tile_site_cum_prox[:, type_ptr[k]:type_ptr[k + 1]], axis=1,
+                  out=tile_site_cum_prox[:, type_ptr[k]:type_ptr[k + 1]])
+    tile_prox_ptr = np.arange(num_tiles, dtype=np.int64) * num_sites
+
+    return tile_sites, tile_ptr, tile_site_cum_prox.ravel(), tile_prox_ptr
 
+@numba.njit
+def _choose_usual_sites(variety_per_type, tile_sites, tile_ptr, cum_site_prox, usual_sites, num_usual_sites, state):
+    """Choose the usual sites of one real individual using random stream `state` and the candidate sites
+    `tile_sites` with offsets `tile_ptr` per type and cumulative site proximities `cum_site_prox`
+    of the individual's home tile (see `_site_choice_tables`) (jit for speed).
+    Writes the usual sites of type `k` into `usual_sites[k, :num_usual_sites[k]]`."""
     # Choose usual sites: Inversely proportional to squared distance among chosen type
-    usual_sites=[]
-    for k in range(len(mob_rate_per_type)):
-        usual_sites_k=[]
-        # All sites of type k
-        s_args = np.where(site_type == k)[0]
+    for k in range(len(variety_per_type)):
+        # All candidate sites of type k
+        a, b = tile_ptr[k], tile_ptr[k + 1]
 
         # Number of discrete sites to choose from type k
         variety_k = variety_per_type[k]
-        # Probability of sites of type k
-        site_prob = site_prox[s_args] / site_prox[s_args].sum()
-        done = 0
-        while (done < variety_k and len(s_args) > done):
-            # s_idx = np.random.choice(site_prob.shape[0], p=site_prob)
-            # s_idx = np.random.multinomial(1, pvals=site_prob).argmax()
-
-            # numba-stable/compatible way of np.random.choice (otherwise crashes)
-            s_idx = np.searchsorted(np.cumsum(site_prob), np.random.random(), side="right")
-            site = s_args[s_idx]
+        num_usual_sites[k] = 0
+        while (num_usual_sites[k] < variety_k and b - a > num_usual_sites[k]):
+            site = tile_sites[a + _random_choice(state, cum_site_prox[a:b])]
             # Don't pick the same site twice
-            if site not in usual_sites_k:
-                usual_sites_k.append(site)
-                done+=1
+            if not np.any(usual_sites[k, :num_usual_sites[k]] == site):
+                usual_sites[k, num_usual_sites[k]] = site
+                num_usual_sites[k] += 1
 
-        usual_sites.append(usual_sites_k)
-
-    id = 0
-    while t < max_time:
-        # k = np.random.multinomial(1, pvals=site_type_prob).argmax()
-        # k = np.random.choice(site_type_prob.shape[0], p=site_type_prob)
+@numba.njit
+def _usual_cum_mob_rate_per_type(cum_mob_rate_per_type, num_usual_sites):
+    """Cumulative mobility rates per site type of one real individual, where site types without
+    usual sites (e.g. if the home tile has no candidate sites of the type) are skipped (jit for speed)"""
+    skipped = False
+    for k in range(len(num_usual_sites)):
+        rate_k = cum_mob_rate_per_type[k] - (cum_mob_rate_per_type[k - 1] if k > 0 else 0.0)
+        if num_usual_sites[k] == 0 and rate_k > 0:
+            skipped = True
+    if not skipped:
+        return cum_mob_rate_per_type
+
+    usual_cum_mob_rate_per_type = np.empty_like(cum_mob_rate_per_type)
+    tot = 0.0
+    for k in range(len(num_usual_sites)):
+        if num_usual_sites[k] > 0:
+            tot += cum_mob_rate_per_type[k] - (cum_mob_rate_per_type[k - 1] if k > 0 else 0.0)
+        usual_cum_mob_rate_per_type[k] = tot
+    return usual_cum_mob_rate_per_type
 
+@numba.njit
+def _simulate_individual_real_trace(t, t_end, max_time, cum_mob_rate_per_type, dur_mean_per_type, delta,
+                                    usual_sites, num_usual_sites, state):
+    """Simulate the visits with arrival time in [`t`, `t_end`) of the mobility trace of one real individual
+    in a given town (jit for speed), where `t` is the next arrival time of the individual.
+    Uses random stream `state` and the usual sites of the individual (see `_choose_usual_sites`).
+    Returns arrays of arrival times, departure times and sites, and the next arrival time after `t_end`.
+    If the trace ended, i.e. the visit arriving next does not end before `max_time`, its random draws are undone,
+    so the trace continues identically for a later `max_time` (see `MobilitySimulator.extend`)."""
+    # Holds times of arrival and departure and sites of visits
+    visit_t_from, visit_t_to, visit_site = [0.0 for _ in range(0)], [0.0 for _ in range(0)], [0 for _ in range(0)]
+    # Set rates, skipping site types without usual sites
+    cum_mob_rate_per_type = _usual_cum_mob_rate_per_type(cum_mob_rate_per_type, num_usual_sites)
+    tot_mob_rate = cum_mob_rate_per_type[-1]  # Total mobility rate
+
+    while t < min(t_end, max_time):
+        visit_state = state[0]
         # Choose a site type
-        # numba-stable/compatible way of np.random.choice (otherwise crashes)
-        k = np.searchsorted(np.cumsum(site_type_prob), np.random.random(), side="right")
+        k = _random_choice(state, cum_mob_rate_per_type)
 
         # Choose a site among the usuals of type k
-        site = np.random.choice(np.array(usual_sites[k]))
+        site = np.int64(usual_sites[k, int(_random(state) * num_usual_sites[k])])
 
         # Duration: Exponential
-        dur = rd.expovariate(1/dur_mean_per_type[k])
+        dur = _expovariate(state, 1/dur_mean_per_type[k])
         if t + dur > max_time:
+            state[0] = visit_state
             break
-        # Add visit namedtuple to list
-        data.append(Visit(
-            id=id,
-            t_from=t,
-            t_to_shifted=t + dur + delta,
-            t_to=t + dur,
-            indiv=indiv,
-            site=site,
-            duration=dur))
+        # Add visit
+        visit_t_from.append(t)
+        visit_t_to.append(t + dur)
+        visit_site.append(site)
         # Shift time to after visit influence (i.e. duration + delta)
         t += dur + delta
         # Shift time to next start of next visit
-        t += rd.expovariate(tot_mob_rate)
-        # Increment id
-        id += 1
+        t += _expovariate(state, tot_mob_rate)
 
-    return data
+    return np.array(visit_t_from), np.array(visit_t_to), np.array(visit_site), t
 
 @numba.njit
-def _simulate_synthetic_mobility_traces(*, num_people, num_sites, max_time, home_loc, site_loc,
-                            site_type, people_age, mob_rate_per_age_per_type, dur_mean_per_type,
-                            delta, seed):
-    rd.seed(seed)
-    np.random.seed(seed-1)
-    data, visit_counts = list(), list()
-
-    for i in range(num_people):
-
-        # use mobility rates of specific age group
-        mob_rate_per_type = mob_rate_per_age_per_type[people_age[i]]
-        data_i = _simulate_individual_synthetic_trace(
-            indiv=i,
-            num_sites=num_sites,
+def _allocate_visit_columns(visit_counts):
+    """Allocate columns for visits in primary order (`indiv`, `t_from`) given the number of visits
+    per individual. Returns offsets `ptr` of individuals and the columns."""
+    ptr = np.zeros(len(visit_counts) + 1, dtype=np.int64)
+    ptr[1:] = np.cumsum(visit_counts)
+    n = ptr[-1]
+    return (ptr, np.empty(n, dtype=np.float64), np.empty(n, dtype=np.float64), np.empty(n, dtype=np.float64),
+            np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32))
+
+@numba.njit
+def _fill_visit_columns(i, a, first_id, visit_t_from, visit_t_to, visit_site, delta,
+                        t_from, t_to_shifted, t_to, indiv, site, visit_id):
+    """Write the visits of individual `i` with ids starting at `first_id` into the columns starting at position `a`"""
+    for m in range(len(visit_t_from)):
+        t_from[a + m] = visit_t_from[m]
+        t_to_shifted[a + m] = visit_t_to[m] + delta
+        t_to[a + m] = visit_t_to[m]
+        indiv[a + m] = i
+        site[a + m] = visit_site[m]
+        visit_id[a + m] = first_id + m
+
+@numba.njit(parallel=True)
+def _init_synthetic_mobility_streams(*, num_people, people_age, cum_mob_rate_per_age_per_type, seed):
+    """Initialize the state of the mobility traces of all synthetic individuals at time 0, i.e.
+    their random streams `rng_state`, next arrival times `next_t` and next visit ids `next_id`"""
+    rng_state = np.empty(num_people, dtype=np.uint64)
+    next_t = np.empty(num_people, dtype=np.float64)
+    next_id = np.zeros(num_people, dtype=np.int64)
+    for i in numba.prange(num_people):
+        state = rng_state[i:i + 1]
+        state[:] = _random_stream(seed, i)
+        next_t[i] = _expovariate(state, cum_mob_rate_per_age_per_type[people_age[i]][-1])
+    return rng_state, next_t, next_id
+
+@numba.njit(parallel=True)
+def _count_synthetic_mobility_visits(t_end, max_time, home_loc, site_loc, people_age,
+                            cum_mob_rate_per_age_per_type, dur_mean_per_type, grid_sites, grid_ptr,
+                            cell_lo, cell_hi, delta, rng_state, next_t):
+    """Count the visits with arrival time before `t_end` of each individual, without changing the state of the traces"""
+    visit_counts = np.zeros(len(next_t), dtype=np.int64)
+    for i in numba.prange(len(next_t)):
+        visit_t_from, _, _, _ = _simulate_individual_synthetic_trace(
+            t=next_t[i],
+            t_end=t_end,
+            max_time=max_time,
+            home=home_loc[i],
+            site_loc=site_loc,
+            # use mobility rates of specific age group
+            cum_mob_rate_per_type=cum_mob_rate_per_age_per_type[people_age[i]],
+            dur_mean_per_type=dur_mean_per_type,
+            delta=delta,
+            grid_sites=grid_sites,
+            grid_ptr=grid_ptr,
+            cell_lo=cell_lo,
+            cell_hi=cell_hi,
+            state=rng_state[i:i + 1].copy())
+        visit_counts[i] = len(visit_t_from)
+    return visit_counts
+
+@numba.njit(parallel=True)
+def _simulate_synthetic_mobility_traces(*, t_end, max_time, home_loc, site_loc, people_age,
+                            cum_mob_rate_per_age_per_type, dur_mean_per_type, grid_sites, grid_ptr,
+                            cell_lo, cell_hi, delta, rng_state, next_t, next_id):
+    """Simulate the visits with arrival time before `t_end` of all individuals and advance the state of the traces"""
+    # Traces are simulated twice from the same random streams: first to count the visits
+    # of each individual, then to write them into preallocated columns
+    visit_counts = _count_synthetic_mobility_visits(
+        t_end=t_end, max_time=max_time, home_loc=home_loc, site_loc=site_loc, people_age=people_age,
+        cum_mob_rate_per_age_per_type=cum_mob_rate_per_age_per_type, dur_mean_per_type=dur_mean_per_type,
+        grid_sites=grid_sites, grid_ptr=grid_ptr, cell_lo=cell_lo, cell_hi=cell_hi, delta=delta,
+        rng_state=rng_state, next_t=next_t)
+
+    ptr, t_from, t_to_shifted, t_to, indiv, site, visit_id = _allocate_visit_columns(visit_counts)
+    for i in numba.prange(len(next_t)):
+        visit_t_from, visit_t_to, visit_site, next_t[i] = _simulate_individual_synthetic_trace(
+            t=next_t[i],
+            t_end=t_end,
             max_time=max_time,
-            home_loc=home_loc,
+            home=home_loc[i],
             site_loc=site_loc,
-            site_type=site_type,
-            mob_rate_per_type=mob_rate_per_type,
+            cum_mob_rate_per_type=cum_mob_rate_per_age_per_type[people_age[i]],
+            dur_mean_per_type=dur_mean_per_type,
+            delta=delta,
+            grid_sites=grid_sites,
+            grid_ptr=grid_ptr,
+            cell_lo=cell_lo,
+            cell_hi=cell_hi,
+            state=rng_state[i:i + 1])
+        _fill_visit_columns(i, ptr[i], next_id[i], visit_t_from, visit_t_to, visit_site, delta,
+                            t_from, t_to_shifted, t_to, indiv, site, visit_id)
+        next_id[i] += len(visit_t_from)
+
+    return t_from, t_to_shifted, t_to, indiv, site, visit_id
+
+@numba.njit(parallel=True)
+def _init_real_mobility_streams(*, num_people, people_age, cum_mob_rate_per_age_per_type, home_tile, tile_sites,
+                                tile_ptr, tile_site_cum_prox, tile_prox_ptr, variety_per_type, seed):
+    """Initialize the state of the mobility traces of all real individuals at time 0, i.e.
+    their random streams `rng_state`, next arrival times `next_t`, next visit ids `next_id`
+    and usual sites (see `_choose_usual_sites`)"""
+    rng_state = np.empty(num_people, dtype=np.uint64)
+    next_t = np.empty(num_people, dtype=np.float64)
+    next_id = np.zeros(num_people, dtype=np.int64)
+    usual_sites = np.zeros((num_people, len(variety_per_type), max(np.max(variety_per_type), 1)), dtype=np.int32)
+    num_usual_sites = np.zeros((num_people, len(variety_per_type)), dtype=np.int64)
+    for i in numba.prange(num_people):
+        state = rng_state[i:i + 1]
+        state[:] = _random_stream(seed, i)
+        tot_mob_rate = cum_mob_rate_per_age_per_type[people_age[i]][-1]
+        next_t[i] = _expovariate(state, tot_mob_rate)
+        # use site proximities from specific tiles
+        _choose_usual_sites(variety_per_type, tile_sites, tile_ptr[home_tile[i]],
+                            tile_site_cum_prox[tile_prox_ptr[home_tile[i]]:], usual_sites[i], num_usual_sites[i], state)
+        # first arrival at the total rate of the site types with usual sites
+        usual_tot_mob_rate = _usual_cum_mob_rate_per_type(
+            cum_mob_rate_per_age_per_type[people_age[i]], num_usual_sites[i])[-1]
+        if usual_tot_mob_rate != tot_mob_rate:
+            next_t[i] = next_t[i] * tot_mob_rate / usual_tot_mob_rate if usual_tot_mob_rate > 0 else np.inf
+    return rng_state, next_t, next_id, usual_sites, num_usual_sites
+
+@numba.njit(parallel=True)
+def _count_real_mobility_visits(t_end, max_time, people_age, cum_mob_rate_per_age_per_type, dur_mean_per_type,
+                                delta, rng_state, next_t, usual_sites, num_usual_sites):
+    """Count the visits with arrival time before `t_end` of each individual, without changing the state of the traces"""
+    visit_counts = np.zeros(len(next_t), dtype=np.int64)
+    for i in numba.prange(len(next_t)):
+        visit_t_from, _, _, _ = _simulate_individual_real_trace(
+            t=next_t[i],
+            t_end=t_end,
+            max_time=max_time,
+            # use mobility rates of specific age group
+            cum_mob_rate_per_type=cum_mob_rate_per_age_per_type[people_age[i]],
             dur_mean_per_type=dur_mean_per_type,
-            delta=delta)
+            delta=delta,
+            usual_sites=usual_sites[i],
+            num_usual_sites=num_usual_sites[i],
+            state=rng_state[i:i + 1].copy())
+        visit_counts[i] = len(visit_t_from)
+    return visit_counts
+
+@numba.njit(parallel=True)
+def _simulate_real_mobility_traces(*, t_end, max_time, people_age, cum_mob_rate_per_age_per_type, dur_mean_per_type,
+                                   delta, rng_state, next_t, next_id, usual_sites, num_usual_sites):
+    """Simulate the visits with arrival time before `t_end` of all individuals and advance the state of the traces"""
+    # Traces are simulated twice from the same random streams: first to count the visits
+    # of each individual, then to write them into preallocated columns
+    visit_counts = _count_real_mobility_visits(
+        t_end=t_end, max_time=max_time, people_age=people_age,
+        cum_mob_rate_per_age_per_type=cum_mob_rate_per_age_per_type, dur_mean_per_type=dur_mean_per_type,
+        delta=delta, rng_state=rng_state, next_t=next_t, usual_sites=usual_sites, num_usual_sites=num_usual_sites)
+
+    ptr, t_from, t_to_shifted, t_to, indiv, site, visit_id = _allocate_visit_columns(visit_counts)
+    for i in numba.prange(len(next_t)):
+        visit_t_from, visit_t_to, visit_site, next_t[i] = _simulate_individual_real_trace(
+            t=next_t[i],
+            t_end=t_end,
+            max_time=max_time,
+            cum_mob_rate_per_type=cum_mob_rate_per_age_per_type[people_age[i]],
+            dur_mean_per_type=dur_mean_per_type,
+            delta=delta,
+            usual_sites=usual_sites[i],
+            num_usual_sites=num_usual_sites[i],
+            state=rng_state[i:i + 1])
+        _fill_visit_columns(i, ptr[i], next_id[i], visit_t_from, visit_t_to, visit_site, delta,
+                            t_from, t_to_shifted, t_to, indiv, site, visit_id)
+        next_id[i] += len(visit_t_from)
 
-        data.extend(data_i)
-        visit_counts.append(len(data_i))
+    return t_from, t_to_shifted, t_to, indiv, site, visit_id
 
-    return data, visit_counts
 
 @numba.njit
-def _simulate_real_mobility_traces(*, num_people, max_time, site_type, people_age, mob_rate_per_age_per_type,
-                            dur_mean_per_type, home_tile, tile_site_dist, variety_per_type, delta, seed):
-    rd.seed(seed)
-    np.random.seed(seed-1)
-    data, visit_counts = list(), list()
-
-    for i in range(num_people):
-        # use mobility rates of specific age group
-        mob_rate_per_type = mob_rate_per_age_per_type[people_age[i]]
-        # use site distances from specific tiles
-        site_dist = tile_site_dist[home_tile[i]]
-
-        data_i = _simulate_individual_real_trace(
-            indiv=i,
-            max_time=max_time,
-            site_type=site_type,
-            mob_rate_per_type=mob_rate_per_type,
-            dur_mean_per_type=dur_mean_per_type,
-            delta=delta,
-            variety_per_type=variety_per_type,
-            site_dist=site_dist)
+def _resolve_batch_visits(ptr, t_from, dur, delta, max_time):
+    """Marks the visits kept when resolving the overlaps of the visits of each individual `ptr[i]:ptr[i+1]`
+    (sorted by arrival time `t_from`) drawn independently by `MobilitySimulator._simulate_mobility_batch` (jit for speed).
+    Arrivals during the influence of a kept visit (its duration `dur` plus `delta`) are dropped, and the trace ends
+    at the first visit not ending before `max_time`, as in `_simulate_individual_real_trace`."""
+    keep = np.zeros(len(t_from), dtype=np.bool_)
+    for i in range(len(ptr) - 1):
+        busy_until = -np.inf
+        for m in range(ptr[i], ptr[i + 1]):
+            if t_from[m] < busy_until:
+                continue
+            if t_from[m] + dur[m] > max_time:
+                break
+            keep[m] = True
+            busy_until = t_from[m] + dur[m] + delta
+    return keep
+
+
+@numba.njit
+def _find_contacts_of_indiv(inf_indiv, inf_visit_t_from, inf_visit_t_to, inf_visit_t_to_shifted, inf_visit_site,
+                            inf_visit_id, reveal, tmin, tmax, extended_time_window,
+                            t_from, t_to, t_to_shifted, indiv, visit_id, site,
+                            site_ptr, site_order, site_t_from, site_max_span, removed):
+    """Find all delta-contacts caused by the visits `inf_visit_*` of individual `inf_indiv` with the visits
+    of a `VisitStore`, skipping visits with `reveal[inf_k] == False` and visits of the store with `removed[k] == True`
+    (jit for speed). Returns parallel arrays of the contacts."""
+
+    # pairs of (visit at risk, infector visit) of all contacts
+    contact_k, contact_inf_k = [0 for _ in range(0)], [0 for _ in range(0)]
+
+    for inf_k in range(len(inf_visit_t_from)):
+        if not reveal[inf_k]:
+            continue
+
+        s = inf_visit_site[inf_k]
+        inf_t_from, inf_t_to, inf_t_to_shifted = inf_visit_t_from[inf_k], inf_visit_t_to[inf_k], inf_visit_t_to_shifted[inf_k]
+
+        # visits at site `s` overlapping [inf_t_from, inf_t_to_shifted] (see `VisitStore.site_window`)
+        lo, hi = site_ptr[s], site_ptr[s + 1]
+        a = lo + np.searchsorted(site_t_from[lo:hi], inf_t_from - site_max_span[s])
+        b = lo + np.searchsorted(site_t_from[lo:hi], inf_t_to_shifted, side='right')
+
+        for pos in range(a, b):
+            k = site_order[pos]
+
+            # ignore non-overlapping visits and visits of the infector, since it is not a contact
+            # ignore if begin of visit is after tmax
+            # this can happen if inf_visit starts just before tmax but continues way beyond tmax
+            if t_to_shifted[k] < inf_t_from or indiv[k] == inf_indiv or t_from[k] > tmax or removed[k]:
+                continue
 
-        data.extend(data_i)
-        visit_counts.append(len(data_i))
+            # contact only if the overlap (including `extended_time_window`) is non-empty
+            c_t_from = max(t_from[k], inf_t_from)
+            c_t_to = min(t_to[k], inf_t_to + extended_time_window)
+            if c_t_to > c_t_from and c_t_to > tmin:
+                contact_k.append(k)
+                contact_inf_k.append(inf_k)
+
+    n = len(contact_k)
+    c_t_from = np.empty(n, dtype=np.float64)
+    c_t_to = np.empty(n, dtype=np.float64)
+    c_t_to_direct = np.empty(n, dtype=np.float64)
+    c_indiv_i = np.empty(n, dtype=np.int32)
+    c_site = np.empty(n, dtype=np.int32)
+    c_id_i = np.empty(n, dtype=np.int32)
+    c_id_j = np.empty(n, dtype=np.int32)
+    for m in range(n):
+        k, inf_k = contact_k[m], contact_inf_k[m]
+        c_t_from[m] = max(t_from[k], inf_visit_t_from[inf_k])
+        c_t_to[m] = min(t_to[k], inf_visit_t_to[inf_k] + extended_time_window)
+        c_t_to_direct[m] = min(t_to[k], inf_visit_t_to[inf_k])  # only direct
+        c_indiv_i[m] = indiv[k]
+        c_site[m] = site[k]
+        c_id_i[m] = visit_id[k]
+        c_id_j[m] = inf_visit_id[inf_k]
+
+    return c_t_from, c_t_to, c_t_to_direct, c_indiv_i, c_site, c_id_i, c_id_j
 
-    return data, visit_counts
+
+@numba.njit
+def _sweep_site_contacts(a, b, delta, site_order, t_from, t_to, indiv, contact_k, contact_inf_k, n):
+    """Sweep-line pass over the visits `site_order[a:b]` of one site sorted by `t_from` (jit for speed).
+    Writes the pairs (visit at risk, infector visit) of all delta-contacts at the site into
+    `contact_k[n:]` and `contact_inf_k[n:]` if given (otherwise only counts them) and returns the new count."""
+    # visits that may still overlap with later visits, i.e. with `t_to` + `delta` > current time
+    active = np.empty(b - a, dtype=np.int64)
+    num_active = 0
+    for pos in range(a, b):
+        v = site_order[pos]
+
+        # drop visits that ended (including `delta`) before arrival of `v`
+        m = 0
+        for q in range(num_active):
+            if t_to[active[q]] + delta > t_from[v]:
+                active[m] = active[q]
+                m += 1
+        num_active = m
+
+        for q in range(num_active):
+            u = active[q]
+            if indiv[u] == indiv[v]:
+                continue
+            # `v` at risk due to `u`, and `u` at risk due to `v` (same contact condition as `_find_contacts_of_indiv`)
+            for r in range(2):
+                k, inf_k = (v, u) if r == 0 else (u, v)
+                if min(t_to[k], t_to[inf_k] + delta) > max(t_from[k], t_from[inf_k]):
+                    if contact_k is not None:
+                        contact_k[n] = k
+                        contact_inf_k[n] = inf_k
+                    n += 1
+
+        active[num_active] = v
+        num_active += 1
+    return n
+
+@numba.njit(parallel=True)
+def _find_all_site_contacts(delta, site_ptr, site_order, t_from, t_to, indiv):
+    """Find the pairs (visit at risk, infector visit) of all delta-contacts by a sweep-line pass
+    over the visits of each site, in parallel across sites (jit for speed)"""
+    num_sites = len(site_ptr) - 1
+    counts = np.zeros(num_sites, dtype=np.int64)
+    for s in numba.prange(num_sites):
+        counts[s] = _sweep_site_contacts(site_ptr[s], site_ptr[s + 1], delta, site_order, t_from, t_to, indiv,
+                                         None, None, 0)
+    offsets = np.zeros(num_sites + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)
+
+    contact_k = np.empty(offsets[-1], dtype=np.int64)
+    contact_inf_k = np.empty(offsets[-1], dtype=np.int64)
+    for s in numba.prange(num_sites):
+        _sweep_site_contacts(site_ptr[s], site_ptr[s + 1], delta, site_order, t_from, t_to, indiv,
+                             contact_k, contact_inf_k, offsets[s])
+    return contact_k, contact_inf_k
+
+
+@numba.njit(parallel=True)
+def _site_contact_time(delta, site_ptr, site_order, t_from, t_to, indiv):
+    """Total duration of all delta-contacts at each site by the same sweep-line pass as
+    `_sweep_site_contacts`, in parallel across sites (jit for speed)"""
+    num_sites = len(site_ptr) - 1
+    contact_time = np.zeros(num_sites)
+    for s in numba.prange(num_sites):
+        a, b = site_ptr[s], site_ptr[s + 1]
+        active = np.empty(b - a, dtype=np.int64)
+        num_active = 0
+        total = 0.0
+        for pos in range(a, b):
+            v = site_order[pos]
+            m = 0
+            for q in range(num_active):
+                if t_to[active[q]] + delta > t_from[v]:
+                    active[m] = active[q]
+                    m += 1
+            num_active = m
+
+            for q in range(num_active):
+                u = active[q]
+                if indiv[u] == indiv[v]:
+                    continue
+                for r in range(2):
+                    k, inf_k = (v, u) if r == 0 else (u, v)
+                    duration = min(t_to[k], t_to[inf_k] + delta) - max(t_from[k], t_from[inf_k])
+                    if duration > 0:
+                        total += duration
+
+            active[num_active] = v
+            num_active += 1
+        contact_time[s] = total
+    return contact_time
+
+
+def mean_invariant_beta_multiplier(beta_multiplier, weights, mode):
+    """Returns normalized beta multipliers from `beta_multiplier` such that the average over the betas
+    of all site types weighted by `weights` (per site type, in the order of `beta_multiplier`) remains invariant."""
+    beta_multiplier_array = np.asarray(list(beta_multiplier.values()), dtype=np.float64)
+    numerator = np.asarray(weights, dtype=np.float64)
+    denominator = numerator * beta_multiplier_array
+
+    if mode == 'rescale_all':
+        # [beta, x*beta, 1/x * beta, beta, beta] -> scaling * np.asarray([beta, x*beta, 1/x * beta, beta, beta])
+        scaling = np.sum(numerator) / np.sum(denominator)
+        beta_multiplier_array *= scaling
+    elif mode == 'rescale_scaled':
+        # [beta, x*beta, 1/x * beta, beta, beta] -> [beta, scaling * x*beta, scaling * 1/x * beta, beta, beta]
+        is_sitetype_scaled = np.where(beta_multiplier_array != 1.0)
+        scaling = np.sum(numerator[is_sitetype_scaled]) / np.sum(denominator[is_sitetype_scaled])
+        beta_multiplier_array[is_sitetype_scaled] *= scaling
+
+    return {key: beta_multiplier_array[k] for k, key in enumerate(beta_multiplier.keys())}
 
 
 def compute_mean_invariant_beta_multipliers(beta_multipliers, country, area, max_time, full_scale=True,
-                                            weighting='integrated_contact_time', mode='rescale_all'):
+                                            weighting='integrated_contact_time', mode='rescale_all', rollouts=1,
+                                            seed=None):
     # Load mob settings
     mob_settings_file = calibration_mob_paths[country][area][1 if full_scale else 0]
-    with open(mob_settings_file, 'rb') as fp:
-        mob_settings = pickle.load(fp)
+    mob_settings = load_settings(mob_settings_file)
 
     mob = MobilitySimulator(**mob_settings)
-    mob.simulate(max_time=max_time)
     mean_invariant_multipliers = mob.compute_mean_invariant_beta_multiplier(beta_multiplier=beta_multipliers,
                                                                             weighting=weighting,
-                                                                            mode=mode)
+                                                                            mode=mode,
+                                                                            rollouts=rollouts,
+                                                                            max_time=max_time,
+                                                                            seed=seed)
     return mean_invariant_multipliers
 
 
@@ -289,7 +1584,7 @@ class MobilitySimulator:
                 mob_rate_per_age_per_type=None, dur_mean_per_type=None, home_tile=None,
                 tile_site_dist=None, variety_per_type=None, people_household=None, downsample=None,
                 num_people=None, num_people_unscaled=None, num_sites=None, mob_rate_per_type=None,
-                dur_mean=None, num_age_groups=None, seed=None, beacon_config=None, verbose=False):
+                dur_mean=None, num_age_groups=None, seed=None, beacon_config=None, site_has_beacon=None, verbose=False):
         """
         delta : float
             Time delta to extend contacts
@@ -299,8 +1594,6 @@ class MobilitySimulator:
             Age group of each individual
         people_household : list of int
             Household of each individual
-        households : dict with key=household, value=individual
-            Individuals on each household
         site_loc : list of [float,float]
             Site coordinates
         site_type : list of int
@@ -320,9 +1613,11 @@ class MobilitySimulator:
             Mean duration of a visit per site type
         home_tile : list of int
             Tile indicator for each home
-        tile_site_dist: 2D int array
+        tile_site_dist: 2D int array or SparseTileSiteDist
             Pairwise distances between tile centers and sites.
             Rows correspond to tiles, columns correspond to sites.
+            If sparse (see `lib.mobilitysettings.sparsify_tile_site_dist`), individuals only
+            choose among the kept nearest sites of their home tile.
         variety_per_type : list of int
             Number of discrete sites per type
         num_people : int
@@ -339,6 +1634,9 @@ class MobilitySimulator:
             Number of age groups
         beacon_config: dict
             Beacons implementation configuration
+        site_has_beacon: array of bool (optional, default: None)
+            Precomputed beacon placement for `beacon_config` (see `place_beacons`), e.g. computed once
+            for all repeats of a simulation. Placed at construction time if None.
         verbose : bool (optional, default: False)
             Verbosity level
         """
@@ -373,7 +1671,7 @@ class MobilitySimulator:
             self.people_age = np.random.randint(low=0, high=num_age_groups,
                                                 size=self.num_people, dtype=int)
             self.people_household = None
-            self.households = None
+            self.indiv_household = self.household_indiv = self.household_ptr = None
             self.daily_tests_unscaled =None
 
             self.num_sites = num_sites
@@ -395,7 +1693,12 @@ class MobilitySimulator:
             self.variety_per_type = None
             
             self.home_tile=None
-            self.tile_site_dist=None
+            self.tile_sites, self.tile_ptr, self.tile_site_cum_prox, self.tile_prox_ptr = None, None, None, None
+            self.tile_site_truncation_error = 0.0
+
+            # spatial index of sites reused for every simulation
+            self.grid_sites, self.grid_ptr, self.cell_lo, self.cell_hi = _site_grid(
+                site_loc=self.site_loc, site_type=self.site_type, num_site_types=self.num_site_types)
 
         elif real:
 
@@ -412,16 +1715,16 @@ class MobilitySimulator:
             if people_household is not None:
                 self.people_household = np.array(people_household)
             
-                # create dict of households, to retreive household members in O(1) during household infections
-                self.households = {}
-                for i in range(self.num_people):
-                    if self.people_household[i] in self.households:
-                        self.households[people_household[i]].append(i)
-                    else:
-                        self.households[people_household[i]] = [i]
+                # CSR arrays of households, to retreive household members in O(1) during household infections:
+                # the members of household `h` are `household_indiv[household_ptr[h]:household_ptr[h+1]]`,
+                # where `indiv_household` is the (contiguous) household index of each individual
+                _, self.indiv_household = np.unique(self.people_household, return_inverse=True)
+                self.household_indiv = np.argsort(self.indiv_household, kind='stable')
+                self.household_ptr = np.zeros(self.indiv_household.max() + 2, dtype=np.int64)
+                np.cumsum(np.bincount(self.indiv_household), out=self.household_ptr[1:])
             else:
                 self.people_household = None
-                self.households = {}
+                self.indiv_household = self.household_indiv = self.household_ptr = None
 
             self.num_sites = len(site_loc)
             self.site_loc = np.array(site_loc)
@@ -438,7 +1741,19 @@ class MobilitySimulator:
             self.variety_per_type=np.array(variety_per_type)
 
             self.home_tile=np.array(home_tile)
-            self.tile_site_dist=np.array(tile_site_dist)
+            if isinstance(tile_site_dist, SparseTileSiteDist):
+                # bound on the total variation distance of the choice of a usual site due to truncation
+                self.tile_site_truncation_error = float(np.max(tile_site_dist.truncation_error))
+                if verbose:
+                    print(f'Sparse tile-site distances with truncation error at most {self.tile_site_truncation_error:.2e}')
+            else:
+                self.tile_site_truncation_error = 0.0
+
+            # site choice tables shared by all residents of a tile and reused for every simulation;
+            # the distances themselves are not kept
+            self.tile_sites, self.tile_ptr, self.tile_site_cum_prox, self.tile_prox_ptr = _site_choice_tables(
+                site_type=self.site_type, num_site_types=self.num_site_types, tile_site_dist=tile_site_dist)
+            self.grid_sites, self.grid_ptr, self.cell_lo, self.cell_hi = None, None, None, None
 
         else:
             raise ValueError('Provide more information for the generation of mobility data.')
@@ -448,36 +1763,83 @@ class MobilitySimulator:
             self.site_dict = {0: 'education', 1: 'social', 2: 'bus_stop', 3: 'office', 4: 'supermarket'}
         else:
             self.site_dict = site_dict
+
+        # site types visited by any age group must have sites
+        n_sites_per_type = np.bincount(self.site_type, minlength=self.num_site_types)
+        missing_types = np.where((n_sites_per_type == 0) & (self.mob_rate_per_age_per_type.max(axis=0) > 0))[0]
+        if len(missing_types) > 0:
+            raise ValueError('No sites of site type(s) {} with positive mobility rate.'.format(
+                ', '.join(str(self.site_dict.get(k, k)) for k in missing_types)))
+
+        # and candidate sites for every home tile in real mode
+        if self.mode == 'real':
+            home_tiles = np.unique(self.home_tile)
+            no_candidates = (np.diff(self.tile_ptr[home_tiles], axis=1) == 0) & \
+                            (self.mob_rate_per_age_per_type.max(axis=0) > 0)
+            if np.any(no_candidates):
+                tiles, types = np.nonzero(no_candidates)
+                raise ValueError('No candidate sites of site type {} for home tile {} with positive mobility rate.'.format(
+                    self.site_dict.get(types[0], types[0]), home_tiles[tiles[0]]))
         self.delta = delta
         self.verbose = verbose
 
+        # streaming mode is only set by `simulate`
+        self.window = None
+
         self.beacon_config = beacon_config
-        self.site_has_beacon = self.place_beacons(
-            beacon_config=beacon_config, rollouts=10, max_time=28 * TO_HOURS)
+        if site_has_beacon is not None:
+            self.site_has_beacon = np.asarray(site_has_beacon, dtype=bool)
+            if self.site_has_beacon.shape != (self.num_sites,):
+                raise ValueError('`site_has_beacon` must contain one entry per site.')
+        else:
+            self.site_has_beacon = self.place_beacons(
+                beacon_config=beacon_config, rollouts=BEACON_ROLLOUTS, max_time=BEACON_MAX_TIME)
 
     '''Beacon information computed at test time'''
 
-    def compute_site_priority(self, rollouts, max_time, beta_multipliers=None):
-        """Computes site priority by integrated visit time scaled with site specific beta."""
+    def _rollouts(self, rollouts, max_time, seed=None, num_threads=None):
+        """Yields the visits of `rollouts` mobility simulations of `max_time` time units. If `seed` is given,
+        the rollouts use fixed seeds derived from it and the random state of the caller is left unchanged."""
+        if seed is None:
+            for _ in range(rollouts):
+                yield self._simulate_mobility(max_time=max_time, num_threads=num_threads)
+            return
+
+        rd_state, np_state = rd.getstate(), np.random.get_state()
+        try:
+            for rollout_seed in rd.Random(seed).sample(range(1, 2**32 - 1), rollouts):
+                yield self._simulate_mobility(max_time=max_time, seed=rollout_seed, num_threads=num_threads)
+        finally:
+            rd.setstate(rd_state)
+            np.random.set_state(np_state)
+
+    def compute_site_score(self, rollouts, max_time, beta_multipliers=None, seed=None):
+        """Computes integrated visit time per site scaled with site specific beta over `rollouts` mobility
+        simulations. If `seed` is given, the rollouts use fixed seeds derived from it."""
         if beta_multipliers:
             weights = beta_multipliers
         else:
             weights = {key: 1.0 for key in self.site_dict.values()}
 
+        weight_per_site = np.array([weights[self.site_dict[k]] for k in self.site_type])
         time_at_site = np.zeros(self.num_sites)
-        for _ in range(rollouts):
-            all_mob_traces = self._simulate_mobility(max_time=max_time)
-            for v in all_mob_traces:
-                site_type = self.site_dict[self.site_type[v.site]]
-                time_at_site[v.site] += v.duration * weights[site_type]
+        for visits in self._rollouts(rollouts, max_time, seed=seed):
+            occupancy = self.site_occupancy(bin_width=max_time, t0=0.0, t1=max_time, visits=visits)
+            time_at_site += occupancy.person_hours[:, 0] * weight_per_site
+        return time_at_site
+
+    def compute_site_priority(self, rollouts, max_time, beta_multipliers=None, seed=None):
+        """Computes site priority by integrated visit time scaled with site specific beta."""
+        time_at_site = self.compute_site_score(rollouts, max_time, beta_multipliers=beta_multipliers, seed=seed)
         temp = time_at_site.argsort()
         site_priority = np.empty_like(temp)
         site_priority[temp] = np.arange(len(time_at_site))
         return site_priority
 
-    def place_beacons(self, *, beacon_config, rollouts, max_time):
+    def place_beacons(self, *, beacon_config, rollouts, max_time, seed=None):
         '''
-        Computes whether or not a given site has a beacon installed
+        Computes whether or not a given site has a beacon installed.
+        For mode `visit_freq`, `seed` fixes the mobility rollouts used to score the sites.
         '''
 
         if beacon_config is None:
@@ -507,75 +1869,139 @@ class MobilitySimulator:
             except KeyError:
                 beta_multipliers = None
 
-            # compute beacon locations
+            # beacons at the sites with priority (i.e. rank of score) above `(num_sites - 1) * (1 - proportion_with_beacon)`
             site_has_beacon = np.zeros(self.num_sites, dtype=bool)
-            site_priority = self.compute_site_priority(rollouts, max_time, beta_multipliers=beta_multipliers)
-            for k in range(len(site_has_beacon)):
-                if site_priority[k] > max(site_priority) * (1 - proportion_with_beacon):
-                    site_has_beacon[k] = True
+            n_beacons = int(np.sum(np.arange(self.num_sites) > (self.num_sites - 1) * (1 - proportion_with_beacon)))
+            if n_beacons > 0:
+                score = self.compute_site_score(rollouts, max_time, beta_multipliers=beta_multipliers, seed=seed)
+                site_has_beacon[np.argpartition(score, self.num_sites - n_beacons)[self.num_sites - n_beacons:]] = True
             return site_has_beacon
         
         else:
             raise ValueError('Invalid `beacon_config` mode.')
 
+    def site_occupancy(self, bin_width, t0=0.0, t1=None, by_type=False, sparse=False, visits=None):
+        """
+        Computes the occupancy of all sites in consecutive time bins of width `bin_width` in [t0, t1]
+        in one vectorized pass over the visits. A visit is present at its site during [`t_from`, `t_to`].
+
+        Parameters
+        ----------
+        bin_width : float
+            Width of time bins; the last bin ends at `t1` and may be shorter
+        t0 : float (optional, default: 0.0)
+            Begin of first bin
+        t1 : float (optional, default: None)
+            End of last bin; `max_time` of the simulation if None
+        by_type : bool (optional, default: False)
+            If True, occupancy is aggregated per site type, i.e. rows correspond to site types
+        sparse : bool (optional, default: False)
+            If True, `occupancy` and `person_hours` are returned as `scipy.sparse.csr_matrix`
+        visits : VisitStore (optional, default: None)
+            Visits to use instead of the visits of the last simulation
+
+        Returns
+        -------
+        occupancy : SiteOccupancy
+            Bin edges, number of visits overlapping each bin and person-hours spent in each bin per site (or type)
+        """
+        t1 = self.max_time if t1 is None else t1
+        if visits is None:
+            if (getattr(self, 'window', None) is not None and t0 < self.keep_from
+                    and not isinstance(self.visits, ChunkedVisitStore)):
+                raise ValueError('Visits before `keep_from` were dropped in streaming mode; '
+                                 'use `simulate` without `window` to compute their occupancy.')
+            stores = self._visit_stores(t0, t1)
+        else:
+            stores = [visits]
+
+        num_bins = max(int(np.ceil((t1 - t0) / bin_width)), 1)
+        bins = np.minimum(t0 + bin_width * np.arange(num_bins + 1), t1)
+
+        # visits present in [t0, t1], clipped to [t0, t1]
+        t_from, t_to, rows = [np.zeros(0)], [np.zeros(0)], [np.zeros(0, dtype=np.int64)]
+        for visits in stores:
+            idx = visits.window(t0, t1)
+            idx = idx[(visits.t_to[idx] > t0) & (visits.t_from[idx] < t1)]
+            t_from.append(np.maximum(visits.t_from[idx], t0))
+            t_to.append(np.minimum(visits.t_to[idx], t1))
+            rows.append(self.site_type[visits.site[idx]] if by_type else visits.site[idx])
+        t_from, t_to, rows = np.concatenate(t_from), np.concatenate(t_to), np.concatenate(rows)
+        num_rows = self.num_site_types if by_type else self.num_sites
+
+        # expand every visit into the bins it overlaps
+        first = np.minimum(((t_from - t0) // bin_width).astype(np.int64), num_bins - 1)
+        last = np.minimum(((t_to - t0) // bin_width).astype(np.int64), num_bins - 1)
+        n_bins = last - first + 1
+        entry = np.repeat(np.arange(len(t_from)), n_bins)
+        entry_bin = first[entry] + (np.arange(len(entry)) - np.repeat(np.cumsum(n_bins) - n_bins, n_bins))
+        overlap = (np.minimum(t_to[entry], bins[entry_bin + 1]) - np.maximum(t_from[entry], bins[entry_bin]))
+        entry_row = rows[entry]
+
+        # visits only touching a bin edge do not count as present in the bin
+        present = overlap > 0
+        entry_row, entry_bin, overlap = entry_row[present], entry_bin[present], overlap[present]
+
+        if sparse:
+            occupancy = sp.sparse.coo_matrix((np.ones(len(overlap), dtype=np.int64), (entry_row, entry_bin)),
+                                             shape=(num_rows, num_bins)).tocsr()
+            person_hours = sp.sparse.coo_matrix((overlap, (entry_row, entry_bin)),
+                                                shape=(num_rows, num_bins)).tocsr()
+        else:
+            flat = entry_row.astype(np.int64) * num_bins + entry_bin
+            occupancy = np.bincount(flat, minlength=num_rows * num_bins).reshape(num_rows, num_bins)
+            person_hours = np.bincount(flat, weights=overlap, minlength=num_rows * num_bins).reshape(num_rows, num_bins)
+
+        return SiteOccupancy(bins=bins, occupancy=occupancy, person_hours=person_hours)
+
     '''Methods to calculate beta multiplier scaling to keep course of epidemic invariant in presence of beta dispersion'''
 
-    def compute_integrated_visit_time_proportion_per_site_type(self, rollouts, max_time):
+    def compute_integrated_visit_time_proportion_per_site_type(self, rollouts, max_time, seed=None):
+        """Proportion of the integrated visit time at each site type, averaged over `rollouts` mobility
+        simulations of `max_time` time units. If `seed` is given, the rollouts use fixed seeds derived from it."""
         time_at_site_type = np.zeros(self.num_site_types)
-        for _ in range(rollouts):
-            all_mob_traces = self._simulate_mobility(max_time=max_time)
-            for v in all_mob_traces:
-                time_at_site_type[self.site_type[v.site]] += v.duration
+        for visits in self._rollouts(rollouts, max_time, seed=seed):
+            occupancy = self.site_occupancy(bin_width=max_time, t0=0.0, t1=max_time, by_type=True, visits=visits)
+            time_at_site_type += occupancy.person_hours[:, 0]
         return time_at_site_type / np.sum(time_at_site_type)
 
-    def compute_integrated_contact_time_proportion_per_site_type(self, average_n_people, max_time):
+    def compute_integrated_contact_time_proportion_per_site_type(self, rollouts, max_time, seed=None,
+                                                                 num_threads=None):
+        """Proportion of the integrated duration of all delta-contacts at each site type, averaged over `rollouts`
+        mobility simulations of `max_time` time units. If `seed` is given, the rollouts use fixed seeds derived from it.
+        Contact durations are summed by a sweep-line pass over the visits of each site (see `compute_contact_graph`),
+        without materializing the contacts."""
         contact_time_at_site_type = np.zeros(self.num_site_types)
-        self.simulate(max_time=max_time)
-        random_people = np.random.uniform(0, self.num_people, average_n_people).astype(np.int)
-        for person in random_people:
-            contacts = self.find_contacts_of_indiv(person, tmin=0, tmax=max_time)
-            for contact in contacts:
-                contact_time_at_site_type[self.site_type[contact.site]] += contact.duration
+        for visits in self._rollouts(rollouts, max_time, seed=seed, num_threads=num_threads):
+            with _numba_num_threads(num_threads):
+                contact_time_at_site = _site_contact_time(
+                    self.delta, visits.site_ptr, visits.site_order, visits.t_from, visits.t_to, visits.indiv)
+            contact_time_at_site_type += np.bincount(self.site_type, weights=contact_time_at_site,
+                                                     minlength=self.num_site_types)
         return contact_time_at_site_type / np.sum(contact_time_at_site_type)
 
-    def compute_mean_invariant_beta_multiplier(self, beta_multiplier, weighting, mode):
-        """Computes normalized beta multipliers from `beta_multiplier` such that the weighted average over the
-        betas at all sites remains invariant. Depending on the quantity that is supposed to be kept invariant,
-        the weights are calculated in different ways."""
-
-        n_sites_per_type = np.asarray([(np.array(self.site_type) == i).sum() for i in range(self.num_site_types)])
-        beta_multiplier_array = np.asarray(list(beta_multiplier.values()))
-
+    def compute_integrated_time_proportion_per_site_type(self, weighting, rollouts=1, max_time=28 * TO_HOURS,
+                                                         seed=None):
+        """Weights of the site types used by `compute_mean_invariant_beta_multiplier` for `weighting`"""
         if weighting == 'sites_per_type':
-            numerator = n_sites_per_type
-            denominator = n_sites_per_type * beta_multiplier_array
+            return np.bincount(self.site_type, minlength=self.num_site_types).astype(np.float64)
         elif weighting == 'integrated_visit_time':
-            integrated_visit_time = self.compute_integrated_visit_time_proportion_per_site_type(
-                max_time=28 * TO_HOURS, rollouts=1)
-            numerator = integrated_visit_time
-            denominator = integrated_visit_time * beta_multiplier_array
+            return self.compute_integrated_visit_time_proportion_per_site_type(
+                rollouts=rollouts, max_time=max_time, seed=seed)
         elif weighting == 'integrated_contact_time':
-            integrated_contact_time = self.compute_integrated_contact_time_proportion_per_site_type(
-                max_time=28 * TO_HOURS, average_n_people=int(self.num_people/10))
-            numerator = integrated_contact_time
-            denominator = integrated_contact_time * beta_multiplier_array
+            return self.compute_integrated_contact_time_proportion_per_site_type(
+                rollouts=rollouts, max_time=max_time, seed=seed)
         else:
-            numerator, denominator = None, None
-            NotImplementedError('Invalid beta weighting method specified')
-
-        if mode == 'rescale_all':
-            # [beta, x*beta, 1/x * beta, beta, beta] -> scaling * np.asarray([beta, x*beta, 1/x * beta, beta, beta])
-            scaling = np.sum(numerator) / np.sum(denominator)
-            beta_multiplier_array *= scaling
-        elif mode == 'rescale_scaled':
-            # [beta, x*beta, 1/x * beta, beta, beta] -> [beta, scaling * x*beta, scaling * 1/x * beta, beta, beta]
-            is_sitetype_scaled = np.where(beta_multiplier_array != 1.0)
-            scaling = np.sum(numerator[is_sitetype_scaled]) / np.sum(denominator[is_sitetype_scaled])
-            beta_multiplier_array[is_sitetype_scaled] *= scaling
-
-        for k, key in enumerate(beta_multiplier.keys()):
-            beta_multiplier[key] = beta_multiplier_array[k]
-        return beta_multiplier
+            raise NotImplementedError('Invalid beta weighting method specified')
+
+    def compute_mean_invariant_beta_multiplier(self, beta_multiplier, weighting, mode, rollouts=1,
+                                               max_time=28 * TO_HOURS, seed=None):
+        """Computes normalized beta multipliers from `beta_multiplier` such that the weighted average over the
+        betas at all sites remains invariant. Depending on the quantity that is supposed to be kept invariant,
+        the weights are calculated in different ways (see `compute_integrated_time_proportion_per_site_type`)."""
+        weights = self.compute_integrated_time_proportion_per_site_type(
+            weighting, rollouts=rollouts, max_time=max_time, seed=seed)
+        return mean_invariant_beta_multiplier(beta_multiplier, weights, mode)
 
     '''Class methods'''
 
@@ -610,7 +2036,90 @@ class MobilitySimulator:
         with open(path, 'wb') as fp:
             pickle.dump(self, fp)
 
-    def _simulate_mobility(self, max_time, seed=None):
+    def _init_mobility_streams(self, seed):
+        """Initialize the state of the mobility traces of all people at time 0 as `MobilityStreams`
+        using random seed `seed`"""
+        cum_mob_rate_per_age_per_type = np.cumsum(self.mob_rate_per_age_per_type, axis=1)
+        if self.mode == 'synthetic':
+            rng_state, next_t, next_id = _init_synthetic_mobility_streams(
+                num_people=self.num_people,
+                people_age=self.people_age,
+                cum_mob_rate_per_age_per_type=cum_mob_rate_per_age_per_type,
+                seed=seed)
+            return MobilityStreams(rng_state=rng_state, next_t=next_t, next_id=next_id,
+                                   usual_sites=None, num_usual_sites=None)
+
+        elif self.mode == 'real':
+            rng_state, next_t, next_id, usual_sites, num_usual_sites = _init_real_mobility_streams(
+                num_people=self.num_people,
+                people_age=self.people_age,
+                cum_mob_rate_per_age_per_type=cum_mob_rate_per_age_per_type,
+                home_tile=self.home_tile,
+                tile_sites=self.tile_sites,
+                tile_ptr=self.tile_ptr,
+                tile_site_cum_prox=self.tile_site_cum_prox,
+                tile_prox_ptr=self.tile_prox_ptr,
+                variety_per_type=self.variety_per_type,
+                seed=seed)
+            return MobilityStreams(rng_state=rng_state, next_t=next_t, next_id=next_id,
+                                   usual_sites=usual_sites, num_usual_sites=num_usual_sites)
+
+    def _simulate_mobility_window(self, streams, t_end, max_time, count_only=False):
+        """Simulate all visits with arrival time before `t_end` of mobility traces in state `streams`
+        of a simulation for `max_time` time units, and advance `streams` to `t_end`.
+        Returns the columns of the visits, or only the number of visits of each individual 
+        without advancing `streams` if `count_only` is True."""
+        cum_mob_rate_per_age_per_type = np.cumsum(self.mob_rate_per_age_per_type, axis=1)
+        if self.mode == 'synthetic':
+            kwargs = dict(
+                t_end=t_end,
+                max_time=max_time,
+                home_loc=self.home_loc,
+                site_loc=self.site_loc,
+                people_age=self.people_age,
+                cum_mob_rate_per_age_per_type=cum_mob_rate_per_age_per_type,
+                dur_mean_per_type=self.dur_mean_per_type,
+                grid_sites=self.grid_sites,
+                grid_ptr=self.grid_ptr,
+                cell_lo=self.cell_lo,
+                cell_hi=self.cell_hi,
+                delta=self.delta,
+                rng_state=streams.rng_state,
+                next_t=streams.next_t)
+            if count_only:
+                return _count_synthetic_mobility_visits(**kwargs)
+            return _simulate_synthetic_mobility_traces(**kwargs, next_id=streams.next_id)
+
+        elif self.mode == 'real':
+            kwargs = dict(
+                t_end=t_end,
+                max_time=max_time,
+                people_age=self.people_age,
+                cum_mob_rate_per_age_per_type=cum_mob_rate_per_age_per_type,
+                dur_mean_per_type=self.dur_mean_per_type,
+                delta=self.delta,
+                rng_state=streams.rng_state,
+                next_t=streams.next_t,
+                usual_sites=streams.usual_sites,
+                num_usual_sites=streams.num_usual_sites)
+            if count_only:
+                return _count_real_mobility_visits(**kwargs)
+            return _simulate_real_mobility_traces(**kwargs, next_id=streams.next_id)
+
+    def _visit_store(self, columns):
+        """Build `VisitStore` from visit columns as returned by `_simulate_mobility_window`"""
+        t_from, t_to_shifted, t_to, indiv, site, visit_id = columns
+        return VisitStore(t_from=t_from, t_to_shifted=t_to_shifted, t_to=t_to, indiv=indiv,
+                          site=site, id=visit_id, num_people=self.num_people, num_sites=self.num_sites)
+
+    def _seed_mobility_streams(self, seed):
+        """Seed the global random state with `seed` (random if None) and initialize `MobilityStreams` from it"""
+        seed = seed or rd.randint(0, 2**32 - 1)
+        rd.seed(seed)
+        np.random.seed(seed-1)
+        return self._init_mobility_streams(seed=rd.randint(0, 2**32 - 1))
+
+    def _simulate_mobility(self, max_time, seed=None, num_threads=None, return_streams=False):
         """
         Simulate mobility of all people for `max_time` time units
 
@@ -620,154 +2129,440 @@ class MobilitySimulator:
             Number time to simulate
         seed : int
             Random seed for reproducibility
+        num_threads : int (optional, default: None)
+            Number of threads used to simulate traces in parallel; all available if None.
+            Each individual draws from its own random stream keyed by (seed, individual),
+            so the traces do not depend on the number of threads.
+        return_streams : bool (optional, default: False)
+            Whether to also return the state of the traces at `max_time`, see `extend`
 
         Return
         ------
-        mob_traces : list of `Visit` namedtuples
-            List of simulated visits of individuals to sites
-        home_loc : numpy.ndarray
-            Locations of homes of individuals
-        site_loc : numpy.ndarray
-            Locations of sites
+        visits : VisitStore
+            Columnar store of simulated visits of individuals to sites
+        streams : MobilityStreams
+            State of the traces at `max_time` (only if `return_streams` is True)
         """
-        # Set random seed for reproducibility
-        seed = seed or rd.randint(0, 2**32 - 1)
-        rd.seed(seed)
-        np.random.seed(seed-1)
+        with _numba_num_threads(num_threads):
+            # Set random seed for reproducibility
+            streams = self._seed_mobility_streams(seed)
+            columns = self._simulate_mobility_window(streams, t_end=max_time, max_time=max_time)
 
-        if self.mode == 'synthetic':
-            all_mob_traces, self.visit_counts = _simulate_synthetic_mobility_traces(
-                num_people=self.num_people,
-                num_sites=self.num_sites,
-                max_time=max_time,
-                home_loc=self.home_loc,
-                site_loc=self.site_loc,
-                site_type=self.site_type,
-                people_age=self.people_age,
-                mob_rate_per_age_per_type=self.mob_rate_per_age_per_type,
-                dur_mean_per_type=self.dur_mean_per_type,
-                delta=self.delta,
-                seed=rd.randint(0, 2**32 - 1)
-                )
+        if return_streams:
+            return self._visit_store(columns), streams
+        return self._visit_store(columns)
 
-        elif self.mode == 'real':
-            all_mob_traces, self.visit_counts = _simulate_real_mobility_traces(
-                num_people=self.num_people,
-                max_time=max_time,
-                site_type=self.site_type,
-                people_age=self.people_age,
-                mob_rate_per_age_per_type=self.mob_rate_per_age_per_type,
-                dur_mean_per_type=self.dur_mean_per_type,
-                delta=self.delta,
-                home_tile=self.home_tile,
-                variety_per_type=self.variety_per_type,
-                tile_site_dist=self.tile_site_dist,
-                seed=rd.randint(0, 2**32 - 1)
-                )
+    def _simulate_mobility_batch(self, max_time, seed=None, num_threads=None):
+        """
+        Simulate mobility of all people for `max_time` time units in real mode by batch generation per stratum
+        of individuals sharing mobility rates, i.e. per (age group, site type): the number of arrivals of every
+        individual is drawn from a Poisson distribution, and arrival times, durations and sites are drawn as arrays.
+        Overlapping visits of an individual are resolved afterwards (see `_resolve_batch_visits`).
 
-        return all_mob_traces
+        Since the arrivals of the types form a Poisson process with the total mobility rate, and by memorylessness
+        the first arrival after a visit is exponentially distributed, the traces have the same distribution as the
+        ones of `_simulate_mobility`. They are not identical for the same `seed`, though, and cannot be streamed
+        or extended. Usual sites are chosen as in `_simulate_mobility`.
+
+        Parameters
+        ----------
+        max_time : float
+            Number time to simulate
+        seed : int
+            Random seed for reproducibility
+        num_threads : int (optional, default: None)
+            Number of threads used to choose usual sites; all available if None
+
+        Return
+        ------
+        visits : VisitStore
+            Columnar store of simulated visits of individuals to sites
+        """
+        if self.mode != 'real':
+            raise ValueError('Batch generation of mobility traces is only implemented in real mode.')
+
+        with _numba_num_threads(num_threads):
+            streams = self._seed_mobility_streams(seed)
+        rng = np.random.default_rng(rd.randint(0, 2**32 - 1))
+
+        strata = []
+        for a in range(self.num_age_groups):
+            people = np.flatnonzero(self.people_age == a)
+            for k in range(self.num_site_types):
+                rate = self.mob_rate_per_age_per_type[a, k]
+                # individuals without usual sites of a site type do not visit it
+                stratum = people[streams.num_usual_sites[people, k] > 0]
+                if rate <= 0 or len(stratum) == 0:
+                    continue
+                indiv = np.repeat(stratum, rng.poisson(rate * max_time, size=len(stratum)))
+                t_from = rng.uniform(0.0, max_time, size=len(indiv))
+                dur = rng.exponential(self.dur_mean_per_type[k], size=len(indiv))
+                usual = (rng.random(len(indiv)) * streams.num_usual_sites[indiv, k]).astype(np.int64)
+                strata.append((indiv, t_from, dur, streams.usual_sites[indiv, k, usual]))
+
+        if strata:
+            indiv, t_from, dur, site = (np.concatenate(columns) for columns in zip(*strata))
+        else:
+            indiv, t_from, dur, site = np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int32)
+
+        # resolve overlapping visits of each individual in primary order (`indiv`, `t_from`)
+        order = np.lexsort((t_from, indiv))
+        indiv, t_from, dur, site = indiv[order], t_from[order], dur[order], site[order]
+        ptr = np.zeros(self.num_people + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indiv, minlength=self.num_people), out=ptr[1:])
+        keep = _resolve_batch_visits(ptr, t_from, dur, self.delta, max_time)
+        indiv, t_from, dur, site = indiv[keep], t_from[keep], dur[keep], site[keep]
+
+        # visit ids are consecutive per individual
+        np.cumsum(np.bincount(indiv, minlength=self.num_people), out=ptr[1:])
+        visit_id = np.arange(len(indiv)) - ptr[indiv]
+
+        return self._visit_store((t_from, t_from + dur + self.delta, t_from + dur, indiv.astype(np.int32),
+                                  site.astype(np.int32), visit_id.astype(np.int32)))
+
+    def _start_mobility_stream(self, max_time, seed=None, num_threads=None, period=None, num_templates=1):
+        """
+        Start simulating mobility of all people for `max_time` time units window by window,
+        see `simulate`. Uses the same random streams as `_simulate_mobility`, so the
+        visits are identical for the same `seed`. If `period` is given, windows are tiled
+        from `num_templates` template periods instead (see `VisitTemplate`).
+        """
+        with _numba_num_threads(num_threads):
+            # Set random seed for reproducibility
+            self._streams = self._seed_mobility_streams(seed)
+
+            if period is None:
+                self._template = None
+                # visit counts of the full horizon are needed upfront, e.g. for the per-visit outcomes of measures
+                self.visit_counts = self._simulate_mobility_window(
+                    self._streams, t_end=max_time, max_time=max_time, count_only=True)
+            else:
+                template_time = num_templates * period
+                columns = self._simulate_mobility_window(self._streams, t_end=template_time, max_time=template_time)
+                self._template = VisitTemplate(self._visit_store(columns), period=period, num_templates=num_templates,
+                                               delta=self.delta, seed=rd.randint(0, 2**32 - 1))
+                self._streams = None
+                self.visit_counts = self._template.visit_counts(max_time)
+
+        empty = (np.zeros(0), np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int32),
+                 np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+        self.visits = self._visit_store(empty)
+        self.simulated_until = 0.0
+        self.keep_from = 0.0
+        self._pinned_visits = []
+
+    def advance(self, t, keep_from=None):
+        """
+        Advance the mobility simulation in streaming mode (see `simulate`) to time `t`,
+        i.e. simulate visits window by window until at least `window` time units ahead of `t`.
+        Has no effect if all visits were simulated upfront.
+
+        Parameters
+        ----------
+        t : float
+            Current time of the simulation using the mobility traces
+        keep_from : float (optional, default: None)
+            Visits with `t_to_shifted` < `keep_from` are not queried anymore and are dropped
+            when the next window is simulated. Queries of visits overlapping [t0, t1] remain exact for t0 >= `keep_from`.
+        """
+        if getattr(self, 'window', None) is None:
+            return
+        if keep_from is not None:
+            self.keep_from = max(self.keep_from, keep_from)
+        self._simulate_until(t + self.window)
+
+    def pin_visits(self, indiv, visit_id):
+        """
+        In streaming mode (see `simulate`), keep the visits with ids `visit_id` of individuals `indiv`
+        until the end of the simulation, even if they end before `keep_from` (see `advance`)
+        """
+        if getattr(self, 'window', None) is None:
+            return
+        self._pinned_visits.append(np.asarray(indiv, dtype=np.int64) * 2**32 + np.asarray(visit_id, dtype=np.int64))
+
+    def _simulate_until(self, t1):
+        """In streaming mode, simulate windows until all visits starting at or before `t1` are simulated"""
+        if getattr(self, 'window', None) is None or self.simulated_until > t1 or self.simulated_until >= self.max_time:
+            return
+
+        if isinstance(self.visits, ChunkedVisitStore):
+            # out-of-core mode: every window is written to disk as one chunk, and visits are never dropped
+            while self.simulated_until <= t1 and self.simulated_until < self.max_time:
+                t_end = min(self.simulated_until + self.window, self.max_time)
+                with _numba_num_threads(self.num_threads):
+                    new_columns = self._simulate_mobility_window(self._streams, t_end=t_end, max_time=self.max_time)
+                self.visits.append(self._visit_store(new_columns), t0=self.simulated_until, t1=t_end)
+                self.simulated_until = t_end
+            return
+
+        t_end = self.simulated_until
+        while t_end <= t1:
+            t_end += self.window
+        t_end = min(t_end, self.max_time)
+
+        if getattr(self, '_template', None) is not None:
+            new_columns = self._template.columns(self.simulated_until, t_end, self.max_time)
+        else:
+            with _numba_num_threads(self.num_threads):
+                new_columns = self._simulate_mobility_window(self._streams, t_end=t_end, max_time=self.max_time)
+
+        # keep visits that are still needed and add new visits
+        visits = self.visits
+        keep = visits.t_to_shifted >= self.keep_from
+        if self._pinned_visits:
+            keep |= np.isin(visits.indiv.astype(np.int64) * 2**32 + visits.id, np.concatenate(self._pinned_visits))
+        old_columns = (visits.t_from, visits.t_to_shifted, visits.t_to, visits.indiv, visits.site, visits.id)
+        self.visits = self._visit_store(tuple(np.concatenate((old[keep], new))
+                                              for old, new in zip(old_columns, new_columns)))
+        self.simulated_until = t_end
+
+        # InterLap objects of traces need to be rebuilt on request
+        self._mob_traces_by_indiv = None
+        self._mob_traces_by_site = None
+        self._mob_traces = None
+
+    def set_removed_visits(self, removed=None):
+        """
+        Remove visits from the contacts enumerated by `find_contacts_of_indiv`, e.g. visits that are skipped
+        due to measures decided upfront (see `DiseaseModel`). All other queries still return removed visits,
+        and contacts looked up in a precomputed `contact_graph` are not affected.
+
+        Parameters
+        ----------
+        removed : callable (optional, default: None)
+            Returns boolean array indicating the removed visits of a `VisitStore` (in primary order)
+            given the store; no visits are removed if None
+        """
+        self._removed = removed
+
+    def _removed_visits(self, visits):
+        """Returns boolean array indicating the removed visits of `VisitStore` `visits` (see `set_removed_visits`),
+        which is computed once per store and filter"""
+        removed = getattr(self, '_removed', None)
+        cached = getattr(visits, '_removed', None)
+        if cached is None or cached[0] is not removed or len(cached[1]) != len(visits):
+            mask = removed(visits) if removed is not None else np.zeros(len(visits), dtype=np.bool_)
+            cached = visits._removed = (removed, mask)
+        return cached[1]
+
+    def _visit_stores(self, t0, t1):
+        """Returns list of `VisitStore`s holding all visits overlapping [t0, t1], sorted by time,
+        simulating the visits first in streaming mode. There are several only in out-of-core mode."""
+        self._simulate_until(t1)
+        if isinstance(self.visits, ChunkedVisitStore):
+            return self.visits.chunks(t0, t1)
+        return [self.visits]
+
+    def extend(self, new_max_time):
+        """
+        Continue the mobility traces of the last call of `simulate` from `max_time` to `new_max_time`.
+        Each trace continues from the state of its random stream after its last visit, so the visits are
+        identical to the ones of a single simulation for `new_max_time` with the same seed. Only the visits
+        in the added time are simulated and merged into the indexes of `visits` (see `VisitStore.extend`).
+        In streaming mode, the visits are simulated on demand as before.
+
+        Traces loaded from a trace cache, generated in batch or tiled from periodic templates cannot be extended.
+
+        Parameters
+        ----------
+        new_max_time : float
+            New maximum time of the simulation, larger than `max_time`
+        """
+        if new_max_time <= self.max_time:
+            raise ValueError(f'`new_max_time` = {new_max_time} has to be larger than `max_time` = {self.max_time}.')
+        if getattr(self, '_template', None) is not None:
+            raise ValueError('Traces tiled from periodic templates cannot be extended.')
+        if getattr(self, '_streams', None) is None:
+            raise ValueError('Traces cannot be extended without the state of their random streams, '
+                             'e.g. if they were loaded from a trace cache or generated in batch.')
+
+        if self.verbose:
+            print(f'Extend mobility from {self.max_time:.2f} to {new_max_time:.2f} time units... ',
+                  end='', flush=True)
+
+        with _numba_num_threads(self.num_threads):
+            if self.window is None:
+                t_from, t_to_shifted, t_to, indiv, site, visit_id = self._simulate_mobility_window(
+                    self._streams, t_end=new_max_time, max_time=new_max_time)
+                self.visits.extend(t_from=t_from, t_to_shifted=t_to_shifted, t_to=t_to, indiv=indiv,
+                                   site=site, id=visit_id)
+                self.visit_counts = self.visits.visit_counts
+            else:
+                # visits not yet simulated are counted from the current state of the streams
+                self.visit_counts = self._streams.next_id + self._simulate_mobility_window(
+                    self._streams, t_end=new_max_time, max_time=new_max_time, count_only=True)
+        self.max_time = new_max_time
+
+        # contacts and InterLap objects of traces need to be recomputed on request
+        self.contact_graph = None
+        self._mob_traces_by_indiv = None
+        self._mob_traces_by_site = None
+        self._mob_traces = None
+
+    def compute_contact_graph(self, num_threads=None):
+        """
+        Compute the `ContactGraph` of all delta-contacts in [0, max_time] by a sweep-line pass over the
+        visits of each site, in parallel across sites. Afterwards, `find_contacts_of_indiv` with
+        `tracing=False` looks up contacts in the graph. Not available in streaming mode (see `simulate`).
+
+        Parameters
+        ----------
+        num_threads : int (optional, default: None)
+            Number of threads; all available if None
+
+        Returns
+        -------
+        contact_graph : ContactGraph
+        """
+        if getattr(self, 'window', None) is not None:
+            raise ValueError('The contact graph requires all visits, i.e. `simulate` without `window`.')
+
+        visits = self.visits
+        with _numba_num_threads(num_threads):
+            contact_k, contact_inf_k = _find_all_site_contacts(
+                self.delta, visits.site_ptr, visits.site_order, visits.t_from, visits.t_to, visits.indiv)
+
+        # group by infector and order contacts of an infector as `find_contacts_of_indiv` does, i.e. by `t_from`,
+        # breaking ties by the reverse order of discovery (infector visit, then position of visit at site)
+        site_pos = np.empty(len(visits), dtype=np.int64)
+        site_pos[visits.site_order] = np.arange(len(visits))
+        t_from = np.maximum(visits.t_from[contact_k], visits.t_from[contact_inf_k])
+        indiv_j = visits.indiv[contact_inf_k]
+        order = np.lexsort((-site_pos[contact_k], -contact_inf_k, t_from, indiv_j))
+        contact_k, contact_inf_k = contact_k[order], contact_inf_k[order]
+
+        ptr = np.zeros(self.num_people + 1, dtype=np.int64)
+        np.cumsum(np.bincount(indiv_j, minlength=self.num_people), out=ptr[1:])
+        self.contact_graph = ContactGraph(
+            ptr=ptr,
+            t_from=t_from[order],
+            t_to=np.minimum(visits.t_to[contact_k], visits.t_to[contact_inf_k] + self.delta),
+            t_to_direct=np.minimum(visits.t_to[contact_k], visits.t_to[contact_inf_k]),
+            indiv_i=visits.indiv[contact_k],
+            site=visits.site[contact_k],
+            id_i=visits.id[contact_k],
+            id_j=visits.id[contact_inf_k])
+        return self.contact_graph
 
     def _find_all_contacts(self):
         """
-        Finds contacts in a given list `mob_traces` of `Visit`s
-        and stores them in a dictionary of dictionaries of InterLap objects,
+        Finds all contacts and stores them in a dictionary of dictionaries of InterLap objects,
+        i.e. contacts[i][j] = "InterLap of contacts from i to j"
         """
+        graph = getattr(self, 'contact_graph', None)
+        if graph is None:
+            graph = self.compute_contact_graph()
 
-        # dict of dict of list of contacts:
-        # i.e. contacts[i][j][k] = "k-th contact from i to j"
         contacts = {i: defaultdict(InterLap) for i in range(self.num_people)}
-
         for j in range(self.num_people):
-            # Get all contacts of indiv j
-            contacts_j = self.find_contacts_of_indiv(indiv=j, tmin=0, tmax=np.inf)
-            # Sort contacts of indiv j by contact person
-            for c in contacts_j:
-                contacts[c.indiv_i, j].update([c])
+            contacts_j = graph.contacts_of_indiv(j, tmin=0.0, tmax=np.inf)
+            for c in contact_tuples(contacts_j):
+                contacts[c.indiv_i][j].update([c])
 
         return contacts
 
     def find_contacts_of_indiv(self, indiv, tmin, tmax, tracing=False, p_reveal_visit=1.0):
         """
         Finds all delta-contacts of person 'indiv' with any other individual after time 'tmin'
-        and returns them as InterLap object.
+        and returns them as `ContactArrays` of parallel numpy arrays, sorted by `t_from`.
         In the simulator, this function is called for `indiv` as infector.
         """
 
         if tracing is True and self.beacon_config is None:
             # If function is used for contact tracing and there are no beacons, can only trace direct contacts
-            extended_time_window = 0
+            extended_time_window = 0.0
         else:
             # If used for infection simulation or used for tracing with beacons, capture also indirect contacts
             extended_time_window = self.delta
 
-        contacts = InterLap()
+        tmax = tmax if (tmax is not None) else np.inf
+        if tracing is False and getattr(self, 'contact_graph', None) is not None:
+            return self.contact_graph.contacts_of_indiv(indiv, tmin, tmax)
 
-        # iterate over all visits of `indiv` intersecting with the interval [tmin, tmax]
-        infector_traces = self.mob_traces_by_indiv[indiv].find((tmin, tmax if (tmax is not None) else np.inf))
+        # all visits overlapping [tmin, tmax]; several stores only in out-of-core mode (see `simulate`)
+        stores = self._visit_stores(tmin, tmax)
 
-        for inf_visit in infector_traces:
+        found, found_in = [], []
+        for inf_visits in stores:
+            # all visits of `indiv` intersecting with the interval [tmin, tmax]
+            inf_from, inf_to = inf_visits.indiv_window(indiv, tmin, tmax)
 
             # coin flip of whether infector `indiv` reveals their visit
-            if tracing is True and np.random.uniform(low=0.0, high=1.0) > p_reveal_visit:
-                continue
+            if tracing is True:
+                reveal = np.random.uniform(low=0.0, high=1.0, size=inf_to - inf_from) <= p_reveal_visit
+            else:
+                reveal = np.ones(inf_to - inf_from, dtype=np.bool_)
+            reveal &= ~self._removed_visits(inf_visits)[inf_from:inf_to]
 
             # find all contacts of `indiv` by querying visits of
             # other individuals during visit time of `indiv` at the same site
-            # (including delta-contacts; if beacon_cache=0, delta-contacts get filtered out below)
-            inf_visit_time = (inf_visit.t_from, inf_visit.t_to_shifted)
-            concurrent_site_traces = self.mob_traces_by_site[inf_visit.site].find(inf_visit_time)
-
-            for visit in concurrent_site_traces:
-                # ignore visits of `indiv` since it is not a contact
-                if visit.indiv == inf_visit.indiv:
-                    continue
-
-                # ignore if begin of visit is after tmax
-                # this can happen if inf_visit starts just before tmax but continues way beyond tmax
-                if visit.t_from > tmax:
-                    continue
-
-                # Compute contact time
-                c_t_from = max(visit.t_from, inf_visit.t_from)
-                c_t_to = min(visit.t_to, inf_visit.t_to + extended_time_window)
-                c_t_to_direct = min(visit.t_to, inf_visit.t_to) # only direct
-
-                if c_t_to > c_t_from and c_t_to > tmin:
-                    c = Contact(t_from=c_t_from,
-                                t_to=c_t_to,
-                                indiv_i=visit.indiv,
-                                indiv_j=inf_visit.indiv,
-                                id_tup=(visit.id, inf_visit.id),
-                                site=inf_visit.site,
-                                duration=c_t_to - c_t_from,
-                                t_to_direct=c_t_to_direct)
-                    contacts.update([c])
+            # (including delta-contacts; if beacon_cache=0, delta-contacts get filtered out)
+            for b, visits in enumerate(stores):
+                found.append(_find_contacts_of_indiv(
+                    indiv, inf_visits.t_from[inf_from:inf_to], inf_visits.t_to[inf_from:inf_to],
+                    inf_visits.t_to_shifted[inf_from:inf_to], inf_visits.site[inf_from:inf_to],
+                    inf_visits.id[inf_from:inf_to], reveal, tmin, tmax, extended_time_window,
+                    visits.t_from, visits.t_to, visits.t_to_shifted, visits.indiv, visits.id, visits.site,
+                    visits.site_ptr, visits.site_order, visits.site_t_from, visits.site_max_span,
+                    self._removed_visits(visits)))
+                found_in.append(np.full(len(found[-1][0]), b))
+
+        t_from, t_to, t_to_direct, indiv_i, site, id_i, id_j = (np.concatenate(column) for column in zip(*found))
+
+        # order of discovery in a single store: by infector visit, then by position of visit at site
+        discovery = np.empty(len(t_from), dtype=np.int64)
+        discovery[np.lexsort((np.arange(len(t_from)), np.concatenate(found_in), id_j))] = np.arange(len(t_from))
+
+        # sort by start of contact, breaking ties by most recently found contact first
+        # (the iteration order of contacts inserted one by one into an `InterLap`)
+        order = np.lexsort((-discovery, t_from))
+        return ContactArrays(
+            t_from=t_from[order],
+            t_to=t_to[order],
+            indiv_i=indiv_i[order],
+            indiv_j=np.full(len(order), indiv, dtype=np.int32),
+            site=site[order],
+            id_i=id_i[order],
+            id_j=id_j[order],
+            t_to_direct=t_to_direct[order])
+
+    @property
+    def mob_traces_by_indiv(self):
+        """Dict of InterLap of visits per individual, i.e.
+
+            mob_traces_by_indiv[i] = "Interlap of visits of indiv i"
+
+        Only kept for backward compatibility and built on first access;
+        queries should go through `self.visits`.
+        """
+        if getattr(self, '_mob_traces_by_indiv', None) is None:
+            self._mob_traces_by_indiv = self.visits.to_interlap_by_indiv()
+        return self._mob_traces_by_indiv
 
-        return contacts
+    @property
+    def mob_traces_by_site(self):
+        """Dict of InterLap of visits per site, i.e.
 
-    def _group_mob_traces_by_indiv(self, mob_traces):
-        """Group `mob_traces` by individual for faster queries.
-        Returns a dict of dict of Interlap of the form:
+            mob_traces_by_site[k] = "Interlap of visits at site k"
 
-            mob_traces_dict[i] = "Interlap of visits of indiv i"
+        Only kept for backward compatibility and built on first access;
+        queries should go through `self.visits`.
         """
-        mob_traces_dict = {i: InterLap() for i in range(self.num_people)}
-        for v in mob_traces:
-            mob_traces_dict[v.indiv].update([v])
-        return mob_traces_dict
-
-    def _group_mob_traces_by_site(self, mob_traces):
-        """Group `mob_traces` by site for faster queries.
-        Returns a dict of dict of Interlap of the form:
-
-            mob_traces_dict[k] = "Interlap of visits at site k"
+        if getattr(self, '_mob_traces_by_site', None) is None:
+            self._mob_traces_by_site = self.visits.to_interlap_by_site()
+        return self._mob_traces_by_site
+
+    @property
+    def mob_traces(self):
+        """InterLap of all visits. Only kept for backward compatibility and built on first access;
+        queries should go through `self.visits`.
         """
-        mob_traces_dict = {k: InterLap() for k in range(self.num_sites)}
-        for v in mob_traces:
-            mob_traces_dict[v.site].update([v])
-        return mob_traces_dict
+        if getattr(self, '_mob_traces', None) is None:
+            self._mob_traces = self.visits.to_interlap()
+        return self._mob_traces
 
-    def simulate(self, max_time, seed=None): 
+    def simulate(self, max_time, seed=None, num_threads=None, window=None, trace_cache=None, trace_key=None,
+                 period=None, num_templates=1, chunk_dir=None, memory_budget=None, batch=False):
         """
         Simulate contacts between individuals in time window [0, max_time].
 
@@ -777,6 +2572,54 @@ class MobilitySimulator:
             Maximum time to simulate
         seed : int
             Random seed for mobility simulation
+        num_threads : int (optional, default: None)
+            Number of threads used for the mobility simulation; all available if None.
+            Traces are identical for any number of threads.
+        window : float (optional, default: None)
+            If None, all visits in [0, max_time] are simulated upfront. Otherwise, visits are
+            simulated in streaming mode in windows of `window` time units ahead of the time
+            passed to `advance` and on demand of queries, and visits no longer needed
+            are dropped (see `advance`). Visits are identical to the ones simulated upfront 
+            for the same `seed`, but only recent visits are held in memory, 
+            so `visits` cannot be inspected over the full horizon after a simulation.
+        trace_cache : TraceCache (optional, default: None)
+            Cache of mobility traces (see `lib.tracecache`). If given together with `trace_key`,
+            the visits of entry `trace_key` are loaded memory-mapped from the cache, or simulated
+            upfront with random seed `seed` and stored in the cache if missing. In both cases,
+            the global random state is left untouched, and `window` is ignored.
+        trace_key : str (optional, default: None)
+            Key of the traces in `trace_cache`, see `TraceCache.key`
+        period : float (optional, default: None)
+            If given, e.g. `7 * TO_HOURS`, only `num_templates` periods of mobility are simulated and tiled
+            over [0, max_time] (see `VisitTemplate`): in every period of the horizon, each individual
+            follows one of their template periods chosen uniformly at random, independently per individual
+            and period. Memory and simulation cost do not depend on `max_time`. Implies streaming mode
+            with `window` = `period` unless `window` is given, and cannot be combined with `trace_cache`.
+
+            This assumes a stationary mobility model and differs statistically from fresh sampling:
+            within a period, the visits of each individual have the same distribution as under fresh
+            sampling, except that visits crossing the end of a template period are dropped (a fraction of
+            about mean visit duration / `period` of the visits). Across periods, the visits of an individual
+            repeat exactly whenever a template period is reused, so individuals meet the same contacts at the
+            same sites and times more often and have fewer distinct contacts over long horizons than under
+            fresh sampling, which matters most for small `num_templates`.
+        num_templates : int (optional, default: 1)
+            Number of template periods per individual if `period` is given
+        chunk_dir : str (optional, default: None)
+            If given, visits are simulated out-of-core for populations whose visits do not fit into memory:
+            in streaming mode with `window` = `TO_HOURS` unless `window` is given, every window of visits is
+            written to a chunk in a temporary subdirectory of `chunk_dir` instead of being held in memory
+            (see `ChunkedVisitStore`), and `visits` is a `ChunkedVisitStore`. Queries read the chunks overlapping
+            their time window back into memory. Visits and queries are identical to the ones of streaming mode,
+            and visits are never dropped. Cannot be combined with `period` or `trace_cache`.
+        memory_budget : int (optional, default: None)
+            Maximum total size in bytes of the chunks kept in memory in out-of-core mode; unbounded if None
+        batch : bool (optional, default: False)
+            If True, traces are generated in batch per stratum of individuals in real mode
+            (see `_simulate_mobility_batch`), which is faster for large populations. Batch traces have the same
+            distribution as, but are not trace-compatible with the per-individual streams, i.e. they differ
+            for the same `seed`; cache them with `TraceCache.key(..., generator='batch')`. Cannot be combined
+            with `window`, `period` or `chunk_dir`, and traces cannot be extended.
 
         Returns
         -------
@@ -795,22 +2638,102 @@ class MobilitySimulator:
                   end='', flush=True)
 
         # simulate mobility traces
-        all_mob_traces = self._simulate_mobility(max_time, seed)
+        self.window = window
+        self.num_threads = num_threads
+        self._template = None
+        self._streams = None
+        if batch and (window is not None or period is not None or chunk_dir is not None):
+            raise ValueError('Batch mobility cannot be combined with `window`, `period` or `chunk_dir`.')
+        if chunk_dir is not None:
+            if period is not None or trace_cache is not None:
+                raise ValueError('Out-of-core mobility cannot be combined with `period` or `trace_cache`.')
+            self.window = window = window or TO_HOURS
+        if period is not None:
+            if trace_cache is not None:
+                raise ValueError('Periodic mobility templates cannot be combined with `trace_cache`.')
+            self.window = window or period
+            self._start_mobility_stream(max_time, seed, num_threads=num_threads,
+                                        period=period, num_templates=num_templates)
+            self.advance(0.0)
+        elif trace_cache is not None and trace_key is not None:
+            self.window = None
+            self.visits = trace_cache.load(trace_key)
+            if self.visits is None:
+                # the random state of the caller must not depend on whether traces were cached
+                rd_state, np_state = rd.getstate(), np.random.get_state()
+                if batch:
+                    self.visits = self._simulate_mobility_batch(max_time, seed, num_threads=num_threads)
+                else:
+                    self.visits = self._simulate_mobility(max_time, seed, num_threads=num_threads)
+                rd.setstate(rd_state)
+                np.random.set_state(np_state)
+                trace_cache.store(trace_key, self.visits)
+            self.visit_counts = self.visits.visit_counts
+        elif batch:
+            self.visits = self._simulate_mobility_batch(max_time, seed, num_threads=num_threads)
+            self.visit_counts = self.visits.visit_counts
+        elif window is None:
+            self.visits, self._streams = self._simulate_mobility(
+                max_time, seed, num_threads=num_threads, return_streams=True)
+            self.visit_counts = self.visits.visit_counts
+        else:
+            self._start_mobility_stream(max_time, seed, num_threads=num_threads)
+            if chunk_dir is not None:
+                self.visits = ChunkedVisitStore(root=chunk_dir, num_people=self.num_people,
+                                                num_sites=self.num_sites, memory_budget=memory_budget)
+            self.advance(0.0)
+
+        # contact graph is only computed on request (see `compute_contact_graph`)
+        self.contact_graph = None
+
+        # InterLap objects of traces are only built on request (see `mob_traces_by_indiv` etc.)
+        self._mob_traces_by_indiv = None
+        self._mob_traces_by_site = None
+        self._mob_traces = None
+
+        # Initialize empty contact store
+        self.contacts = ContactStore(self.num_people)
+
+    def household_members(self, indiv):
+        """Return array of the members of the household of `indiv` (including `indiv`)"""
+        h = self.indiv_household[indiv]
+        return self.household_indiv[self.household_ptr[h]:self.household_ptr[h + 1]]
+
+    def copresence_index(self, away=None):
+        """Return `CopresenceIndex` of all visits, where only the visits marked in `away` (in primary order of
+        `visits`) count as time away from home (all if None). Requires all visits to be simulated upfront."""
+        if getattr(self, 'window', None) is not None:
+            raise ValueError('Co-presence index requires all visits to be simulated upfront, i.e. `simulate` without `window`.')
+        return CopresenceIndex(self.visits, away=away)
+
+    def find_visits_of_indiv(self, indiv, t0, t1):
+        """Return a generator of `Visit`s of `indiv` overlapping with [t0, t1]
+        (matched on visit window [`t_from`, `t_to_shifted`])
+        """
+        return itertools.chain.from_iterable(
+            visits.visits(range(*visits.indiv_window(indiv, t0, t1))) for visits in self._visit_stores(t0, t1))
 
-        self.mob_traces_by_indiv = self._group_mob_traces_by_indiv(all_mob_traces)
-        self.mob_traces_by_site = self._group_mob_traces_by_site(all_mob_traces)
-        self.mob_traces = InterLap(ranges=all_mob_traces)
+    def find_visits_at_site(self, site, t0, t1):
+        """Return a generator of `Visit`s at `site` overlapping with [t0, t1]
+        (matched on visit window [`t_from`, `t_to_shifted`])
+        """
+        return itertools.chain.from_iterable(
+            visits.visits(visits.site_window(site, t0, t1)) for visits in self._visit_stores(t0, t1))
 
-        # Initialize empty contact array
-        self.contacts = {i: defaultdict(InterLap) for i in range(self.num_people)}
+    def find_visits(self, t0, t1):
+        """Return a generator of all `Visit`s overlapping with [t0, t1], ordered by `t_from`
+        (matched on visit window [`t_from`, `t_to_shifted`])
+        """
+        return itertools.chain.from_iterable(
+            visits.visits(visits.window(t0, t1)) for visits in self._visit_stores(t0, t1))
 
     def list_intervals_in_window_individual_at_site(self, *, indiv, site, t0, t1):
         """Return a generator of Intervals of all visits of `indiv` is at site
            `site` that overlap with [t0, t1]
 
-        The call 
+        The query
 
-            self.mob_traces_by_indiv[indiv].find((t0, t1))
+            self.visits.indiv_window(indiv, t0, t1)
 
         matches all visits on visit window [`t_from`, `t_to_shifted`].
         Since we only want to return real in-person visits, 
@@ -818,44 +2741,31 @@ class MobilitySimulator:
         in the sense of "environemental contamination" 
         i.e. only matched on (`t_to`, `t_to_shifted`] 
         """
-        for visit in self.mob_traces_by_indiv[indiv].find((t0, t1)):
-            if visit.t_to >= t0 and visit.site == site:
-                yield Interval(visit.t_from, visit.t_to)
+        for visits in self._visit_stores(t0, t1):
+            a, b = visits.indiv_window(indiv, t0, t1)
+            for k in range(a, b):
+                if visits.t_to[k] >= t0 and visits.site[k] == site:
+                    yield Interval(float(visits.t_from[k]), float(visits.t_to[k]))
 
     def is_in_contact(self, *, indiv_i, indiv_j, t, site=None):
         """Indicate if individual `indiv_i` is within `delta` time (i.e. at most `delta` later than `indiv_j`)
         to make contact with `indiv_j` at time `t` in site `site`, and return contact if possible
         In this query, `indiv_j` is usually an infector.
         """
-        try:
-            # Find contact matching time and check site
-            contact = next(self.contacts[indiv_i][indiv_j].find((t, t)))
-            return (site is None) or (contact.site == site), contact
-
-        except StopIteration:  # No such contact, call to `next` failed
+        # Find contact matching time and check site
+        contact = self.contacts.find(indiv_i, indiv_j, t)
+        if contact is None:
             return False, None
+        return (site is None) or (contact.site == site), contact
 
     def will_be_in_contact(self, *, indiv_i, indiv_j, t, site=None):
         """Indicate if individuals `indiv_i` will ever make contact with
         `indiv_j` in site `site` at a time greater or equal to `t`
         """
-        contacts_ij = self.contacts[indiv_i][indiv_j]
-        # Search future contacts
-        for c in contacts_ij.find((t, np.inf)):
-            # Check site
-            if (site is None) or (c.site == site):
-                return True
-
-        return False
+        return self.contacts.next(indiv_i, indiv_j, t, site=site) is not None
 
     def next_contact(self, *, indiv_i, indiv_j, t=np.inf, site=None):
         """Returns the next `delta`- contact between
             `indiv_i` with `indiv_j` in site `site` at a time greater or equal to `t`
         """
-        contacts_ij = self.contacts[indiv_i][indiv_j]
-        # Search future contacts
-        for c in contacts_ij.find((t, np.inf)):
-            # Check site
-            if (site is None) or (c.site == site):
-                return c
-        return None # No contact in the future
+        return self.contacts.next(indiv_i, indiv_j, t, site=site)
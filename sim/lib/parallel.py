@@ -1,6 +1,7 @@
 
 import time
 import bisect
+import random
 import copy
 import numpy as np
 import pandas as pd
@@ -10,10 +11,12 @@ import scipy.optimize
 import scipy as sp
 import os, math
 import pickle
+import shutil
+import tempfile
 import matplotlib.pyplot as plt
 from joblib import Parallel, delayed
 from pathos.multiprocessing import ProcessingPool as Pool
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 
 from lib.dynamics import DiseaseModel
 from lib.priorityqueue import PriorityQueue
@@ -23,12 +26,50 @@ from lib.measures import (MeasureList, BetaMultiplierMeasureBySite,
                       SocialDistancingForPositiveMeasure, SocialDistancingByAgeMeasure, SocialDistancingForSmartTracing, ComplianceForAllMeasure)
 
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
-from lib.mobilitysim import MobilitySimulator
+from lib.mobilitysim import MobilitySimulator, BEACON_ROLLOUTS, BEACON_MAX_TIME
+from lib.mobilitysettings import load_settings, save_settings, is_binary_settings
+from lib.tracecache import TraceCache, settings_file_digest
 
 TO_HOURS = 24.0
 
 pp_legal_states = ['susc', 'expo', 'ipre', 'isym', 'iasy', 'posi', 'nega', 'resi', 'dead', 'hosp']
 
+# Compact reference to the mobility traces of a repeat, stored in `ParallelSummary.mob` instead of
+# the `MobilitySimulator` itself; the traces are regenerated deterministically by `regenerate_mob`
+MobilityReference = namedtuple('MobilityReference', (
+    'settings',          # Path of the mobility settings file
+    'settings_digest',   # Digest of the content of the settings file (see `lib.tracecache.settings_file_digest`)
+    'downsample',        # Factor by which the settings were downsampled on load (see `lib.mobilitysettings.load_settings`)
+    'seed',              # Random seed of the traces
+    'max_time',          # Time horizon of the traces
+    'beacon_config',     # Beacon configuration
+    'site_has_beacon',   # Beacon placement
+    'batch',             # Whether the traces were generated in batch (see `MobilitySimulator.simulate`)
+), defaults=(False,))
+
+
+def regenerate_mob(reference):
+    """
+    Regenerates the `MobilitySimulator` with the traces of `MobilityReference` `reference`,
+    which are identical to the ones of the simulation since the visits only depend on
+    the settings and the seed. Contacts are not restored, i.e. the contact store is empty.
+    """
+    if settings_file_digest(reference.settings) != reference.settings_digest:
+        raise ValueError(f'Mobility settings `{reference.settings}` changed since the simulation, '
+                         'its traces cannot be regenerated.')
+
+    kwargs = dict(load_settings(reference.settings, downsample=reference.downsample))
+    kwargs['beacon_config'] = reference.beacon_config
+    kwargs['site_has_beacon'] = reference.site_has_beacon
+
+    # constructing and simulating reseeds the global random state, which is restored for the caller
+    rd_state, np_state = random.getstate(), np.random.get_state()
+    mob = MobilitySimulator(**kwargs, seed=reference.seed)
+    mob.simulate(max_time=reference.max_time, seed=reference.seed, batch=reference.batch)
+    random.setstate(rd_state)
+    np.random.set_state(np_state)
+    return mob
+
 
 class ParallelSummary(object):
     """
@@ -84,7 +125,7 @@ class ParallelSummary(object):
         }
         
         self.measure_list = []
-        self.mob = []
+        self.mob = []  # `MobilityReference` (or `MobilitySimulator`) of each repeat if stored, see `get_mob`
         
         self.people_age = np.zeros((repeats, n_people), dtype='int')
 
@@ -110,6 +151,26 @@ class ParallelSummary(object):
             for policy in ['sites', 'no_sites']})
         for thres in thresholds_roc}
 
+    def get_mob(self, r):
+        """
+        Returns the `MobilitySimulator` of repeat `r`, regenerating its traces from the stored
+        `MobilityReference` on request. The last regenerated simulator is kept in memory
+        (but not pickled), so repeated calls for the same `r` are cheap.
+        """
+        mob = self.mob[r]
+        if not isinstance(mob, MobilityReference):
+            # summary of a single simulation or saved before references were introduced
+            return mob
+        cached = getattr(self, '_mob_cache', None)
+        if cached is None or cached[0] != r:
+            cached = self._mob_cache = (r, regenerate_mob(mob))
+        return cached[1]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_mob_cache', None)
+        return state
+
 
 def create_ParallelSummary_from_DiseaseModel(sim, store_mob=False):
 
@@ -142,11 +203,65 @@ def create_ParallelSummary_from_DiseaseModel(sim, store_mob=False):
     return summary
 
 
-def pp_launch(r, kwargs, distributions, params, initial_counts, testing_params, measure_list, max_time,
-              thresholds_roc, store_mob, store_measure_bernoullis):
+def compute_site_has_beacon(mob_settings, beacon_config, seed=0, trace_cache=None):
+    """
+    Computes the beacon placement for `beacon_config` once for all repeats of a simulation,
+    using mobility rollouts with fixed `seed`. If `trace_cache` is given, placements are cached on disk
+    per (settings, `beacon_config`, `seed`). Returns None if the placement is cheap or random
+    and hence done by each `MobilitySimulator` itself.
+    """
+    if beacon_config is None or beacon_config['mode'] != 'visit_freq':
+        return None
+
+    if trace_cache is not None:
+        key = TraceCache.beacon_key(settings_digest=settings_file_digest(mob_settings), beacon_config=beacon_config,
+                                    seed=seed, rollouts=BEACON_ROLLOUTS, max_time=BEACON_MAX_TIME)
+        site_has_beacon = trace_cache.load_array(key)
+        if site_has_beacon is not None:
+            return site_has_beacon
+
+    # constructing the simulator reseeds the global random state, which is restored for the caller
+    rd_state, np_state = random.getstate(), np.random.get_state()
+    mob = MobilitySimulator(**load_settings(mob_settings), seed=seed + 1)
+    site_has_beacon = mob.place_beacons(beacon_config=beacon_config, rollouts=BEACON_ROLLOUTS,
+                                        max_time=BEACON_MAX_TIME, seed=seed)
+    random.setstate(rd_state)
+    np.random.set_state(np_state)
+
+    if trace_cache is not None:
+        trace_cache.store_array(key, site_has_beacon)
+    return site_has_beacon
+
+
+def pp_simulate_traces(mob_settings, max_time, mob_seed, mob_cache, mob_trace_key, mob_batch=False):
+    """Simulates the mobility traces of realization `mob_seed` of the trace pool
+    and stores them in `mob_cache` as entry `mob_trace_key`, unless already cached"""
+    if mob_cache.load(mob_trace_key) is None:
+        mob = MobilitySimulator(**load_settings(mob_settings))
+        mob.simulate(max_time=max_time, seed=mob_seed, trace_cache=mob_cache, trace_key=mob_trace_key,
+                     batch=mob_batch)
+    return mob_trace_key
+
+
+def pp_launch(r, mob_settings, beacon_config, distributions, params, initial_counts, testing_params, measure_list,
+              max_time, thresholds_roc, store_mob, store_measure_bernoullis, mob_window=None,
+              mob_seed=None, mob_cache=None, mob_trace_key=None, site_has_beacon=None,
+              mob_chunk_dir=None, mob_memory_budget=None, well_mixed_occupancy=None, mob_batch=False):
+
+    # settings are loaded once per worker process and shared read-only by its repeats
+    kwargs = load_settings(mob_settings)
+
+    # test-time mobility simulator additions and modifications
+    kwargs['beacon_config'] = beacon_config
+    kwargs['site_has_beacon'] = site_has_beacon
 
     mob = MobilitySimulator(**kwargs)
-    mob.simulate(max_time=max_time)
+    if store_mob and mob_seed is None:
+        # the seed `simulate` would draw is drawn here, so the traces can be regenerated from it (see `regenerate_mob`)
+        mob_seed = random.randint(0, 2**32 - 1)
+    mob.simulate(max_time=max_time, seed=mob_seed, window=mob_window,
+                 trace_cache=mob_cache, trace_key=mob_trace_key,
+                 chunk_dir=mob_chunk_dir, memory_budget=mob_memory_budget, batch=mob_batch)
 
     sim = DiseaseModel(mob, distributions)
 
@@ -156,7 +271,8 @@ def pp_launch(r, kwargs, distributions, params, initial_counts, testing_params,
         testing_params=testing_params,
         measure_list=measure_list,
         thresholds_roc=thresholds_roc,
-        verbose=False)
+        verbose=False,
+        well_mixed_occupancy=well_mixed_occupancy)
 
     ml = copy.deepcopy(sim.measure_list)
     if not store_measure_bernoullis:
@@ -177,7 +293,10 @@ def pp_launch(r, kwargs, distributions, params, initial_counts, testing_params,
         'num_household_exposures': sim.num_household_exposures
     }
     if store_mob:
-        result['mob'] = sim.mob
+        result['mob_seed'] = mob_seed
+        result['site_has_beacon'] = sim.mob.site_has_beacon
+    if mob_chunk_dir is not None:
+        sim.mob.visits.close()
 
     return result
 
@@ -185,80 +304,180 @@ def pp_launch(r, kwargs, distributions, params, initial_counts, testing_params,
 def launch_parallel_simulations(mob_settings, distributions, random_repeats, cpu_count, params, 
     initial_seeds, testing_params, measure_list, max_time, num_people, num_sites, site_loc, home_loc,
     beacon_config=None, thresholds_roc=None, verbose=True, synthetic=False, summary_options=None,
-    store_mob=False, store_measure_bernoullis=False):
-
-    with open(mob_settings, 'rb') as fp:
-        kwargs = pickle.load(fp)
-
-        # test-time mobility simulator additions and modifications
-        kwargs['beacon_config'] = beacon_config
-
-    mob_setting_list = [copy.deepcopy(kwargs) for _ in range(random_repeats)]
-    distributions_list = [copy.deepcopy(distributions) for _ in range(random_repeats)]
-    measure_list_list = [copy.deepcopy(measure_list) for _ in range(random_repeats)]
-    params_list = [copy.deepcopy(params) for _ in range(random_repeats)]
-    initial_seeds_list = [copy.deepcopy(initial_seeds) for _ in range(random_repeats)]
-    testing_params_list = [copy.deepcopy(testing_params) for _ in range(random_repeats)]
-    thresholds_roc_list = [copy.deepcopy(thresholds_roc) for _ in range(random_repeats)]
-    max_time_list = [copy.deepcopy(max_time) for _ in range(random_repeats)]
-    store_mob_list = [copy.deepcopy(store_mob) for _ in range(random_repeats)]
-    store_measure_bernoullis_list = [copy.deepcopy(store_measure_bernoullis) for _ in range(random_repeats)]
-    repeat_ids = list(range(random_repeats))
-
-    if verbose:
-        print('Launching simulations...')
+    store_mob=False, store_measure_bernoullis=False, mob_window=None,
+    mob_pool_size=None, mob_cache_dir=None, mob_cache_max_bytes=None, mob_shared=False,
+    mob_chunk_dir=None, mob_memory_budget=None, well_mixed_occupancy=None, mob_downsample=None, mob_batch=False):
 
-    with ProcessPoolExecutor(cpu_count) as ex:
-        res = ex.map(pp_launch, repeat_ids, mob_setting_list, distributions_list, params_list,
-                     initial_seeds_list, testing_params_list, measure_list_list, max_time_list,
-                     thresholds_roc_list, store_mob_list, store_measure_bernoullis_list)
+    # With `mob_chunk_dir`, every worker simulates its mobility out-of-core in a temporary subdirectory
+    # of `mob_chunk_dir`, keeping at most `mob_memory_budget` bytes of visits in memory (see `MobilitySimulator.simulate`)
+    if mob_chunk_dir is not None and (store_mob or mob_cache_dir is not None or mob_shared):
+        raise ValueError('Out-of-core mobility cannot be combined with `store_mob`, `mob_cache_dir` or `mob_shared`.')
 
-    # # # DEBUG mode (to see errors printed properly)
-    # res = []
-    # for r in repeat_ids:
-    #     res.append(pp_launch(r, mob_setting_list[r], distributions_list[r], params_list[r],
-    #                  initial_seeds_list[r], testing_params_list[r], measure_list_list[r], 
-    #                  max_time_list[r], thresholds_roc_list[r], store_mob_list[r], store_measure_bernoullis_list[r]))
+    # With `mob_batch`, traces are generated in batch per stratum (see `MobilitySimulator.simulate`),
+    # which are distributed like, but differ from the traces of the per-individual streams of the same seed
+    if mob_batch and (mob_window is not None or mob_chunk_dir is not None):
+        raise ValueError('Batch mobility cannot be combined with `mob_window` or `mob_chunk_dir`.')
 
-    
-    # collect all result (the fact that mob is still available here is due to the for loop)
-    summary = ParallelSummary(max_time, random_repeats, num_people, num_sites, site_loc, home_loc, thresholds_roc)
-    num_site_exposures = []
-    num_household_exposures = []
-
-    for r, result in enumerate(res):
-
-        for code in pp_legal_states:
-            summary.state[code][r, :] = result['state'][code]
-            summary.state_started_at[code][r, :] = result['state_started_at'][code]
-            summary.state_ended_at[code][r, :] = result['state_ended_at'][code]
-
-        ml = result['measure_list']
-        summary.measure_list.append(ml)
-
-        if store_mob:
-            summary.mob.append(result['mob']) 
+    # settings are only passed by path, workers load them with the process-local cache of `load_settings`
+    kwargs = load_settings(mob_settings, downsample=mob_downsample)
 
-        summary.people_age[r, :] = result['people_age']
-
-        summary.children_count_iasy[r, :] = result['children_count_iasy']
-        summary.children_count_ipre[r, :] = result['children_count_ipre']
-        summary.children_count_isym[r, :] = result['children_count_isym']
-
-        summary.visit_expo_counts.append(result['visit_expo_counts'])
-
-        for thres in result['tracing_stats'].keys():
-            for sitetype in result['tracing_stats'][thres].keys():
-                for policy in ['sites', 'no_sites']:
-                    for action in ['isolate', 'test']:
-                        for stat in ['tp', 'fp', 'tn', 'fn']:
-                            summary.tracing_stats[thres][sitetype][policy][action][stat][r] = \
-                                result['tracing_stats'][thres][sitetype][policy][action][stat]
-            # Transform defaultdict back to dict
-            summary.tracing_stats[thres] = dict(summary.tracing_stats[thres])
+    # With `store_mob`, the summary holds a `MobilityReference` per repeat to regenerate its traces on request,
+    # which refers to the settings file given here (the ones passed to the workers may be temporary)
+    if store_mob:
+        mob_settings_reference = os.path.abspath(mob_settings)
+        mob_settings_reference_digest = settings_file_digest(mob_settings)
+
+    # mobility of repeat `r` is realization `r % mob_pool_size` of a fixed pool of traces with seeds 1, ..., K,
+    # so that all simulations of an experiment (and all experiments) use the same traces.
+    # With `mob_cache_dir`, the realizations are only simulated once and cached on disk.
+    if mob_pool_size is not None:
+        mob_seed_list = [(r % mob_pool_size) + 1 for r in range(random_repeats)]
+    else:
+        mob_seed_list = [None for _ in range(random_repeats)]
+
+    # With `mob_shared`, the trace pool (unless cached in `mob_cache_dir`) and settings not in the binary format
+    # are published in a temporary directory in shared memory. Workers memory-map them read-only,
+    # so memory does not grow with `cpu_count`. With `mob_downsample`, the downsampled settings are
+    # written to this (or else a regular) temporary directory, which is removed when the simulations end or fail.
+    if mob_shared:
+        shared_dir = tempfile.mkdtemp(prefix='mobility-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    elif mob_downsample is not None and mob_downsample != 1:
+        shared_dir = tempfile.mkdtemp(prefix='mobility-')
+    else:
+        shared_dir = None
+
+    try:
+        if mob_shared and mob_cache_dir is None and mob_pool_size is not None:
+            mob_cache_dir = os.path.join(shared_dir, 'traces')
+
+        # With `mob_downsample`, people and sites are downsampled once (see `lib.mobilitysettings.downsample_settings`)
+        # and the downsampled settings are passed to the workers by path like any other settings
+        if mob_downsample is not None and mob_downsample != 1:
+            mob_settings = os.path.join(shared_dir, 'settings-downsampled')
+            save_settings(kwargs, mob_settings)
+
+        if mob_pool_size is not None and mob_cache_dir is not None:
+            mob_cache = TraceCache(mob_cache_dir, max_bytes=mob_cache_max_bytes)
+            settings_digest = settings_file_digest(mob_settings)
+            mob_trace_key_list = [TraceCache.key(settings_digest=settings_digest, max_time=max_time,
+                                                 delta=kwargs['delta'], seed=seed,
+                                                 generator='batch' if mob_batch else None)
+                                  for seed in mob_seed_list]
+        else:
+            mob_cache = None
+            mob_trace_key_list = [None for _ in range(random_repeats)]
+        mob_cache_list = [mob_cache for _ in range(random_repeats)]
+
+        worker_settings = mob_settings
+        if mob_shared and not is_binary_settings(mob_settings):
+            worker_settings = os.path.join(shared_dir, 'settings')
+            save_settings(kwargs, worker_settings)
+
+        mob_setting_list = [worker_settings for _ in range(random_repeats)]
+        beacon_config_list = [copy.deepcopy(beacon_config) for _ in range(random_repeats)]
+        distributions_list = [copy.deepcopy(distributions) for _ in range(random_repeats)]
+        measure_list_list = [copy.deepcopy(measure_list) for _ in range(random_repeats)]
+        params_list = [copy.deepcopy(params) for _ in range(random_repeats)]
+        initial_seeds_list = [copy.deepcopy(initial_seeds) for _ in range(random_repeats)]
+        testing_params_list = [copy.deepcopy(testing_params) for _ in range(random_repeats)]
+        thresholds_roc_list = [copy.deepcopy(thresholds_roc) for _ in range(random_repeats)]
+        max_time_list = [copy.deepcopy(max_time) for _ in range(random_repeats)]
+        store_mob_list = [copy.deepcopy(store_mob) for _ in range(random_repeats)]
+        store_measure_bernoullis_list = [copy.deepcopy(store_measure_bernoullis) for _ in range(random_repeats)]
+        mob_window_list = [copy.deepcopy(mob_window) for _ in range(random_repeats)]
+        mob_chunk_dir_list = [mob_chunk_dir for _ in range(random_repeats)]
+        mob_memory_budget_list = [mob_memory_budget for _ in range(random_repeats)]
+        well_mixed_occupancy_list = [well_mixed_occupancy for _ in range(random_repeats)]
+        mob_batch_list = [mob_batch for _ in range(random_repeats)]
+        repeat_ids = list(range(random_repeats))
+
+        if verbose:
+            print('Launching simulations...')
+
+        with ProcessPoolExecutor(cpu_count) as ex:
+            # beacon placement is computed once and shared by all repeats; this runs in a worker,
+            # since forking the pool after using numba's thread pool in this process may deadlock
+            site_has_beacon = ex.submit(compute_site_has_beacon, mob_settings, beacon_config,
+                                        trace_cache=mob_cache).result()
+            site_has_beacon_list = [site_has_beacon for _ in range(random_repeats)]
+
+            # each realization of the trace pool is simulated once, then all repeats memory-map it from the cache
+            if mob_cache is not None:
+                pool_seeds = sorted(set(mob_seed_list))
+                pool_keys = [mob_trace_key_list[mob_seed_list.index(seed)] for seed in pool_seeds]
+                list(ex.map(pp_simulate_traces, [worker_settings] * len(pool_seeds), [max_time] * len(pool_seeds),
+                            pool_seeds, [mob_cache] * len(pool_seeds), pool_keys, [mob_batch] * len(pool_seeds)))
+
+            res = ex.map(pp_launch, repeat_ids, mob_setting_list, beacon_config_list, distributions_list, params_list,
+                         initial_seeds_list, testing_params_list, measure_list_list, max_time_list,
+                         thresholds_roc_list, store_mob_list, store_measure_bernoullis_list, mob_window_list,
+                         mob_seed_list, mob_cache_list, mob_trace_key_list, site_has_beacon_list,
+                         mob_chunk_dir_list, mob_memory_budget_list, well_mixed_occupancy_list, mob_batch_list)
+
+        # # # DEBUG mode (to see errors printed properly)
+        # site_has_beacon_list = [compute_site_has_beacon(mob_settings, beacon_config, trace_cache=mob_cache)
+        #                         for _ in range(random_repeats)]
+        # res = []
+        # for r in repeat_ids:
+        #     res.append(pp_launch(r, mob_setting_list[r], beacon_config_list[r], distributions_list[r], params_list[r],
+        #                  initial_seeds_list[r], testing_params_list[r], measure_list_list[r], 
+        #                  max_time_list[r], thresholds_roc_list[r], store_mob_list[r], store_measure_bernoullis_list[r],
+        #                  mob_window_list[r], mob_seed_list[r], mob_cache_list[r], mob_trace_key_list[r],
+        #                  site_has_beacon_list[r], mob_chunk_dir_list[r], mob_memory_budget_list[r],
+        #                  well_mixed_occupancy_list[r], mob_batch_list[r]))
 
-        num_household_exposures.append(result['num_household_exposures'])
-        num_site_exposures.append(result['num_site_exposures'])
+    
+        # collect all result (the fact that mob is still available here is due to the for loop)
+        summary = ParallelSummary(max_time, random_repeats, num_people, num_sites, site_loc, home_loc, thresholds_roc)
+        num_site_exposures = []
+        num_household_exposures = []
+
+        for r, result in enumerate(res):
+
+            for code in pp_legal_states:
+                summary.state[code][r, :] = result['state'][code]
+                summary.state_started_at[code][r, :] = result['state_started_at'][code]
+                summary.state_ended_at[code][r, :] = result['state_ended_at'][code]
+
+            ml = result['measure_list']
+            summary.measure_list.append(ml)
+
+            if store_mob:
+                summary.mob.append(MobilityReference(
+                    settings=mob_settings_reference,
+                    settings_digest=mob_settings_reference_digest,
+                    downsample=mob_downsample,
+                    seed=result['mob_seed'],
+                    max_time=max_time,
+                    beacon_config=beacon_config,
+                    site_has_beacon=result['site_has_beacon'],
+                    batch=mob_batch))
+
+            summary.people_age[r, :] = result['people_age']
+
+            summary.children_count_iasy[r, :] = result['children_count_iasy']
+            summary.children_count_ipre[r, :] = result['children_count_ipre']
+            summary.children_count_isym[r, :] = result['children_count_isym']
+
+            summary.visit_expo_counts.append(result['visit_expo_counts'])
+
+            for thres in result['tracing_stats'].keys():
+                for sitetype in result['tracing_stats'][thres].keys():
+                    for policy in ['sites', 'no_sites']:
+                        for action in ['isolate', 'test']:
+                            for stat in ['tp', 'fp', 'tn', 'fn']:
+                                summary.tracing_stats[thres][sitetype][policy][action][stat][r] = \
+                                    result['tracing_stats'][thres][sitetype][policy][action][stat]
+                # Transform defaultdict back to dict
+                summary.tracing_stats[thres] = dict(summary.tracing_stats[thres])
+
+            num_household_exposures.append(result['num_household_exposures'])
+            num_site_exposures.append(result['num_site_exposures'])
+
+    finally:
+        if shared_dir is not None:
+            # memory maps of workers are closed
+            shutil.rmtree(shared_dir, ignore_errors=True)
 
     if verbose:
         print('Mean site exposures: ', np.mean(num_site_exposures))
@@ -23,6 +23,7 @@ import matplotlib.colors as colors
 
 from lib.calibrationFunctions import downsample_cases, pdict_to_parr, load_state
 from lib.data import collect_data_from_df
+from lib.mobilitysettings import load_settings
 
 import botorch.utils.transforms as transforms
 
@@ -1297,8 +1298,7 @@ class Plotter(object):
         lockdown_at = (pd.to_datetime(start_date_lockdown) - pd.to_datetime(start_date)).days
 
         mob_settings_paths = calibration_mob_paths[country][area][1]
-        with open(mob_settings_paths, 'rb') as fp:
-            mob_settings = pickle.load(fp)
+        mob_settings = load_settings(mob_settings_paths)
 
         area_cases = collect_data_from_df(country=country,
                                           area=area,
@@ -3019,8 +3019,7 @@ class Plotter(object):
         train_G = state['train_G']
 
         mob_settings = calibration_mob_paths[country][area][1]
-        with open(mob_settings, 'rb') as fp:
-            mob_kwargs = pickle.load(fp)
+        mob_kwargs = load_settings(mob_settings)
 
         data_start_date = calibration_start_dates[country][area]
         data_end_date = calibration_lockdown_dates[country]['end']
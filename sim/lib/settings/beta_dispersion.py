@@ -1,8 +1,18 @@
-from lib.mobilitysim import compute_mean_invariant_beta_multipliers
+import os
+import json
+
+from lib.calibrationSettings import calibration_mob_paths
+from lib.mobilitysettings import load_settings
+from lib.mobilitysim import MobilitySimulator, mean_invariant_beta_multiplier
+from lib.tracecache import settings_file_digest, TRACE_CACHE_VERSION
 
 
 TO_HOURS = 24.0
 
+# bump when `compute_integrated_time_proportion_per_site_type` changes such that the weights of given settings change
+# (weights of simulated traces are also invalidated by `TRACE_CACHE_VERSION`, see `get_site_type_weights`)
+SITE_TYPE_WEIGHTS_VERSION = 1
+
 invariant_beta_multipliers = {
     'GER': {
         'TU': {
@@ -36,7 +46,50 @@ invariant_beta_multipliers = {
     }
 
 
-def get_invariant_beta_multiplier(dispersion_factor, country, area, use_invariant_rescaling=True, verbose=True):
+def get_site_type_weights(country, area, weighting='integrated_contact_time', rollouts=1, max_time=28 * TO_HOURS,
+                          full_scale=True, table_path=None, verbose=True):
+    """
+    Returns the weights per site type used to compute mean invariant beta multipliers
+    (see `MobilitySimulator.compute_integrated_time_proportion_per_site_type`), averaged over `rollouts`
+    mobility simulations with fixed seeds. The weights do not depend on the dispersion factor, so if
+    `table_path` is given, they are stored in the JSON table at `table_path` keyed by (settings content, weighting,
+    rollouts, max_time, versions of the mobility model and of the weights) and only simulated once for a sweep
+    over dispersion factors.
+    """
+    mob_settings_file = calibration_mob_paths[country][area][1 if full_scale else 0]
+    key = json.dumps(dict(settings=settings_file_digest(mob_settings_file), weighting=weighting,
+                          rollouts=int(rollouts), max_time=float(max_time),
+                          version=TRACE_CACHE_VERSION, weights_version=SITE_TYPE_WEIGHTS_VERSION), sort_keys=True)
+
+    table = {}
+    if table_path is not None and os.path.isfile(table_path):
+        with open(table_path, 'r') as fp:
+            table = json.load(fp)
+    if key in table:
+        return table[key]
+
+    if verbose:
+        print(f'Computing site type weights `{weighting}` of {mob_settings_file} over {rollouts} rollouts ...')
+    mob = MobilitySimulator(**load_settings(mob_settings_file))
+    weights = mob.compute_integrated_time_proportion_per_site_type(
+        weighting, rollouts=rollouts, max_time=max_time, seed=0).tolist()
+
+    if table_path is not None:
+        # re-read, since the table may have been extended concurrently, and replace atomically
+        if os.path.isfile(table_path):
+            with open(table_path, 'r') as fp:
+                table = json.load(fp)
+        table[key] = weights
+        os.makedirs(os.path.dirname(os.path.abspath(table_path)), exist_ok=True)
+        tmp = f'{table_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fp:
+            json.dump(table, fp, indent=1)
+        os.replace(tmp, table_path)
+    return weights
+
+
+def get_invariant_beta_multiplier(dispersion_factor, country, area, use_invariant_rescaling=True, verbose=True,
+                                  rollouts=1, table_path=None):
     try:
         beta_multipliers = invariant_beta_multipliers[country][area][dispersion_factor]
     except KeyError:
@@ -51,12 +104,10 @@ def get_invariant_beta_multiplier(dispersion_factor, country, area, use_invarian
             'supermarket': 1.0,
         }
         if use_invariant_rescaling:
-            beta_multipliers = compute_mean_invariant_beta_multipliers(beta_multipliers=beta_multipliers,
-                                                                       country=country, area=area,
-                                                                       max_time=28 * TO_HOURS,
-                                                                       full_scale=True,
-                                                                       weighting='integrated_contact_time',
-                                                                       mode='rescale_all')
+            weights = get_site_type_weights(country=country, area=area, weighting='integrated_contact_time',
+                                            rollouts=rollouts, max_time=28 * TO_HOURS, full_scale=True,
+                                            table_path=table_path, verbose=verbose)
+            beta_multipliers = mean_invariant_beta_multiplier(beta_multipliers, weights, mode='rescale_all')
     if verbose:
         print(f'Using multipliers: {beta_multipliers}')
     return beta_multipliers
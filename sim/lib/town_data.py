@@ -6,6 +6,8 @@ import json
 import geopy.distance
 import requests
 
+from lib.mobilitysettings import sparsify_tile_site_dist, concatenate_sparse_tile_site_dist
+
 TO_HOURS = 24.0
 
 # tile levels and corresponding width (degrees of longitudes)
@@ -340,13 +342,123 @@ def generate_sites(bbox, query_files, site_based_density_file=None):
 
     return site_loc, site_type, site_dict, density_site_loc
 
-def compute_distances(site_loc, tile_loc):
-    
-    # 2D array containing pairwise distances
-    tile_site_dist=np.zeros((len(tile_loc), len(site_loc)))
-    
-    for i_tile, tile in enumerate(tile_loc):
-        for i_site, site in enumerate(site_loc):
-            tile_site_dist[i_tile,i_site]=geopy.distance.distance(tile,site).km
-
-    return tile_site_dist
+# WGS-84 ellipsoid (as used by `geopy.distance.distance`)
+WGS84_A = 6378.137  # semi-major axis in km
+WGS84_F = 1 / 298.257223563  # flattening
+EARTH_MEAN_RADIUS = 6371.0088  # in km
+
+
+def haversine_distances(loc_a, loc_b):
+    """
+    Great-circle distances (in km) on a sphere of radius `EARTH_MEAN_RADIUS` between all pairs
+    of (lat, lon) coordinates in `loc_a` and `loc_b`, returned as array of shape (len(loc_a), len(loc_b)).
+    Deviates from geodesic distances on the WGS-84 ellipsoid by up to about 0.5%.
+    """
+    lat_a, lon_a = np.radians(np.asarray(loc_a, dtype=np.float64).reshape(-1, 2)).T
+    lat_b, lon_b = np.radians(np.asarray(loc_b, dtype=np.float64).reshape(-1, 2)).T
+    dlat = lat_b[None, :] - lat_a[:, None]
+    dlon = lon_b[None, :] - lon_a[:, None]
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat_a)[:, None] * np.cos(lat_b)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_MEAN_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def vincenty_distances(loc_a, loc_b, tol=1e-12, max_iter=200):
+    """
+    Geodesic distances (in km) on the WGS-84 ellipsoid between all pairs of (lat, lon) coordinates
+    in `loc_a` and `loc_b` by Vincenty's inverse formula, returned as array of shape (len(loc_a), len(loc_b)).
+    Agrees with `geopy.distance.distance` (Karney's algorithm) to well below a millimeter
+    except for nearly antipodal points, where the iteration may not converge
+    and the haversine distance is returned instead.
+    """
+    a, f = WGS84_A, WGS84_F
+    b = (1 - f) * a
+    lat_a, lon_a = np.radians(np.asarray(loc_a, dtype=np.float64).reshape(-1, 2)).T
+    lat_b, lon_b = np.radians(np.asarray(loc_b, dtype=np.float64).reshape(-1, 2)).T
+
+    # reduced latitudes
+    u_a = np.arctan((1 - f) * np.tan(lat_a))[:, None]
+    u_b = np.arctan((1 - f) * np.tan(lat_b))[None, :]
+    sin_u_a, cos_u_a = np.sin(u_a), np.cos(u_a)
+    sin_u_b, cos_u_b = np.sin(u_b), np.cos(u_b)
+    L = lon_b[None, :] - lon_a[:, None]
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    for _ in range(max_iter):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cos_u_b * sin_lam) ** 2 + (cos_u_a * sin_u_b - sin_u_a * cos_u_b * cos_lam) ** 2)
+        cos_sigma = sin_u_a * sin_u_b + cos_u_a * cos_u_b * cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        # coincident points have `sin_sigma` = 0
+        sin_alpha = np.divide(cos_u_a * cos_u_b * sin_lam, sin_sigma,
+                              out=np.zeros_like(sin_sigma), where=sin_sigma > 0)
+        cos_sq_alpha = 1 - sin_alpha ** 2
+        # equatorial lines have `cos_sq_alpha` = 0
+        cos_2sigma_m = np.divide(2 * sin_u_a * sin_u_b, cos_sq_alpha,
+                                 out=np.zeros_like(cos_sq_alpha), where=cos_sq_alpha > 0)
+        cos_2sigma_m = np.where(cos_sq_alpha > 0, cos_sigma - cos_2sigma_m, 0.0)
+        C = f / 16 * cos_sq_alpha * (4 + f * (4 - 3 * cos_sq_alpha))
+        lam_prev = lam
+        lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+        converged = np.abs(lam - lam_prev) <= tol
+        if converged.all():
+            break
+
+    u_sq = cos_sq_alpha * (a ** 2 - b ** 2) / b ** 2
+    A = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    B = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    dist = b * A * (sigma - delta_sigma)
+
+    if not converged.all():
+        dist = np.where(converged, dist, haversine_distances(loc_a, loc_b))
+    return dist
+
+
+def compute_distances(site_loc, tile_loc, site_type=None, k=None, radius=None, chunk_size=1024, method='vincenty'):
+    """
+    Computes pairwise distances (in km) between tile centers `tile_loc` and sites `site_loc`
+    given as (lat, lon) coordinates, using `chunk_size` tiles at a time to bound memory.
+
+    The distance `method` is one of
+    - 'vincenty': geodesic distance on the WGS-84 ellipsoid (default, see `vincenty_distances`),
+      which agrees with 'geopy' to below a millimeter
+    - 'haversine': great-circle distance on a sphere, within about 0.5% of 'geopy'
+    - 'geopy': `geopy.distance.distance` of every pair (slow, reference implementation)
+
+    If `k` or `radius` is given, returns the sparse representation `SparseTileSiteDist` keeping only the
+    `k` nearest sites of each type in `site_type` per tile and/or all sites within `radius` km,
+    together with the resulting truncation error (see `lib.mobilitysettings.sparsify_tile_site_dist`).
+    The dense matrix is then never held in memory.
+    """
+    sparse = k is not None or radius is not None
+    if sparse and site_type is None:
+        raise ValueError('`site_type` is required for sparse tile-site distances.')
+
+    def _distances(tiles):
+        if method == 'vincenty':
+            return vincenty_distances(tiles, site_loc)
+        elif method == 'haversine':
+            return haversine_distances(tiles, site_loc)
+        elif method == 'geopy':
+            # 2D array containing pairwise distances
+            tile_site_dist=np.zeros((len(tiles), len(site_loc)))
+
+            for i_tile, tile in enumerate(tiles):
+                for i_site, site in enumerate(site_loc):
+                    tile_site_dist[i_tile,i_site]=geopy.distance.distance(tile,site).km
+
+            return tile_site_dist
+        else:
+            raise ValueError(f'Unknown distance method `{method}`.')
+
+    if not sparse:
+        return np.concatenate([_distances(tile_loc[a:a + chunk_size]) for a in range(0, len(tile_loc), chunk_size)]
+                              or [np.zeros((0, len(site_loc)))])
+
+    blocks = [sparsify_tile_site_dist(_distances(tile_loc[a:a + chunk_size]), site_type=site_type, k=k, radius=radius)
+              for a in range(0, len(tile_loc), chunk_size)]
+    return concatenate_sparse_tile_site_dist(blocks)
@@ -107,7 +107,7 @@ class MapIllustrator():
                                                                 state_resi_started_at=sim.state_started_at['resi'][r, :],
                                                                 state_dead_started_at=sim.state_started_at['dead'][r, :])) and
                      (sim.state_started_at['dead'][r, indiv] > t) and
-                     (len(list(sim.mob[r].list_intervals_in_window_individual_at_site(indiv=indiv, site=site, t0=t, t1=t+TO_HOURS))) > 0) ):
+                     (len(list(sim.get_mob(r).list_intervals_in_window_individual_at_site(indiv=indiv, site=site, t0=t, t1=t+TO_HOURS))) > 0) ):
 
 
 
@@ -122,12 +122,12 @@ class MapIllustrator():
         Computes the empirical survival probability for site ``site'' between t0 and t1
         '''        
         s = 0
-        mob = summary.mob[r]
+        mob = summary.get_mob(r)
         
         for j in range(summary.n_people):
             if ( (summary.state_started_at['posi'][r, j] < t1 + delta) and
                  (summary.state_started_at['posi'][r, j] >= t0 - delta) ):
-                for visit in summary.mob[r].mob_traces[j].find((t0, t1)):
+                for visit in mob.find_visits_of_indiv(j, t0, t1):
                     if visit.t_to > t0 and visit.site == site:
                         # skip if j was contained
                         visit_id = visit.id
@@ -334,6 +334,60 @@ class MapIllustrator():
     
     """
     
+    def site_occupancy_map(self, bbox, site_loc, site_type, site_dict, map_name, mob, t0, t1,
+                           scaling_markersize=0.3):
+        '''
+        Computes the person-hours spent at each site in the interval [t0, t1] from the mobility traces
+        and visualizes them relative to the busiest site with markers of different sizes.
+        Replaces the deprecated `checkin_rate_map`. The map is saved as an html file.
+
+        Parameters
+        ----------
+        bbox : (float, float, float, float)
+            Coordinate bounding box
+        site_loc : list of [float, float]
+            List of site coordinates
+        site_type : list of int
+            List of site type
+        site_dict : dictionary {int : string}
+            Contains site types and their verbal interpretation
+        map_name : string
+            A name for the generated map
+        mob : MobilitySimulator object
+            Simulated mobility traces (e.g. `summary.get_mob(r)`)
+        t0 : float
+            Starting time
+        t1 : float
+            Ending time
+        Returns
+        -------
+        m : MapIllustrator object
+            The generated map
+        '''
+
+        # center map around the given bounding box
+        center = ((bbox[0]+bbox[1])/2,(bbox[2]+bbox[3])/2)
+        m = folium.Map(location=center,tiles=self.tile)
+        m.fit_bounds([(bbox[0],bbox[2]),(bbox[1],bbox[3])])
+
+        # set marker labels as site types
+        labels = [site_dict[site] for site in site_type]
+
+        # compute person-hours per site in a single bin
+        person_hours = mob.site_occupancy(bin_width=t1 - t0, t0=t0, t1=t1).person_hours.sum(axis=1)
+        scale = (person_hours / max(person_hours.max(), 1e-12)).tolist()
+
+        # add sites as markers
+        self._add_markers_with_category(map_obj=m, markers=site_loc, categories=site_type, labels=labels, scale=scale,
+                                        scaling_markersize=scaling_markersize)
+
+        # save map as html
+        if not os.path.exists('maps'):
+            os.mkdir('maps')
+        m.save('maps/'+map_name+'.html')
+
+        return m
+
     def empirical_infection_probability_map(self, bbox, site_loc, site_type, site_dict, map_name, sim, t0, t1, delta,
                                             site_has_beacon, scaling_markersize=0.3, r=0):
         '''
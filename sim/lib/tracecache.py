@@ -0,0 +1,198 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+from lib.mobilitysim import VisitStore
+
+# bump when the mobility model changes such that traces of a given seed change
+TRACE_CACHE_VERSION = 1
+
+# bump when the batch generator changes such that its traces of a given seed change
+# (see `MobilitySimulator.simulate(..., batch=True)`)
+BATCH_TRACE_CACHE_VERSION = 1
+
+
+def settings_file_digest(settings_file):
+    """Returns SHA-256 hex digest of the content of the mobility settings file `settings_file`,
+    or of all files of a settings directory (see `lib.mobilitysettings`)"""
+    if os.path.isdir(settings_file):
+        files = [os.path.join(settings_file, f) for f in sorted(os.listdir(settings_file))]
+    else:
+        files = [settings_file]
+    h = hashlib.sha256()
+    for file in files:
+        with open(file, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 24), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+class TraceCache(object):
+    """
+    Content-addressed on-disk cache of simulated mobility traces (`VisitStore`s) and
+    other arrays derived from mobility rollouts, e.g. beacon placements.
+
+    An entry is a directory of `.npy` files named by the hash of everything the traces depend on,
+    i.e. the content of the mobility settings file, `max_time`, `delta` and the random seed.
+    Entries are memory-mapped read-only when loaded, so processes using the same traces share
+    the pages. Entries are written to a temporary directory first and renamed atomically,
+    hence several processes may use the same cache directory concurrently.
+
+    If `max_bytes` is given, the least recently used entries are evicted whenever storing
+    a new entry makes the cache exceed `max_bytes`.
+    """
+
+    def __init__(self, root, max_bytes=None):
+        """
+        root : str
+            Cache directory
+        max_bytes : int (optional, default: None)
+            Maximum total size of the cache in bytes; unbounded if None
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(*, settings_digest, max_time, delta, seed, generator=None):
+        """
+        Returns cache key of the traces of a mobility simulation
+
+        Parameters
+        ----------
+        settings_digest : str
+            Digest of the mobility settings file, see `settings_file_digest`
+        max_time : float
+            Simulated time horizon
+        delta : float
+            Time delta of contacts (affects `t_to_shifted` of visits)
+        seed : int
+            Random seed of the mobility simulation
+        generator : str (optional, default: None)
+            'batch' for traces of the batch generator, which differ from the ones of the
+            per-individual streams for the same seed; None for the per-individual streams
+        """
+        description = dict(
+            version=TRACE_CACHE_VERSION,
+            settings=settings_digest,
+            max_time=float(max_time),
+            delta=float(delta),
+            seed=int(seed))
+        if generator == 'batch':
+            description.update(generator=generator, generator_version=BATCH_TRACE_CACHE_VERSION)
+        elif generator is not None:
+            raise ValueError(f'Unknown trace generator `{generator}`.')
+        description = json.dumps(description, sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    @staticmethod
+    def beacon_key(*, settings_digest, beacon_config, seed, rollouts, max_time):
+        """
+        Returns cache key of a beacon placement (see `MobilitySimulator.place_beacons`)
+
+        Parameters
+        ----------
+        settings_digest : str
+            Digest of the mobility settings file, see `settings_file_digest`
+        beacon_config : dict
+            Beacons implementation configuration
+        seed : int
+            Random seed of the mobility rollouts used for placement
+        rollouts : int
+            Number of mobility rollouts used for placement
+        max_time : float
+            Simulated time horizon of each rollout
+        """
+        description = json.dumps(dict(
+            version=TRACE_CACHE_VERSION,
+            kind='beacons',
+            settings=settings_digest,
+            beacon_config=beacon_config,
+            seed=int(seed),
+            rollouts=int(rollouts),
+            max_time=float(max_time)), sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key):
+        """Returns memory-mapped `VisitStore` of entry `key`, or None if it is not in the cache"""
+        path = self._path(key)
+        try:
+            visits = VisitStore.load(path, mmap_mode='r')
+            # access time is tracked via the modification time of the entry (`atime` is often disabled)
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            # missing, or evicted/partially removed concurrently
+            return None
+        return visits
+
+    def store(self, key, visits):
+        """Stores `VisitStore` `visits` as entry `key` and evicts old entries if needed"""
+        path = self._path(key)
+        if os.path.isdir(path):
+            os.utime(path)
+            return
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            visits.save(tmp)
+            os.rename(tmp, path)
+        except OSError:
+            # entry was stored concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def load_array(self, key):
+        """Returns array of entry `key` stored with `store_array`, or None if it is not in the cache"""
+        path = self._path(key)
+        try:
+            array = np.load(os.path.join(path, 'array.npy'))
+            os.utime(path)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        return array
+
+    def store_array(self, key, array):
+        """Stores a single (small) array, e.g. a beacon placement, as entry `key`"""
+        path = self._path(key)
+        if os.path.isdir(path):
+            os.utime(path)
+            return
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.root)
+        try:
+            np.save(os.path.join(tmp, 'array.npy'), array)
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """Returns list of (last access time, size in bytes, key) of all entries"""
+        entries = []
+        for key in os.listdir(self.root):
+            path = self._path(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, key))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self):
+        """Removes least recently used entries until the cache size is at most `max_bytes`"""
+        if self.max_bytes is None:
+            return
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            # memory-mapped files of processes still using the entry remain valid after removal
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
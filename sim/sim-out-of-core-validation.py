@@ -0,0 +1,138 @@
+import sys
+import time
+
+if '..' not in sys.path:
+    sys.path.append('..')
+
+import copy
+import argparse
+import tempfile
+import random as rd
+import numpy as np
+from lib.measures import *
+from lib.mobilitysim import MobilitySimulator, VisitStore
+from lib.dynamics import DiseaseModel
+from lib.distributions import CovidDistributions
+from lib.calibrationSettings import calibration_testing_params
+
+TO_HOURS = 24.0
+
+
+def run(max_time, mob_seed, epi_seed, mob_kwargs, window=None, chunk_dir=None, memory_budget=None):
+    """Simulates mobility in streaming mode (out-of-core if `chunk_dir` is given) and an epidemic with
+    contact tracing on it. Returns the `DiseaseModel` and the peak number of bytes of resident chunks
+    and of the chunks needed by a single query (both 0 if not out-of-core)."""
+
+    mob = MobilitySimulator(**mob_kwargs, seed=mob_seed)
+    mob.simulate(max_time=max_time, seed=mob_seed, window=window, chunk_dir=chunk_dir, memory_budget=memory_budget)
+
+    # record the resident chunks after every query of the out-of-core store
+    peak = dict(resident=0, needed=0)
+    if chunk_dir is not None:
+        chunks = mob.visits.chunks
+
+        def recorded_chunks(t0, t1):
+            stores = chunks(t0, t1)
+            needed = sum(getattr(visits, name).nbytes for visits in stores for name in VisitStore._arrays)
+            peak['resident'] = max(peak['resident'], mob.visits.resident_bytes)
+            peak['needed'] = max(peak['needed'], needed)
+            return stores
+
+        mob.visits.chunks = recorded_chunks
+
+    testing_params = copy.deepcopy(calibration_testing_params)
+    testing_params['testing_t_window'] = [0.0, max_time]
+    testing_params['smart_tracing_actions'] = ['isolate', 'test']
+    testing_params['smart_tracing_policy_isolate'] = 'advanced'
+    testing_params['smart_tracing_isolated_contacts'] = 100
+    testing_params['smart_tracing_policy_test'] = 'advanced'
+    testing_params['smart_tracing_tested_contacts'] = 100
+
+    measure_list = MeasureList([
+        SocialDistancingForPositiveMeasure(t_window=Interval(0.0, max_time), p_stay_home=1.0),
+        SocialDistancingForSmartTracing(t_window=Interval(0.0, max_time), p_stay_home=1.0,
+                                        smart_tracing_isolation_duration=TO_HOURS * 14.0),
+        ComplianceForAllMeasure(t_window=Interval(0.0, max_time), p_compliance=0.8),
+    ])
+
+    # the epidemic draws from the global random state, which is seeded identically for every run
+    np.random.seed(epi_seed)
+    rd.seed(epi_seed)
+    sim = DiseaseModel(mob, CovidDistributions(country='GER'))
+    sim.launch_epidemic(
+        params={'betas': {site_type: 0.1 for site_type in mob.site_dict.values()}, 'beta_household': 0.0},
+        initial_counts={'expo': 10, 'iasy': 5, 'ipre': 5},
+        testing_params=testing_params,
+        measure_list=measure_list,
+        thresholds_roc=[],
+        verbose=False)
+
+    if chunk_dir is not None:
+        mob.visits.close()
+    return sim, peak
+
+
+if __name__ == '__main__':
+
+    # Validates out-of-core mobility (see `MobilitySimulator.simulate(..., chunk_dir=...)`): on a synthetic town
+    # whose visits take several times the memory budget, the resident chunks stay within the budget
+    # (up to the chunks needed by a single query), and exposures and states of an epidemic with contact tracing
+    # are identical to the ones of in-memory streaming mode (`window` only) with the same seeds.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_people", type=int, default=1000)
+    parser.add_argument("--num_sites", type=int, default=100)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--budget_fraction", type=float, default=0.25,
+                        help="memory budget as fraction of the size of all visits")
+    parser.add_argument("--chunk_dir", type=str, help="directory of the chunks (temporary directory if not given)")
+    args = parser.parse_args()
+
+    max_time = TO_HOURS * args.days
+    mob_seed, epi_seed = 1, 2
+    distributions = CovidDistributions(country='GER')
+    mob_kwargs = dict(
+        num_people=args.num_people,
+        num_sites=args.num_sites,
+        mob_rate_per_type=[0.2, 0.2, 0.2, 0.2, 0.2],
+        dur_mean=0.5,
+        num_age_groups=len(distributions.fatality_rates_by_age),
+        delta=distributions.delta)
+
+    # size of all visits if held in memory at once
+    mob = MobilitySimulator(**mob_kwargs, seed=mob_seed)
+    mob.simulate(max_time=max_time, seed=mob_seed)
+    full_bytes = sum(getattr(mob.visits, name).nbytes for name in VisitStore._arrays)
+    memory_budget = int(args.budget_fraction * full_bytes)
+    print(f'{len(mob.visits)} visits of {full_bytes / 1e6:.1f} MB, memory budget {memory_budget / 1e6:.1f} MB')
+    del mob
+
+    t0 = time.time()
+    streamed, _ = run(max_time, mob_seed, epi_seed, mob_kwargs, window=TO_HOURS)
+    runtime_streamed = time.time() - t0
+
+    with tempfile.TemporaryDirectory(dir=args.chunk_dir) as chunk_dir:
+        t0 = time.time()
+        chunked, peak = run(max_time, mob_seed, epi_seed, mob_kwargs, chunk_dir=chunk_dir, memory_budget=memory_budget)
+        runtime_chunked = time.time() - t0
+
+    print(f'peak resident chunks {peak["resident"] / 1e6:.1f} MB, '
+          f'peak chunks needed by a query {peak["needed"] / 1e6:.1f} MB')
+    print(f'runtime streaming {runtime_streamed:.1f}s, out-of-core {runtime_chunked:.1f}s')
+
+    # chunks beyond the budget are only kept while needed by the current query, which spans
+    # at most the infectious period or the tracing window (see `smart_tracing_contact_delta`)
+    assert peak['resident'] <= max(memory_budget, peak['needed']), 'resident chunks exceed memory budget'
+    assert peak['resident'] < full_bytes / 2, 'resident chunks are not bounded'
+
+    for state in streamed.state:
+        assert np.array_equal(streamed.state[state], chunked.state[state]), f'state `{state}` differs'
+        assert np.array_equal(streamed.state_started_at[state], chunked.state_started_at[state]), \
+            f'start times of state `{state}` differ'
+    assert streamed.num_site_exposures == chunked.num_site_exposures, 'site exposures differ'
+    assert streamed.num_household_exposures == chunked.num_household_exposures, 'household exposures differ'
+    assert streamed.visit_expo_counts.keys() == chunked.visit_expo_counts.keys() and all(
+        np.array_equal(streamed.visit_expo_counts[k], chunked.visit_expo_counts[k])
+        for k in streamed.visit_expo_counts), 'exposures at visits differ'
+
+    num_expo = int(np.sum(chunked.state_started_at['expo'] < np.inf))
+    print(f'{num_expo} exposures ({chunked.num_site_exposures} at sites), identical to streaming mode.')
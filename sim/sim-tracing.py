@@ -86,6 +86,15 @@ if __name__ == '__main__':
         cpu_count=cpu_count,
         full_scale=full_scale,
         verbose=verbose,
+        mob_pool_size=args.mob_pool_size,
+        mob_cache_dir=args.mob_cache_dir,
+        mob_cache_max_bytes=int(args.mob_cache_max_gb * 1e9) if args.mob_cache_max_gb else None,
+        mob_shared=args.mob_shared,
+        mob_chunk_dir=args.mob_chunk_dir,
+        mob_memory_budget=int(args.mob_memory_budget_gb * 1e9) if args.mob_memory_budget_gb else None,
+        mob_batch=args.mob_batch,
+        well_mixed_occupancy=args.well_mixed_occupancy,
+        mob_downsample=args.downsample,
     )
 
     # contact tracing experiment for various options
@@ -0,0 +1,126 @@
+import sys
+import time
+
+if '..' not in sys.path:
+    sys.path.append('..')
+
+import random as rd
+import pandas as pd
+from lib.measures import *
+from lib.experiment import Experiment, options_to_str, process_command_line
+from lib.calibrationSettings import calibration_lockdown_dates, calibration_start_dates, \
+    calibration_mobility_reduction, calibration_lockdown_site_closures
+from lib.calibrationFunctions import get_calibrated_params, get_calibrated_params_from_path
+from lib.summary import load_condensed_summary
+from lib.mobilitysettings import load_settings
+
+TO_HOURS = 24.0
+
+if __name__ == '__main__':
+
+    # command line parsing
+    args = process_command_line()
+    country = args.country
+    area = args.area
+    cpu_count = args.cpu_count
+
+    name = 'well-mixed-validation'
+    random_repeats = 48
+    # the bundled towns are downscaled
+    full_scale = False
+    verbose = True
+    seed_summary_path = None
+    set_initial_seeds_to = None
+    condensed_summary = True
+
+    # sites with at least this mean number of concurrent visitors are simulated as well-mixed
+    well_mixed_occupancies = [args.well_mixed_occupancy] if args.well_mixed_occupancy else [2.0, 5.0]
+
+    # seed
+    c = 0
+    np.random.seed(c)
+    rd.seed(c)
+
+    if args.smoke_test:
+        random_repeats = 1
+        well_mixed_occupancies = well_mixed_occupancies[:1]
+
+    # set simulation and intervention dates as in the validation experiment
+    start_date = calibration_start_dates[country][area]
+    end_date = calibration_lockdown_dates[country]['end']
+    measure_start_date = calibration_lockdown_dates[country]['start']
+    measure_window_in_hours = dict()
+    measure_window_in_hours['start'] = (pd.to_datetime(measure_start_date) - pd.to_datetime(
+        start_date)).days * TO_HOURS
+    measure_window_in_hours['end'] = (pd.to_datetime(end_date) - pd.to_datetime(start_date)).days * TO_HOURS
+
+    if not args.calibration_state:
+        calibrated_params = get_calibrated_params(country=country, area=area)
+    else:
+        calibrated_params = get_calibrated_params_from_path(args.calibration_state)
+        print('Loaded non-standard calibration state.')
+
+    p_stay_home_dict_mobility_reduced = calibration_mobility_reduction[country][area]
+    p_stay_home_dict_closures = {site_type: 1.0 for site_type in calibration_lockdown_site_closures}
+    p_stay_home_dict = {**p_stay_home_dict_closures, **p_stay_home_dict_mobility_reduced}
+
+    # every mode is run as separate experiment to measure its runtime
+    runtimes, summaries = dict(), dict()
+    for well_mixed_occupancy in [None] + well_mixed_occupancies:
+
+        mode = 'exact' if well_mixed_occupancy is None else f'well-mixed={well_mixed_occupancy}'
+        experiment_info = f'{name}-{area}-{mode}'
+        experiment = Experiment(
+            experiment_info=experiment_info,
+            start_date=start_date,
+            end_date=end_date,
+            random_repeats=random_repeats,
+            cpu_count=cpu_count,
+            full_scale=full_scale,
+            verbose=verbose,
+            well_mixed_occupancy=well_mixed_occupancy,
+        )
+
+        m = [
+            SocialDistancingBySiteTypeForAllMeasure(
+                    t_window=Interval(
+                        measure_window_in_hours['start'],
+                        measure_window_in_hours['end']),
+                    p_stay_home_dict=p_stay_home_dict),
+            ]
+
+        sim_info = options_to_str(validation_region=area)
+
+        experiment.add(
+            simulation_info=sim_info,
+            country=country,
+            area=area,
+            measure_list=m,
+            seed_summary_path=seed_summary_path,
+            set_calibrated_params_to=calibrated_params,
+            set_initial_seeds_to=set_initial_seeds_to,
+            full_scale=full_scale)
+
+        print(f'{experiment_info} configuration done.')
+
+        # execute all simulations
+        t0 = time.time()
+        experiment.run_all()
+        runtimes[mode] = time.time() - t0
+
+        sim = experiment.sims[0]
+        summaries[mode] = load_condensed_summary(experiment.get_sim_path(sim) + '.pk')
+        num_people = len(load_settings(sim.mob_settings_file)['home_loc'])
+
+    # compare attack rates, i.e. proportion of the population infected until the end, with the exact mode
+    print(f'\nAttack rates in {country}-{area} ({random_repeats} random repeats)')
+    exact = summaries['exact']
+    for mode, data in summaries.items():
+        attack_mu = data['cumu_infected_mu'][-1] / num_people
+        attack_sig = data['cumu_infected_sig'][-1] / num_people
+        diff = (data['cumu_infected_mu'][-1] - exact['cumu_infected_mu'][-1]) / num_people
+        stderr = np.sqrt(data['cumu_infected_sig'][-1] ** 2 + exact['cumu_infected_sig'][-1] ** 2) \
+            / np.sqrt(random_repeats) / num_people
+        print(f'{mode:>20}: {100 * attack_mu:6.2f}% +- {100 * attack_sig:5.2f}% '
+              f'| difference to exact {100 * diff:+6.2f}% (stderr {100 * stderr:5.2f}%) '
+              f'| runtime {runtimes[mode]:8.1f}s ({runtimes[mode] / runtimes["exact"]:.2f}x)')